@@ -10,13 +10,35 @@ from typing import Any
 
 import voluptuous as vol
 from homeassistant.components.http import StaticPathConfig
-from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant, ServiceCall
+from homeassistant.config_entries import (
+    SOURCE_IGNORE,
+    ConfigEntry,
+    ConfigEntryState,
+)
+from homeassistant.core import (
+    HomeAssistant,
+    ServiceCall,
+    ServiceResponse,
+    SupportsResponse,
+)
+from homeassistant.exceptions import ServiceValidationError
 from homeassistant.helpers import entity_registry as er
 
-from .const import DOMAIN, PLATFORMS, PK_PARAMETERS, resolve_model_key
+from .const import (
+    DOMAIN,
+    ESTERS,
+    METHODS,
+    PLATFORMS,
+    PK_PARAMETERS,
+    TARGET_TROUGH,
+    resolve_model_key,
+)
 from .coordinator import EstrannaisCoordinator
-from .database import EstrannaisDatabase
+from .database import WRITE_QUEUE_MAX_BATCH, EstrannaisDatabase
+from .hub import EstrannaisHub
+from .refresh import EstrannaisRefreshScheduler, EstrannaisStartupBarrier
+from .regimen_simulator import DEFAULT_LIMIT, async_simulate_regimens
+from .retention import EstrannaisRetentionManager
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -25,26 +47,50 @@ _VALID_SERVICE_MODELS = [
     k for k in PK_PARAMETERS
 ] + ["patch"]
 
+_DOSE_FIELDS = {
+    vol.Required("model"): vol.In(_VALID_SERVICE_MODELS),
+    vol.Required("dose_mg"): vol.All(vol.Coerce(float), vol.Range(min=0.01)),
+    vol.Optional("timestamp"): vol.All(
+        vol.Coerce(float), vol.Range(min=1577836800, max=4102444800)
+    ),
+}
+
+_BLOOD_TEST_FIELDS = {
+    vol.Required("level_pg_ml"): vol.All(vol.Coerce(float), vol.Range(min=0)),
+    vol.Optional("timestamp"): vol.All(
+        vol.Coerce(float), vol.Range(min=1577836800, max=4102444800)
+    ),
+    vol.Optional("notes"): str,
+    vol.Optional("on_schedule"): bool,
+}
+
 SERVICE_LOG_DOSE_SCHEMA = vol.Schema(
+    {vol.Required("entity_id"): str, **_DOSE_FIELDS}
+)
+
+SERVICE_LOG_BLOOD_TEST_SCHEMA = vol.Schema(
+    {vol.Required("entity_id"): str, **_BLOOD_TEST_FIELDS}
+)
+
+# Bulk variants: every item is committed in one transaction, so a call
+# holds at most one write-queue batch
+SERVICE_LOG_DOSES_SCHEMA = vol.Schema(
     {
         vol.Required("entity_id"): str,
-        vol.Required("model"): vol.In(_VALID_SERVICE_MODELS),
-        vol.Required("dose_mg"): vol.All(vol.Coerce(float), vol.Range(min=0.01)),
-        vol.Optional("timestamp"): vol.All(
-            vol.Coerce(float), vol.Range(min=1577836800, max=4102444800)
+        vol.Required("doses"): vol.All(
+            [vol.Schema(_DOSE_FIELDS)],
+            vol.Length(min=1, max=WRITE_QUEUE_MAX_BATCH),
         ),
     }
 )
 
-SERVICE_LOG_BLOOD_TEST_SCHEMA = vol.Schema(
+SERVICE_LOG_BLOOD_TESTS_SCHEMA = vol.Schema(
     {
         vol.Required("entity_id"): str,
-        vol.Required("level_pg_ml"): vol.All(vol.Coerce(float), vol.Range(min=0)),
-        vol.Optional("timestamp"): vol.All(
-            vol.Coerce(float), vol.Range(min=1577836800, max=4102444800)
+        vol.Required("blood_tests"): vol.All(
+            [vol.Schema(_BLOOD_TEST_FIELDS)],
+            vol.Length(min=1, max=WRITE_QUEUE_MAX_BATCH),
         ),
-        vol.Optional("notes"): str,
-        vol.Optional("on_schedule"): bool,
     }
 )
 
@@ -68,6 +114,25 @@ SERVICE_CLEAR_DATA_SCHEMA = vol.Schema(
     }
 )
 
+SERVICE_SIMULATE_REGIMENS_SCHEMA = vol.Schema(
+    {
+        vol.Optional("esters"): [vol.In(list(ESTERS))],
+        vol.Optional("methods"): [vol.In(list(METHODS))],
+        vol.Optional("doses_mg"): [
+            vol.All(vol.Coerce(float), vol.Range(min=0.01))
+        ],
+        vol.Optional("intervals_days"): [
+            vol.All(vol.Coerce(float), vol.Range(min=0.25, max=90))
+        ],
+        vol.Optional("target_type", default="target_range"): vol.In(
+            list(TARGET_TROUGH)
+        ),
+        vol.Optional("limit", default=DEFAULT_LIMIT): vol.All(
+            vol.Coerce(int), vol.Range(min=1, max=500)
+        ),
+    }
+)
+
 
 def _get_coordinator(
     hass: HomeAssistant, entity_id: str
@@ -86,16 +151,56 @@ def _get_coordinator(
     return coordinator
 
 
+def _resolve_service_model(coord: EstrannaisCoordinator, model: str) -> str:
+    """Resolve the service model "patch" to the entry's internal model key."""
+    if model != "patch":
+        return model
+    cfg = coord._get_config()
+    return resolve_model_key("E", "patch", cfg["interval_days"]) or "patch tw"
+
+
 async def _refresh_all_coordinators(hass: HomeAssistant) -> None:
-    """Refresh all estrannaise coordinators after a data change."""
+    """Refresh all estrannaise coordinators after a data change.
+
+    Called by the refresh scheduler, which debounces the requests; it
+    refreshes directly rather than through each coordinator's own
+    request debouncer.
+    """
     for key, val in list(hass.data.get(DOMAIN, {}).items()):
         if isinstance(val, EstrannaisCoordinator):
             try:
-                await val.async_request_refresh()
+                await val.async_refresh()
             except Exception:  # noqa: BLE001
                 _LOGGER.exception("Failed to refresh coordinator %s", key)
 
 
+def _schedule_refresh(hass: HomeAssistant) -> None:
+    """Request a (debounced) refresh of all estrannaise coordinators."""
+    refresher = hass.data.get(DOMAIN, {}).get("refresher")
+    if refresher is not None:
+        refresher.async_schedule()
+
+
+async def _persist_all_pending(hass: HomeAssistant) -> None:
+    """Write every coordinator's pending changes before their first refresh."""
+    now = time.time()
+    for key, val in list(hass.data.get(DOMAIN, {}).items()):
+        if isinstance(val, EstrannaisCoordinator):
+            try:
+                await val.async_persist_pending(now)
+            except Exception:  # noqa: BLE001
+                _LOGGER.exception("Failed to persist doses for %s", key)
+
+
+def _retention_days(hass: HomeAssistant) -> dict[str, float]:
+    """Minimum dose retention (days) for every loaded entry."""
+    return {
+        val.config_entry.entry_id: val.retention_days()
+        for val in hass.data.get(DOMAIN, {}).values()
+        if isinstance(val, EstrannaisCoordinator)
+    }
+
+
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Set up Estrannaise from a config entry."""
     hass.data.setdefault(DOMAIN, {})
@@ -124,19 +229,37 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         hass.data[DOMAIN]["_setup_lock"] = asyncio.Lock()
     setup_lock: asyncio.Lock = hass.data[DOMAIN]["_setup_lock"]
 
+    # Entries set up together (HA startup) hold their first refreshes
+    # until all have registered, so the shared model is computed once
+    # instead of once per entry
+    if "startup_barrier" not in hass.data[DOMAIN]:
+        hass.data[DOMAIN]["startup_barrier"] = EstrannaisStartupBarrier(
+            {
+                other.entry_id
+                for other in hass.config_entries.async_entries(DOMAIN)
+                if other.disabled_by is None
+                and other.source != SOURCE_IGNORE
+                and other.state
+                in (ConfigEntryState.NOT_LOADED, ConfigEntryState.SETUP_IN_PROGRESS)
+            }
+            | {entry.entry_id},
+            lambda: _persist_all_pending(hass),
+        )
+    barrier: EstrannaisStartupBarrier = hass.data[DOMAIN]["startup_barrier"]
+
+    try:
+        async with setup_lock:
+            coordinator = await _async_register_entry(hass, entry)
+    except Exception:
+        # Don't keep the other entries waiting for this one
+        barrier.async_depart(entry.entry_id)
+        hass.data[DOMAIN].pop(entry.entry_id, None)
+        raise
+
+    # Outside the lock, so the other entries can register meanwhile
+    at_startup = await barrier.async_arrive(entry.entry_id)
+
     async with setup_lock:
-        # Open / reuse database
-        if "database" not in hass.data[DOMAIN]:
-            db_path = Path(hass.config.config_dir) / "estrannaise.db"
-            database = EstrannaisDatabase(db_path)
-            await database.async_setup()
-            hass.data[DOMAIN]["database"] = database
-        else:
-            database = hass.data[DOMAIN]["database"]
-
-        # Create coordinator (store before first refresh so _get_all_entry_configs works)
-        coordinator = EstrannaisCoordinator(hass, entry, database)
-        hass.data[DOMAIN][entry.entry_id] = coordinator
         await coordinator.async_config_entry_first_refresh()
 
     # Forward to entity platforms
@@ -150,36 +273,94 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         _register_services(hass)
         hass.data[DOMAIN]["services_registered"] = True
 
-    # Refresh ALL coordinators so existing entries immediately pick up
-    # the new entry in their all_configs (otherwise they wait 5 min)
-    await _refresh_all_coordinators(hass)
+    # Refresh ALL coordinators so existing entries pick up the new entry
+    # in their all_configs (otherwise they wait 5 min); entries that came
+    # through the startup barrier already saw each other
+    if not at_startup:
+        _schedule_refresh(hass)
 
     return True
 
 
+async def _async_register_entry(
+    hass: HomeAssistant, entry: ConfigEntry
+) -> EstrannaisCoordinator:
+    """Open the shared database if needed and register the entry's coordinator.
+
+    Called with the setup lock held.
+    """
+    # Open / reuse database
+    if "database" not in hass.data[DOMAIN]:
+        db_path = Path(hass.config.config_dir) / "estrannaise.db"
+        database = EstrannaisDatabase(db_path)
+        await database.async_setup()
+        # Writes are committed in batches, and the refreshes they ask
+        # for are debounced across batches
+        refresher = EstrannaisRefreshScheduler(
+            hass, lambda: _refresh_all_coordinators(hass)
+        )
+        database.add_flush_listener(refresher.async_schedule)
+        hass.data[DOMAIN]["refresher"] = refresher
+        hass.data[DOMAIN]["database"] = database
+        hass.data[DOMAIN]["hub"] = EstrannaisHub(hass, database)
+        # Stale doses are archived and the file compacted in the
+        # background, not on every refresh
+        retention = EstrannaisRetentionManager(
+            hass, database, lambda: _retention_days(hass)
+        )
+        retention.start()
+        hass.data[DOMAIN]["retention"] = retention
+    else:
+        database = hass.data[DOMAIN]["database"]
+    hub = hass.data[DOMAIN]["hub"]
+
+    # Create coordinator (store before first refresh so _get_all_entry_configs works)
+    coordinator = EstrannaisCoordinator(hass, entry, database, hub)
+    hass.data[DOMAIN][entry.entry_id] = coordinator
+    # New rows are written to the entry's profile; rows stored under a
+    # previous profile move with it
+    await database.async_set_entry_profile(
+        entry.entry_id, coordinator._get_config()["profile"]
+    )
+    return coordinator
+
+
 def _register_services(hass: HomeAssistant) -> None:
-    """Register estrannaise services."""
+    """Register estrannaise services.
+
+    Dose and blood test writes go through the database's write queue:
+    calls made within one flush window share a commit, and the flush
+    listener asks the refresh scheduler for one debounced refresh.  The
+    bulk services (log_doses, log_blood_tests) commit their whole list in
+    one transaction.
+    """
 
     async def handle_log_dose(call: ServiceCall) -> None:
         coord = _get_coordinator(hass, call.data["entity_id"])
         entry_id = coord.config_entry.entry_id
-        model = call.data["model"]
         ts = call.data.get("timestamp", time.time())
-
-        # Resolve "patch" to internal model key
-        if model == "patch":
-            cfg = coord._get_config()
-            resolved = resolve_model_key("E", "patch", cfg["interval_days"])
-            model = resolved or "patch tw"
-
         await coord.database.add_dose(
             config_entry_id=entry_id,
-            model=model,
+            model=_resolve_service_model(coord, call.data["model"]),
             dose_mg=call.data["dose_mg"],
             timestamp=ts,
             source="manual",
         )
-        await _refresh_all_coordinators(hass)
+
+    async def handle_log_doses(call: ServiceCall) -> None:
+        coord = _get_coordinator(hass, call.data["entity_id"])
+        now = time.time()
+        await coord.database.add_doses(
+            coord.config_entry.entry_id,
+            [
+                (
+                    _resolve_service_model(coord, dose["model"]),
+                    dose["dose_mg"],
+                    dose.get("timestamp", now),
+                )
+                for dose in call.data["doses"]
+            ],
+        )
 
     async def handle_log_blood_test(call: ServiceCall) -> None:
         coord = _get_coordinator(hass, call.data["entity_id"])
@@ -192,24 +373,52 @@ def _register_services(hass: HomeAssistant) -> None:
             notes=call.data.get("notes"),
             on_schedule=call.data.get("on_schedule"),
         )
-        await _refresh_all_coordinators(hass)
+
+    async def handle_log_blood_tests(call: ServiceCall) -> None:
+        coord = _get_coordinator(hass, call.data["entity_id"])
+        now = time.time()
+        await coord.database.add_blood_tests(
+            coord.config_entry.entry_id,
+            [
+                (
+                    test["level_pg_ml"],
+                    test.get("timestamp", now),
+                    test.get("notes"),
+                    test.get("on_schedule"),
+                )
+                for test in call.data["blood_tests"]
+            ],
+        )
 
     async def handle_delete_dose(call: ServiceCall) -> None:
         coord = _get_coordinator(hass, call.data["entity_id"])
         entry_id = coord.config_entry.entry_id
         await coord.database.delete_dose(entry_id, call.data["dose_id"])
-        await _refresh_all_coordinators(hass)
 
     async def handle_delete_blood_test(call: ServiceCall) -> None:
         coord = _get_coordinator(hass, call.data["entity_id"])
         entry_id = coord.config_entry.entry_id
         await coord.database.delete_blood_test(entry_id, call.data["test_id"])
-        await _refresh_all_coordinators(hass)
 
     async def handle_clear_data(call: ServiceCall) -> None:
         coord = _get_coordinator(hass, call.data["entity_id"])
         await coord.database.clear_all_data()
-        await _refresh_all_coordinators(hass)
+        _schedule_refresh(hass)
+
+    async def handle_simulate_regimens(call: ServiceCall) -> ServiceResponse:
+        try:
+            return await async_simulate_regimens(
+                hass,
+                esters=call.data.get("esters"),
+                methods=call.data.get("methods"),
+                doses_mg=call.data.get("doses_mg"),
+                intervals_days=call.data.get("intervals_days"),
+                target_type=call.data["target_type"],
+                limit=call.data["limit"],
+            )
+        except ValueError as err:
+            # The requested grid is too large: a user error, not a failure
+            raise ServiceValidationError(str(err)) from err
 
     hass.services.async_register(
         DOMAIN, "log_dose", handle_log_dose, schema=SERVICE_LOG_DOSE_SCHEMA
@@ -220,6 +429,15 @@ def _register_services(hass: HomeAssistant) -> None:
         handle_log_blood_test,
         schema=SERVICE_LOG_BLOOD_TEST_SCHEMA,
     )
+    hass.services.async_register(
+        DOMAIN, "log_doses", handle_log_doses, schema=SERVICE_LOG_DOSES_SCHEMA
+    )
+    hass.services.async_register(
+        DOMAIN,
+        "log_blood_tests",
+        handle_log_blood_tests,
+        schema=SERVICE_LOG_BLOOD_TESTS_SCHEMA,
+    )
     hass.services.async_register(
         DOMAIN,
         "delete_dose",
@@ -238,6 +456,13 @@ def _register_services(hass: HomeAssistant) -> None:
         handle_clear_data,
         schema=SERVICE_CLEAR_DATA_SCHEMA,
     )
+    hass.services.async_register(
+        DOMAIN,
+        "simulate_regimens",
+        handle_simulate_regimens,
+        schema=SERVICE_SIMULATE_REGIMENS_SCHEMA,
+        supports_response=SupportsResponse.ONLY,
+    )
 
 
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
@@ -252,12 +477,20 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         for eid, val in hass.data[DOMAIN].items()
         if isinstance(val, EstrannaisCoordinator)
     ]
+    if not remaining and "refresher" in hass.data[DOMAIN]:
+        hass.data[DOMAIN].pop("refresher").stop()
+    if not remaining:
+        hass.data[DOMAIN].pop("startup_barrier", None)
+    if not remaining and "hub" in hass.data[DOMAIN]:
+        hass.data[DOMAIN].pop("hub").close()
+    if not remaining and "retention" in hass.data[DOMAIN]:
+        hass.data[DOMAIN].pop("retention").stop()
     if not remaining and "database" in hass.data[DOMAIN]:
         db: EstrannaisDatabase = hass.data[DOMAIN].pop("database")
         await db.async_close()
     elif remaining:
         # Refresh remaining coordinators so they drop the removed entry
-        await _refresh_all_coordinators(hass)
+        _schedule_refresh(hass)
 
     return unload_ok
 
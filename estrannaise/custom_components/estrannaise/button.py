@@ -56,7 +56,7 @@ class EstrannaisResetButton(ButtonEntity):
         if database:
             await database.clear_all_data()
             _LOGGER.info("Estrannaise: All dose and blood test data cleared")
-            # Refresh all coordinators
-            for val in self.hass.data.get(DOMAIN, {}).values():
-                if isinstance(val, EstrannaisCoordinator):
-                    await val.async_request_refresh()
+            # Refresh all coordinators (debounced with other changes)
+            refresher = self.hass.data.get(DOMAIN, {}).get("refresher")
+            if refresher is not None:
+                refresher.async_schedule()
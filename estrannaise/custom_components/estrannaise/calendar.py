@@ -2,13 +2,14 @@
 
 from __future__ import annotations
 
+import bisect
+import time
 from datetime import datetime, timedelta, timezone
-from typing import Any
+from typing import Any, NamedTuple
 
 from homeassistant.components.calendar import CalendarEntity, CalendarEvent
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant
-from homeassistant.util import dt as dt_util
+from homeassistant.core import HomeAssistant, callback
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
 from homeassistant.helpers.update_coordinator import CoordinatorEntity
 
@@ -18,12 +19,18 @@ from .const import (
     DOMAIN,
     ESTERS,
     METHODS,
-    MODE_AUTOMATIC,
-    MODE_BOTH,
-    compute_suggested_regimen,
     get_dose_units,
 )
 from .coordinator import EstrannaisCoordinator
+from .schedule import DoseSeries, ProjectedSeries
+
+# Scheduled doses are generated this far ahead when the store is built;
+# queries reaching further generate the rest on demand, up to the limit
+SCHEDULE_HORIZON = 30 * 86400.0
+SCHEDULE_LIMIT = 5 * 366 * 86400.0
+# Doses of the same ester closer than this are shown as one event
+MERGE_WINDOW = 3600.0
+EVENT_DURATION = timedelta(minutes=15)
 
 
 async def async_setup_entry(
@@ -46,6 +53,141 @@ async def async_setup_entry(
     async_add_entities([EstrannaisCalendar(coordinator, entry)])
 
 
+class _ScheduledDoses(NamedTuple):
+    """A dose series with the text of its calendar events."""
+
+    series: DoseSeries
+    ester: str
+    label: str
+    desc: str
+
+
+# Raw dose record: (timestamp, ester, dose_mg, label, description)
+_RawDose = tuple[float, str, float, str, str]
+
+
+def _scheduled_doses(runs: list[ProjectedSeries]) -> list[_ScheduledDoses]:
+    """Return the projected auto-dose runs with their event text."""
+    scheduled: list[_ScheduledDoses] = []
+    for run in runs:
+        ester_name = ESTERS.get(run.ester, run.ester)
+        method_name = METHODS.get(run.method, run.method)
+        dose_unit = get_dose_units(run.method)
+        text = f"{run.series.dose_mg}{dose_unit} {ester_name} ({method_name})"
+        scheduled.append(_ScheduledDoses(
+            series=run.series,
+            ester=run.ester,
+            label=text,
+            desc=f"Scheduled dose: {text}",
+        ))
+    return scheduled
+
+
+class _EventStore:
+    """Merged dose events of one coordinator update, sorted by start.
+
+    Logged doses are all known up front; scheduled doses are generated up
+    to a horizon that advances when a query reaches past it.  Coincident
+    doses of the same ester are merged greedily in (time, ester) order,
+    so a merged group starting more than MERGE_WINDOW before the horizon
+    is final; extending only re-merges the groups after that point.
+    """
+
+    def __init__(
+        self, raw: list[_RawDose], series: list[_ScheduledDoses], now: float
+    ) -> None:
+        """Build the store from logged doses and scheduled series."""
+        self._raw = sorted(raw, key=lambda d: (d[0], d[1]))
+        self._series = series
+        self._limit = now + SCHEDULE_LIMIT
+        # Scheduled doses after now, up to this timestamp, are generated
+        self._until = now
+        # Merged groups: [ts, ester, dose_mg, label, desc, first raw index],
+        # with their events and start timestamps in parallel lists
+        self._groups: list[list[Any]] = []
+        self._events: list[CalendarEvent] = []
+        self._starts: list[float] = []
+        self._merge_from(0, 0)
+        self.extend(now + SCHEDULE_HORIZON)
+
+    def extend(self, until: float) -> None:
+        """Generate scheduled doses (and merge them) up to *until*."""
+        until = min(until, self._limit)
+        if until <= self._until or not self._series:
+            return
+        new: list[_RawDose] = [
+            (t, sch.ester, sch.series.dose_mg, sch.label, sch.desc)
+            for sch in self._series
+            for t in sch.series.times(self._until, until)
+        ]
+        # Every new dose is after the old horizon, so only groups
+        # that start within MERGE_WINDOW of it can change
+        k = bisect.bisect_left(self._starts, self._until - MERGE_WINDOW)
+        r = self._groups[k][5] if k < len(self._groups) else len(self._raw)
+        self._raw[r:] = sorted(self._raw[r:] + new, key=lambda d: (d[0], d[1]))
+        self._until = until
+        self._merge_from(k, r)
+
+    def _merge_from(self, k: int, r: int) -> None:
+        """Re-merge raw doses from index *r* on, replacing groups from *k*."""
+        groups = self._groups
+        del groups[k:]
+        for i in range(r, len(self._raw)):
+            ts, ester, dose_mg, label, desc = self._raw[i]
+            prev = groups[-1] if groups else None
+            if (prev and prev[1] == ester
+                    and abs(ts - prev[0]) < MERGE_WINDOW):
+                prev[2] += dose_mg
+                ester_name = ESTERS.get(prev[1], prev[1])
+                prev[3] = f"{prev[2]}mg {ester_name}"
+                prev[4] = f"{prev[4]}\n+ {desc}"
+            else:
+                groups.append([ts, ester, dose_mg, label, desc, i])
+
+        del self._events[k:]
+        del self._starts[k:]
+        for ts, _ester, _mg, label, desc, _i in groups[k:]:
+            start = datetime.fromtimestamp(ts, tz=timezone.utc)
+            self._events.append(CalendarEvent(
+                summary=f"E2 Dose: {label}",
+                start=start,
+                end=start + EVENT_DURATION,
+                description=desc,
+            ))
+            self._starts.append(ts)
+
+    def events_between(self, start: float, end: float) -> list[CalendarEvent]:
+        """Return the events overlapping [start, end)."""
+        self.extend(end + MERGE_WINDOW)
+        lo = bisect.bisect_right(
+            self._starts, start - EVENT_DURATION.total_seconds()
+        )
+        hi = bisect.bisect_left(self._starts, end)
+        return self._events[lo:hi]
+
+    def next_event(self, now: float) -> CalendarEvent | None:
+        """Return the first event not yet over, else the latest one."""
+        i = bisect.bisect_left(self._starts, now - EVENT_DURATION.total_seconds())
+        # Generate further while the candidate could still change (or a
+        # scheduled dose could come before it)
+        while (
+            self._series
+            and self._until < self._limit
+            and (i == len(self._starts)
+                 or self._starts[i] >= self._until - MERGE_WINDOW)
+        ):
+            self.extend(
+                self._until
+                + max(sch.series.interval_sec for sch in self._series)
+            )
+            i = bisect.bisect_left(
+                self._starts, now - EVENT_DURATION.total_seconds()
+            )
+        if i < len(self._events):
+            return self._events[i]
+        return self._events[-1] if self._events else None
+
+
 class EstrannaisCalendar(
     CoordinatorEntity[EstrannaisCoordinator], CalendarEntity
 ):
@@ -63,22 +205,22 @@ class EstrannaisCalendar(
         super().__init__(coordinator)
         self._attr_unique_id = f"{entry.entry_id}_dose_calendar"
         self._entry = entry
+        # Built on first read after each coordinator update
+        self._store: _EventStore | None = None
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        """Drop the cached events; the next read rebuilds them."""
+        self._store = None
+        super()._handle_coordinator_update()
 
     @property
     def event(self) -> CalendarEvent | None:
         """Return the next upcoming dose event."""
-        events = self._build_events()
-        if not events:
+        store = self._get_store()
+        if store is None:
             return None
-
-        now = datetime.now(timezone.utc)
-        future = [e for e in events if e.end >= now]
-        if future:
-            future.sort(key=lambda e: e.start)
-            return future[0]
-
-        events.sort(key=lambda e: e.start, reverse=True)
-        return events[0]
+        return store.next_event(time.time())
 
     async def async_get_events(
         self,
@@ -87,145 +229,45 @@ class EstrannaisCalendar(
         end_date: datetime,
     ) -> list[CalendarEvent]:
         """Return events in the given date range."""
-        events = self._build_events()
-        return [
-            e
-            for e in events
-            if e.end > start_date and e.start < end_date
-        ]
+        store = self._get_store()
+        if store is None:
+            return []
+        return store.events_between(start_date.timestamp(), end_date.timestamp())
 
-    def _build_events(self) -> list[CalendarEvent]:
-        """Build calendar events from dose data and schedule."""
+    def _get_store(self) -> _EventStore | None:
+        """Return the event store for the current data, building it once."""
         if not self.coordinator.data:
-            return []
+            return None
+        if self._store is None:
+            self._store = self._build_store()
+        return self._store
 
-        # Collect raw dose records: (datetime, ester_key, dose_mg, label, desc)
-        raw_doses: list[dict] = []
+    def _build_store(self) -> _EventStore:
+        """Build the event store from dose data and schedules."""
         data = self.coordinator.data
-        all_configs = data.get("all_configs", [])
+        now = time.time()
 
-        # Past manual doses from database (all entries)
+        # Past doses from database (all entries)
+        raw_doses: list[_RawDose] = []
         for dose in data.get("doses", []):
             ts = dose.get("timestamp")
             if not ts:
                 continue
-            dt = datetime.fromtimestamp(ts, tz=timezone.utc)
             model = dose.get("model", "")
             mg = dose.get("dose_mg", 0)
             # Extract ester key from model (e.g. "EEn im" → "EEn")
             ester_key = model.split(" ")[0] if model else ""
             ester_name = ESTERS.get(ester_key, model)
-            raw_doses.append({
-                "dt": dt, "ester": ester_key, "dose_mg": mg,
-                "label": f"{mg}mg {ester_name}",
-                "desc": f"Logged dose: {mg}mg {model}\nSource: {dose.get('source', 'manual')}",
-            })
-
-        # Future scheduled doses from ALL entries
-        for cfg in all_configs:
-            mode = cfg.get("mode", "manual")
-            if mode not in (MODE_AUTOMATIC, MODE_BOTH):
-                continue
-
-            ester = cfg.get("ester", "")
-            method = cfg.get("method", "im")
-            ester_name = ESTERS.get(ester, ester)
-            method_name = METHODS.get(method, method)
-            dose_unit = get_dose_units(method)
-
-            dose_time_str = cfg.get("dose_time", "08:00")
-            try:
-                parts = dose_time_str.split(":")
-                hour = int(parts[0])
-                minute = int(parts[1]) if len(parts) > 1 else 0
-            except (ValueError, IndexError):
-                hour, minute = 8, 0
-            hour = max(0, min(23, hour))
-            minute = max(0, min(59, minute))
-
-            now = datetime.now(timezone.utc)
-            local_tz = dt_util.DEFAULT_TIME_ZONE
-            now_local = now.astimezone(local_tz)
-
-            # Compute today's dose time in local timezone (→ UTC timestamp)
-            today_dose_local = now_local.replace(
-                hour=hour, minute=minute, second=0, microsecond=0
-            )
-
-            schedules = None
-            if cfg.get("auto_regimen", False):
-                target_type = cfg.get("target_type", "target_range")
-                suggested = compute_suggested_regimen(ester, method, target_type)
-                if suggested and "schedules" in suggested:
-                    schedules = suggested["schedules"]
-                elif suggested:
-                    schedules = [{
-                        "dose_mg": suggested["dose_mg"],
-                        "interval_days": suggested["interval_days"],
-                        "phase_days": 0,
-                    }]
-
-            if not schedules:
-                schedules = [{
-                    "dose_mg": cfg.get("dose_mg", 0),
-                    "interval_days": cfg.get("interval_days", 7),
-                    "phase_days": cfg.get("phase_days", 0),
-                }]
-
-            for sch in schedules:
-                dose_mg = sch["dose_mg"]
-                interval_days_val = sch["interval_days"]
-                interval = timedelta(days=interval_days_val)
-                if interval.total_seconds() <= 0:
-                    continue
-                phase_days_val = sch.get("phase_days", 0)
-                if phase_days_val and phase_days_val > 0:
-                    # Phase-based anchoring (matches coordinator logic)
-                    epoch_day_local = int(now_local.replace(
-                        hour=0, minute=0, second=0, microsecond=0
-                    ).timestamp() // 86400)
-                    cycle_day_now = epoch_day_local % 28
-                    days_back = (cycle_day_now - int(phase_days_val)) % 28
-                    anchor_ts = today_dose_local.timestamp() - days_back * 86400.0
-                    t = anchor_ts
-                    interval_sec = interval_days_val * 86400.0
-                    now_ts = now.timestamp()
-                    while t <= now_ts:
-                        t += interval_sec
-                    next_dose = datetime.fromtimestamp(t, tz=timezone.utc)
-                else:
-                    today_dose_utc = today_dose_local.astimezone(timezone.utc)
-                    next_dose = today_dose_utc if today_dose_utc > now else today_dose_utc + interval
-                while next_dose < now + timedelta(days=30):
-                    raw_doses.append({
-                        "dt": next_dose, "ester": ester, "dose_mg": dose_mg,
-                        "label": f"{dose_mg}{dose_unit} {ester_name} ({method_name})",
-                        "desc": f"Scheduled dose: {dose_mg}{dose_unit} {ester_name} ({method_name})",
-                    })
-                    next_dose += interval
-
-        # Merge coincident doses of the same ester (within 1 hour)
-        raw_doses.sort(key=lambda d: (d["dt"], d["ester"]))
-        merged_doses: list[dict] = []
-        for rd in raw_doses:
-            prev = merged_doses[-1] if merged_doses else None
-            if (prev and prev["ester"] == rd["ester"]
-                    and abs((rd["dt"] - prev["dt"]).total_seconds()) < 3600):
-                prev["dose_mg"] += rd["dose_mg"]
-                ester_name = ESTERS.get(prev["ester"], prev["ester"])
-                prev["label"] = f"{prev['dose_mg']}mg {ester_name}"
-                prev["desc"] = f"{prev['desc']}\n+ {rd['desc']}"
-            else:
-                merged_doses.append({**rd})
-
-        # Convert to CalendarEvents
-        events: list[CalendarEvent] = []
-        for md in merged_doses:
-            events.append(CalendarEvent(
-                summary=f"E2 Dose: {md['label']}",
-                start=md["dt"],
-                end=md["dt"] + timedelta(minutes=15),
-                description=md["desc"],
+            raw_doses.append((
+                float(ts), ester_key, mg,
+                f"{mg}mg {ester_name}",
+                f"Logged dose: {mg}mg {model}\nSource: {dose.get('source', 'manual')}",
             ))
 
-        return events
+        # Future scheduled doses from ALL entries: the refresh's projected
+        # runs, continued past their projection window as far as queried.
+        # They start at the refresh time, so doses due since then still
+        # show until the next refresh persists them.
+        runs = data.get("auto_schedules", [])
+        start = min((run.after for run in runs), default=now)
+        return _EventStore(raw_doses, _scheduled_doses(runs), start)
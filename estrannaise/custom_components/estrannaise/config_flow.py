@@ -2,6 +2,8 @@
 
 from __future__ import annotations
 
+import asyncio
+import logging
 from typing import Any
 
 import voluptuous as vol
@@ -15,10 +17,13 @@ from .const import (
     CONF_DOSE_TIME,
     CONF_ENABLE_CALENDAR,
     CONF_ESTER,
+    CONF_FIT_MODE,
     CONF_INTERVAL_DAYS,
     CONF_METHOD,
     CONF_MODE,
     CONF_PHASE_DAYS,
+    CONF_PROCESS_POOL,
+    CONF_PROFILE,
     CONF_TARGET_TYPE,
     CONF_UNITS,
     DEFAULT_AUTO_REGIMEN,
@@ -27,14 +32,20 @@ from .const import (
     DEFAULT_DOSE_TIME,
     DEFAULT_ENABLE_CALENDAR,
     DEFAULT_ESTER,
+    DEFAULT_FIT_MODE,
     DEFAULT_INTERVAL_DAYS,
     DEFAULT_METHOD,
     DEFAULT_MODE,
     DEFAULT_PHASE_DAYS,
+    DEFAULT_PROCESS_POOL,
+    DEFAULT_PROFILE,
     DEFAULT_TARGET_TYPE,
     DEFAULT_UNITS,
     DOMAIN,
     ESTERS,
+    FIT_MODE_BEAM,
+    FIT_MODE_EXHAUSTIVE,
+    FIT_MODE_GREEDY,
     METHODS,
     MODE_AUTOMATIC,
     MODE_BOTH,
@@ -43,6 +54,19 @@ from .const import (
     get_dose_units,
     is_combination_supported,
 )
+from .cycle_fit_cache import async_get_cycle_fit_regimen
+from .cycle_fit_search import async_search_cycle_fit_regimens
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _schedules_summary(schedules: list[dict[str, Any]]) -> str:
+    """Describe cycle-fit schedules on one line, numbered."""
+    return ", ".join(
+        f"{i}. {sch['dose_mg']}mg every {sch['interval_days']}d "
+        f"(cycle day {int(sch['phase_days'])})"
+        for i, sch in enumerate(schedules, 1)
+    )
 
 
 class EstrannaisConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
@@ -55,6 +79,13 @@ class EstrannaisConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         self._data: dict[str, Any] = {}
         self._schedules: list[dict[str, Any]] = []
         self._setup_mode: str = "manual"
+        # Running cycle-fit search (shown as a progress step), its fit
+        # mode, the regimens it ranked, and errors to show when returning
+        # to the target form
+        self._search_task: asyncio.Task[list[dict]] | None = None
+        self._fit_mode: str = DEFAULT_FIT_MODE
+        self._ranked: list[dict] = []
+        self._target_errors: dict[str, str] = {}
 
     async def async_step_user(
         self, user_input: dict[str, Any] | None = None
@@ -153,24 +184,21 @@ class EstrannaisConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         self, user_input: dict[str, Any] | None = None
     ) -> config_entries.ConfigFlowResult:
         """Step 2a (auto path): Choose target range."""
-        errors: dict[str, str] = {}
+        errors, self._target_errors = self._target_errors, {}
 
         if user_input is not None:
             target_type = user_input.get(CONF_TARGET_TYPE, DEFAULT_TARGET_TYPE)
             self._data[CONF_TARGET_TYPE] = target_type
             self._data[CONF_DOSE_TIME] = DEFAULT_DOSE_TIME
 
+            if target_type == "menstrual_range":
+                return await self.async_step_cycle_fit_mode()
+
             ester = self._data.get(CONF_ESTER, DEFAULT_ESTER)
             method = self._data.get(CONF_METHOD, DEFAULT_METHOD)
-
-            # Compute the regimen at config flow time
             suggested = compute_suggested_regimen(ester, method, target_type)
 
-            if suggested and "schedules" in suggested:
-                # Multi-schedule cycle fit → discrete entries
-                self._schedules = suggested["schedules"]
-                return await self.async_step_confirm_schedules()
-            elif suggested:
+            if suggested:
                 # Single schedule (target_range) → one concrete entry
                 self._schedules = [{
                     "dose_mg": suggested["dose_mg"],
@@ -199,6 +227,110 @@ class EstrannaisConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
             errors=errors,
         )
 
+    async def async_step_cycle_fit_mode(
+        self, user_input: dict[str, Any] | None = None
+    ) -> config_entries.ConfigFlowResult:
+        """Step 2a (auto path, menstrual range): Choose the cycle-fit search."""
+        errors: dict[str, str] = {}
+
+        if user_input is not None:
+            fit_mode = user_input.get(CONF_FIT_MODE, DEFAULT_FIT_MODE)
+            if fit_mode != FIT_MODE_GREEDY:
+                # Opt-in wider search (time-bounded), run behind a
+                # progress step
+                self._fit_mode = fit_mode
+                return await self.async_step_cycle_fit_search()
+
+            # Cycle fits are memoized; a cache miss is computed in the
+            # executor
+            ester = self._data.get(CONF_ESTER, DEFAULT_ESTER)
+            method = self._data.get(CONF_METHOD, DEFAULT_METHOD)
+            suggested = await async_get_cycle_fit_regimen(self.hass, ester, method)
+            if suggested:
+                self._schedules = suggested["schedules"]
+                return await self.async_step_confirm_schedules()
+            errors["base"] = "invalid_combination"
+
+        return self.async_show_form(
+            step_id="cycle_fit_mode",
+            data_schema=vol.Schema(
+                {
+                    vol.Required(
+                        CONF_FIT_MODE, default=DEFAULT_FIT_MODE
+                    ): vol.In(
+                        {
+                            FIT_MODE_GREEDY: "Quick fit",
+                            FIT_MODE_BEAM: "Beam search (slower, better fit)",
+                            FIT_MODE_EXHAUSTIVE: "Exhaustive search (slowest)",
+                        }
+                    ),
+                }
+            ),
+            errors=errors,
+        )
+
+    async def async_step_cycle_fit_search(
+        self, user_input: dict[str, Any] | None = None
+    ) -> config_entries.ConfigFlowResult:
+        """Step 2a' (auto path): Run the wider cycle-fit search with progress."""
+        if self._search_task is None:
+            self._search_task = self.hass.async_create_task(
+                async_search_cycle_fit_regimens(
+                    self.hass,
+                    self._data.get(CONF_ESTER, DEFAULT_ESTER),
+                    self._data.get(CONF_METHOD, DEFAULT_METHOD),
+                    self._fit_mode,
+                )
+            )
+        if not self._search_task.done():
+            return self.async_show_progress(
+                step_id="cycle_fit_search",
+                progress_action="cycle_fit_search",
+                progress_task=self._search_task,
+            )
+
+        task, self._search_task = self._search_task, None
+        try:
+            ranked = task.result()
+        except Exception:  # noqa: BLE001
+            _LOGGER.exception("Cycle-fit search failed")
+            ranked = []
+        # The greedy fit is always ranked, so this is empty only when the
+        # combination cannot be fitted at all
+        if ranked:
+            self._ranked = ranked
+            self._schedules = ranked[0]["schedules"]
+            if len(ranked) > 1:
+                return self.async_show_progress_done(
+                    next_step_id="choose_cycle_fit"
+                )
+            return self.async_show_progress_done(next_step_id="confirm_schedules")
+        self._target_errors = {"base": "invalid_combination"}
+        return self.async_show_progress_done(next_step_id="auto_target")
+
+    async def async_step_choose_cycle_fit(
+        self, user_input: dict[str, Any] | None = None
+    ) -> config_entries.ConfigFlowResult:
+        """Step 2a (auto path): Pick one of the best regimens the search found."""
+        if user_input is not None:
+            self._schedules = self._ranked[int(user_input["regimen"])]["schedules"]
+            return await self.async_step_confirm_schedules()
+
+        choices = {
+            str(i): (
+                f"Residual {regimen['residual_rms']} pg/mL: "
+                + _schedules_summary(regimen["schedules"])
+            )
+            for i, regimen in enumerate(self._ranked)
+        }
+        return self.async_show_form(
+            step_id="choose_cycle_fit",
+            data_schema=vol.Schema(
+                {vol.Required("regimen", default="0"): vol.In(choices)}
+            ),
+            description_placeholders={"count": str(len(choices))},
+        )
+
     async def async_step_confirm_schedules(
         self, user_input: dict[str, Any] | None = None
     ) -> config_entries.ConfigFlowResult:
@@ -211,20 +343,13 @@ class EstrannaisConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         method = self._data.get(CONF_METHOD, DEFAULT_METHOD)
         method_name = METHODS.get(method, "")
 
-        lines = []
-        for i, sch in enumerate(self._schedules, 1):
-            lines.append(
-                f"{i}. {sch['dose_mg']}mg every {sch['interval_days']}d "
-                f"(cycle day {int(sch['phase_days'])})"
-            )
-
         return self.async_show_form(
             step_id="confirm_schedules",
             data_schema=vol.Schema({}),
             description_placeholders={
                 "ester": ester_name,
                 "method": method_name,
-                "schedules": ", ".join(lines),
+                "schedules": _schedules_summary(self._schedules),
                 "count": str(len(self._schedules)),
             },
         )
@@ -670,6 +795,7 @@ class EstrannaisConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                     CONF_UNITS: units,
                     CONF_ENABLE_CALENDAR: enable_cal,
                     CONF_BACKFILL_DOSES: backfill,
+                    CONF_PROFILE: self._data.get(CONF_PROFILE, DEFAULT_PROFILE),
                 }
                 title = (
                     f"{ester_name} {first['dose_mg']}mg"
@@ -695,6 +821,8 @@ class EstrannaisConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                         CONF_UNITS: units,
                         CONF_ENABLE_CALENDAR: enable_cal,
                         CONF_BACKFILL_DOSES: backfill,
+                        # Same person as the first schedule
+                        CONF_PROFILE: first_data[CONF_PROFILE],
                         "subsidiary": True,
                     }
                     self.hass.async_create_task(
@@ -724,6 +852,7 @@ class EstrannaisConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
             vol.Required(
                 CONF_ENABLE_CALENDAR, default=DEFAULT_ENABLE_CALENDAR
             ): bool,
+            vol.Optional(CONF_PROFILE, default=DEFAULT_PROFILE): str,
         }
         # Only show backfill if not already answered (e.g. guided flow)
         if CONF_BACKFILL_DOSES not in self._data:
@@ -868,6 +997,14 @@ class EstrannaisOptionsFlow(config_entries.OptionsFlow):
                         CONF_BACKFILL_DOSES,
                         default=data.get(CONF_BACKFILL_DOSES, DEFAULT_BACKFILL_DOSES),
                     ): bool,
+                    vol.Optional(
+                        CONF_PROCESS_POOL,
+                        default=data.get(CONF_PROCESS_POOL, DEFAULT_PROCESS_POOL),
+                    ): bool,
+                    vol.Optional(
+                        CONF_PROFILE,
+                        default=data.get(CONF_PROFILE, DEFAULT_PROFILE),
+                    ): str,
                 }
             ),
             description_placeholders={"dose_unit": dose_unit},
@@ -3,6 +3,14 @@
 from __future__ import annotations
 
 import math
+from typing import TYPE_CHECKING, NamedTuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import datetime as _dt
+
+    from .pk import DoseArrays, PKModel
 
 DOMAIN = "estrannaise"
 
@@ -22,6 +30,9 @@ CONF_AUTO_REGIMEN = "auto_regimen"
 CONF_TARGET_TYPE = "target_type"
 CONF_PHASE_DAYS = "phase_days"
 CONF_BACKFILL_DOSES = "backfill_doses"
+CONF_FIT_MODE = "fit_mode"
+CONF_PROCESS_POOL = "process_pool"
+CONF_PROFILE = "profile"
 
 # ── Defaults ─────────────────────────────────────────────────────────────────
 
@@ -37,6 +48,9 @@ DEFAULT_AUTO_REGIMEN = False
 DEFAULT_TARGET_TYPE = "target_range"
 DEFAULT_PHASE_DAYS = 0.0
 DEFAULT_BACKFILL_DOSES = False
+DEFAULT_FIT_MODE = "greedy"
+DEFAULT_PROCESS_POOL = False
+DEFAULT_PROFILE = "default"
 DEFAULT_UPDATE_INTERVAL = 300  # 5 minutes
 
 # ── Dosing modes ─────────────────────────────────────────────────────────────
@@ -47,6 +61,14 @@ MODE_BOTH = "both"
 
 MODES = [MODE_AUTOMATIC, MODE_MANUAL, MODE_BOTH]
 
+# ── Cycle-fit search modes ───────────────────────────────────────────────────
+
+FIT_MODE_GREEDY = "greedy"
+FIT_MODE_BEAM = "beam"
+FIT_MODE_EXHAUSTIVE = "exhaustive"
+
+FIT_MODES = [FIT_MODE_GREEDY, FIT_MODE_BEAM, FIT_MODE_EXHAUSTIVE]
+
 # ── Attribute names ──────────────────────────────────────────────────────────
 
 ATTR_DOSES = "doses"
@@ -210,6 +232,17 @@ def get_dose_units(method: str) -> str:
     return "mcg/day" if method == "patch" else "mg"
 
 
+def round_regimen_dose(model_key: str, dose: float) -> float:
+    """Round a PK-unit dose to a practical stored dose (mg, or mg/day for patches)."""
+    if model_key in PATCH_WEAR_DAYS:
+        # dose is in mcg/day (PK model units); convert to mg/day
+        dose /= 1000.0
+        dose = round(dose / 0.025) * 0.025  # 25 mcg/day steps
+        return max(0.025, min(0.4, dose))
+    dose = round(dose * 2) / 2  # 0.5 mg increments
+    return max(0.5, min(20.0, dose))
+
+
 def compute_suggested_regimen(
     ester: str, method: str, target_type: str = "target_range"
 ) -> dict[str, Any] | None:
@@ -220,9 +253,11 @@ def compute_suggested_regimen(
     """
     from typing import Any
 
-    # For menstrual range, use multi-schedule cycle fitting
+    # For menstrual range, use multi-schedule cycle fitting (memoized)
     if target_type == "menstrual_range":
-        return compute_cycle_fit_regimen(ester, method)
+        from .cycle_fit_cache import get_cycle_fit_regimen
+
+        return get_cycle_fit_regimen(ester, method)
 
     target_trough = TARGET_TROUGH.get(target_type, 200.0)
 
@@ -234,44 +269,28 @@ def compute_suggested_regimen(
         # Default to twice-weekly for patch
         model_key = "patch tw"
 
-    params = PK_PARAMETERS.get(model_key)
-    if not params:
+    from .pk import PK_MODELS
+
+    pk_model = PK_MODELS.get(model_key)
+    if pk_model is None:
         return None
 
     intervals = SUGGESTED_INTERVALS.get(model_key, [7.0])
 
     # Use the first (most recommended) valid interval
-    d, k1, k2, k3 = params
     for interval in intervals:
         # Check ≤ 4 doses per week constraint
         if 7.0 / interval > 4.0:
             continue
 
-        # Compute steady-state trough per mg dose
-        trough_per_mg = 0.0
-        for n in range(1, 60):
-            t = n * interval
-            if model_key in PATCH_WEAR_DAYS:
-                w = PATCH_WEAR_DAYS[model_key]
-                trough_per_mg += e2_patch_3c(t, 1.0, d, k1, k2, k3, w)
-            else:
-                trough_per_mg += e2_curve_3c(t, 1.0, d, k1, k2, k3)
+        # Steady-state trough per unit dose (closed form, infinite history)
+        trough_per_mg = pk_model.periodic_level(0.0, interval)
 
         if trough_per_mg <= 0:
             continue
 
-        dose = target_trough / trough_per_mg
-        if model_key in PATCH_WEAR_DAYS:
-            # dose is in mcg/day (PK model units); convert to mg/day
-            dose /= 1000.0
-            dose = round(dose / 0.025) * 0.025  # 25 mcg/day steps
-            dose = max(0.025, min(0.4, dose))
-        else:
-            dose = round(dose * 2) / 2  # 0.5 mg increments
-            dose = max(0.5, min(20.0, dose))
-
         return {
-            "dose_mg": dose,
+            "dose_mg": round_regimen_dose(model_key, target_trough / trough_per_mg),
             "interval_days": interval,
             "model_key": model_key,
         }
@@ -311,6 +330,16 @@ MENSTRUAL_CYCLE_DATA: dict[str, list[float]] = {
 
 # ── PK helper (Python-side, for sensor state) ───────────────────────────────
 
+def normalize_profile(profile: str | None) -> str:
+    """Return the profile id for a configured profile name."""
+    return (profile or "").strip() or DEFAULT_PROFILE
+
+
+def max_contribution_days() -> float:
+    """Longest terminal_elimination_days over all PK models."""
+    return max(terminal_elimination_days(model) for model in PK_PARAMETERS)
+
+
 def terminal_elimination_days(model: str, nb_half_lives: float = 5.0) -> float:
     """Estimate when a dose's contribution drops to ~1% of peak (in days)."""
     params = PK_PARAMETERS.get(model)
@@ -329,6 +358,8 @@ def e2_curve_3c(
 
     Returns estimated estradiol level (pg/mL) at time t (days) after
     administering dose (mg). Parameters d, k1, k2, k3 are model-specific.
+    Reference implementation: pk.PKModel evaluates the same curve and is
+    tested against it.
     """
     if t < 0:
         return 0.0
@@ -385,6 +416,7 @@ def e2_patch_3c(
     """Three-compartment PK model for a transdermal patch.
 
     w = wear duration in days (3.5 for twice-weekly, 7.0 for once-weekly).
+    Reference implementation, like e2_curve_3c.
     """
     if t < 0:
         return 0.0
@@ -411,48 +443,45 @@ def e2_patch_3c(
 
 def compute_e2_at_time(
     t_now: float,
-    doses: list[dict],
+    doses: list[dict] | DoseArrays,
     scaling_factor: float = 1.0,
 ) -> float:
     """Compute estimated E2 level at time t_now from all dose contributions.
 
     t_now: Unix timestamp (seconds).
-    doses: list of dicts with 'timestamp', 'model', 'dose_mg' keys.
+    doses: list of dicts with 'timestamp', 'model', 'dose_mg' keys, or a
+    prebuilt DoseArrays (see pk.py) to avoid re-converting on every call.
     Returns E2 in pg/mL.
     """
-    total = 0.0
-    for dose_rec in doses:
-        model = dose_rec.get("model", "")
-        params = PK_PARAMETERS.get(model)
-        if not params:
-            continue
-        d, k1, k2, k3 = params
-        dose_mg = dose_rec.get("dose_mg", 0.0)
-        # Patch PK parameters are calibrated for mcg/day input;
-        # stored dose_mg is in mg/day, so convert (×1000)
-        if model in PATCH_WEAR_DAYS:
-            dose_mg *= 1000.0
-        t_days = (t_now - dose_rec["timestamp"]) / 86400.0
-        if model in PATCH_WEAR_DAYS:
-            w = PATCH_WEAR_DAYS[model]
-            total += e2_patch_3c(t_days, dose_mg, d, k1, k2, k3, w)
-        else:
-            total += e2_curve_3c(t_days, dose_mg, d, k1, k2, k3)
-    return total * scaling_factor
+    from .pk import evaluate_e2
+
+    return float(evaluate_e2(doses, t_now)[0]) * scaling_factor
 
 
 def compute_steady_state_e2_at_time(
     t_target: float,
     all_configs: list[dict],
-    n_virtual_intervals: int = 20,
+    local_tz: _dt.tzinfo | None = None,
 ) -> float:
     """Compute predicted E2 at t_target assuming steady-state dosing.
 
-    Generates virtual doses from each config's schedule around t_target
-    and returns the summed PK prediction. Useful for blood tests that
-    predate recorded dose history.
+    Aligns each config's schedule to t_target and evaluates the closed-form
+    periodic sum of its PK model (exact over infinite dose history).
+    Useful for blood tests that predate recorded dose history.
+    *local_tz* defaults to HA's configured time zone.
     """
-    virtual_doses: list[dict] = []
+    import datetime as _dt
+
+    from .pk import periodic_unit_level
+
+    if local_tz is None:
+        try:
+            from homeassistant.util import dt as dt_util
+            local_tz = dt_util.DEFAULT_TIME_ZONE
+        except ImportError:
+            local_tz = _dt.timezone.utc
+
+    total = 0.0
     for cfg in all_configs:
         ester = cfg.get("ester", "")
         method = cfg.get("method", "")
@@ -464,26 +493,18 @@ def compute_steady_state_e2_at_time(
             continue
         if dose_mg <= 0 or interval_days <= 0:
             continue
+        # Patch PK parameters are calibrated for mcg/day input
+        if model_key in PATCH_WEAR_DAYS:
+            dose_mg *= 1000.0
 
-        interval_s = interval_days * 86400.0
-
-        # Parse dose_time to seconds-from-midnight
+        # Parse dose_time to hours/minutes
         try:
             h, m = map(int, dose_time_str.split(":"))
         except (ValueError, AttributeError):
             h, m = 0, 0
-        dose_offset = h * 3600 + m * 60
-
-        # Find the nearest aligned dose time on or before t_target:
-        # Start from midnight of t_target's day + dose_offset, then step
-        # by interval until we pass t_target, then back up one step.
-        import datetime as _dt
-        try:
-            from homeassistant.util import dt as dt_util
-            local_tz = dt_util.DEFAULT_TIME_ZONE
-        except ImportError:
-            local_tz = _dt.timezone.utc
 
+        # Most recent dose time-of-day on or before t_target anchors the
+        # schedule; the phase within the interval follows by modulo.
         dt_target = _dt.datetime.fromtimestamp(t_target, tz=local_tz)
         dose_at_target_day = dt_target.replace(
             hour=h, minute=m, second=0, microsecond=0
@@ -492,78 +513,43 @@ def compute_steady_state_e2_at_time(
         if anchor > t_target:
             anchor -= 86400  # use previous day's dose time
 
-        # Align: find the dose time closest to (but <= t_target) in the cycle
-        # Walk forward from a far-past anchor to avoid modular arithmetic issues
-        far_past = anchor - n_virtual_intervals * interval_s
-        t = far_past
-        last_before = far_past
-        while t <= t_target:
-            last_before = t
-            t += interval_s
-        anchor = last_before
-
-        # Generate n_virtual_intervals doses ending at anchor
-        for i in range(n_virtual_intervals):
-            dose_ts = anchor - i * interval_s
-            virtual_doses.append({
-                "timestamp": dose_ts,
-                "model": model_key,
-                "dose_mg": dose_mg,
-            })
-
-    if not virtual_doses:
-        return 0.0
-    return compute_e2_at_time(t_target, virtual_doses, scaling_factor=1.0)
-
-
-# ── Cycle-fitting algorithm (menstrual range auto-regimen) ──────────────────
-
-
-def _ss_unit_3c(
-    t_mod: float, T: float, d: float, k1: float, k2: float, k3: float
-) -> float:
-    """Steady-state E2 from 1 mg injection repeated every T days.
+        interval_s = interval_days * 86400.0
+        phase_days = math.fmod(t_target - anchor, interval_s) / 86400.0
+        total += dose_mg * periodic_unit_level(
+            model_key, phase_days, interval_days
+        )
 
-    Uses the geometric series of the 3-compartment model (general case,
-    all rate constants distinct).  Returns E2 (pg/mL) at time *t_mod*
-    within the dosing interval [0, T).
-    """
-    if T <= 0 or d <= 0:
-        return 0.0
-    try:
+    return total
 
-        def _geom(k: float, t: float) -> float:
-            return math.exp(-k * t) / (1.0 - math.exp(-k * T))
 
-        val = d * k1 * k2 * (
-            _geom(k1, t_mod) / (k1 - k2) / (k1 - k3)
-            - _geom(k2, t_mod) / (k1 - k2) / (k2 - k3)
-            + _geom(k3, t_mod) / (k1 - k3) / (k2 - k3)
-        )
-        return max(0.0, val)
-    except (OverflowError, ZeroDivisionError, ValueError):
-        return 0.0
+# ── Cycle-fitting algorithm (menstrual range auto-regimen) ──────────────────
 
 
 def _compute_basis_vector(
-    interval: float,
-    phase: float,
-    d: float,
-    k1: float,
-    k2: float,
-    k3: float,
+    interval: float | np.ndarray,
+    phase: float | np.ndarray,
+    pk_model: PKModel,
     n_days: int = 28,
-) -> list[float]:
+) -> np.ndarray:
     """Steady-state E2 per cycle day from a 1 mg schedule.
 
     *interval*: dosing interval (days).
     *phase*: cycle day when a dose is administered (0-indexed).
-    Returns an *n_days*-element list.
+    Scalars give an *n_days* vector; arrays of intervals/phases give an
+    (*n_days*, n_candidates) basis matrix with one column per schedule.
+    Each distinct interval is one PKModel.periodic_response call.
     """
-    return [
-        _ss_unit_3c((day - phase) % interval, interval, d, k1, k2, k3)
-        for day in range(n_days)
-    ]
+    interval = np.asarray(interval, dtype=np.float64)
+    phase = np.asarray(phase, dtype=np.float64)
+    shape = np.broadcast(interval, phase).shape
+    intervals = np.broadcast_to(interval, shape).ravel()
+    phases = np.broadcast_to(phase, shape).ravel()
+    days = np.arange(n_days, dtype=np.float64)[:, None]
+    basis = np.zeros((n_days, intervals.size))
+    for intv in np.unique(intervals):
+        cols = intervals == intv
+        basis[:, cols] = pk_model.periodic_response(days - phases[cols], intv)
+    return basis.reshape((n_days,) + shape)
 
 
 def _gauss_solve(
@@ -602,17 +588,17 @@ def _gauss_solve(
     return x
 
 
-def _nnls(
-    columns: list[list[float]], b: list[float]
-) -> list[float]:
-    """Non-negative least squares (Lawson-Hanson active set).
+def _nnls_gram(G: np.ndarray, Atb: np.ndarray) -> list[float]:
+    """Non-negative least squares (Lawson-Hanson) from normal equations.
 
-    *columns*: list of column vectors (each len *n*).
-    *b*: target vector (len *n*).
-    Returns x (len k, all >= 0) minimising ||Ax - b||².
+    *G*: Gram matrix AᵀA (k × k).  *Atb*: Aᵀb (k).
+    Returns x (len k, all >= 0) minimising ||Ax - b||².  Works entirely
+    on the precomputed Gram system, so no column sums are rebuilt; the
+    systems are tiny (k <= max_schedules), so plain lists beat NumPy here.
     """
-    n = len(b)
-    k = len(columns)
+    G_l: list[list[float]] = G.tolist()
+    Atb_l: list[float] = Atb.tolist()
+    k = len(Atb_l)
     if k == 0:
         return []
 
@@ -620,15 +606,11 @@ def _nnls(
     free = [False] * k
 
     for _outer in range(3 * k + 1):
-        # Residual r = b - Ax
-        r = list(b)
-        for j in range(k):
-            if x[j] != 0.0:
-                for i in range(n):
-                    r[i] -= columns[j][i] * x[j]
-
-        # Gradient w = Aᵀ r
-        w = [sum(columns[j][i] * r[i] for i in range(n)) for j in range(k)]
+        # Gradient w = Aᵀ(b - Ax) = Aᵀb - AᵀA x
+        w = [
+            Atb_l[j] - sum(G_l[j][i] * x[i] for i in range(k) if x[i] != 0.0)
+            for j in range(k)
+        ]
 
         best_j, best_w = -1, 1e-10
         for j in range(k):
@@ -642,18 +624,8 @@ def _nnls(
         # Inner loop: solve LS on free set, enforce non-negativity
         for _inner in range(3 * k + 1):
             free_idx = [j for j in range(k) if free[j]]
-            nf = len(free_idx)
-
-            AtA = [[0.0] * nf for _ in range(nf)]
-            Atb_vec = [0.0] * nf
-            for ii in range(nf):
-                ci = free_idx[ii]
-                for jj in range(nf):
-                    cj = free_idx[jj]
-                    AtA[ii][jj] = sum(
-                        columns[ci][i] * columns[cj][i] for i in range(n)
-                    )
-                Atb_vec[ii] = sum(columns[ci][i] * b[i] for i in range(n))
+            AtA = [[G_l[ci][cj] for cj in free_idx] for ci in free_idx]
+            Atb_vec = [Atb_l[ci] for ci in free_idx]
 
             s_free = _gauss_solve(AtA, Atb_vec)
             if s_free is None:
@@ -678,19 +650,51 @@ def _nnls(
     return x
 
 
-def compute_cycle_fit_regimen(
-    ester: str, method: str, max_schedules: int = 4
-) -> dict | None:
-    """Compute a multi-schedule regimen approximating the menstrual cycle.
-
-    Uses greedy forward selection with NNLS to find up to *max_schedules*
-    dose schedules (same ester/method, varying dose/interval/phase) that
-    minimise the MSE between predicted steady-state E2 and the reference
-    menstrual-cycle E2 curve.
+def _score_column_sets(
+    basis: np.ndarray,
+    target: np.ndarray,
+    gram: np.ndarray,
+    atb: np.ndarray,
+    cols: np.ndarray,
+) -> np.ndarray:
+    """MSE of the NNLS fit of *target* on each row of column indices *cols*.
 
-    Returns ``{"schedules": [...], "residual_rms": float,
-    "cycle_fit_curve": [float, ...]}`` or *None*.
+    Solves every normal-equation system in one batched call; rows whose
+    unconstrained solution is already non-negative are the NNLS optimum,
+    the rest fall back to _nnls_gram.
     """
+    n_days = target.shape[0]
+    systems = gram[cols[:, :, None], cols[:, None, :]]
+    rhs = atb[cols]
+
+    try:
+        x = np.linalg.solve(systems, rhs[..., None])[..., 0]
+        feasible = (x >= 0).all(axis=1) & np.isfinite(x).all(axis=1)
+    except np.linalg.LinAlgError:
+        x = np.zeros(cols.shape, dtype=np.float64)
+        feasible = np.zeros(cols.shape[0], dtype=bool)
+    for row in np.flatnonzero(~feasible):
+        x[row] = _nnls_gram(systems[row], rhs[row])
+
+    fitted = np.einsum("nck,ck->cn", basis[:, cols], x)
+    mses = ((target[None, :] - fitted) ** 2).sum(axis=1) / n_days
+    return np.where(np.isfinite(mses), mses, np.inf)
+
+
+class CycleFitProblem(NamedTuple):
+    """Candidate schedules and cached normal equations for one cycle fit."""
+
+    model_key: str
+    intervals: list[float]
+    phases: list[float]
+    target: np.ndarray
+    basis: np.ndarray
+    gram: np.ndarray
+    atb: np.ndarray
+
+
+def _cycle_fit_problem(ester: str, method: str) -> CycleFitProblem | None:
+    """Build the candidate (interval, phase) pool and its basis matrix."""
     model_key = ESTER_METHOD_TO_MODEL.get((ester, method))
     if model_key is None:
         return None
@@ -701,7 +705,14 @@ def compute_cycle_fit_regimen(
     if not params:
         return None
 
-    d, k1, k2, k3 = params
+    from .pk import PK_MODELS, PKModel
+
+    pk_model = PK_MODELS[model_key]
+    if pk_model.is_patch:
+        # The fit has always modelled a patch dose as never removed; a
+        # model of the same parameters without the wear phase keeps the
+        # fitted regimens (and the shipped table) as they are
+        pk_model = PKModel(f"{model_key} unworn", params)
     n_days = 28
     target = MENSTRUAL_CYCLE_DATA["E2"][:n_days]
 
@@ -712,94 +723,125 @@ def compute_cycle_fit_regimen(
     for intv in (3.5, 4.0, 5.0, 7.0, 9.0, 10.0, 14.0, 28.0):
         interval_set.add(intv)
 
-    candidates: list[tuple[float, float, list[float]]] = []
+    cand_intervals: list[float] = []
+    cand_phases: list[float] = []
     for intv in sorted(interval_set):
         if intv < 2.0 or intv > 28.0:
             continue
         n_phases = max(1, int(math.ceil(intv)))
         for phase in range(n_phases):
-            bv = _compute_basis_vector(intv, float(phase), d, k1, k2, k3, n_days)
-            candidates.append((intv, float(phase), bv))
+            cand_intervals.append(intv)
+            cand_phases.append(float(phase))
 
-    # ── Greedy forward selection ──
-    selected: list[int] = []
-    baseline_mse = sum(v**2 for v in target) / n_days
-    prev_mse = baseline_mse
-
-    for step in range(max_schedules):
-        best_ci = -1
-        best_mse = prev_mse
-        for ci, (_intv, _phase, bv) in enumerate(candidates):
-            if ci in selected:
-                continue
-            A_cols = [candidates[si][2] for si in selected] + [bv]
-            x = _nnls(A_cols, target)
-            fitted = [0.0] * n_days
-            for j, xj in enumerate(x):
-                for i in range(n_days):
-                    fitted[i] += xj * A_cols[j][i]
-            mse = (
-                sum((target[i] - fitted[i]) ** 2 for i in range(n_days)) / n_days
-            )
-            if mse < best_mse:
-                best_mse = mse
-                best_ci = ci
+    # ── Basis matrix, Gram matrix and Aᵀb, computed once ──
+    target_vec = np.asarray(target, dtype=np.float64)
+    basis = _compute_basis_vector(
+        np.array(cand_intervals), np.array(cand_phases), pk_model, n_days
+    )
+    return CycleFitProblem(
+        model_key=model_key,
+        intervals=cand_intervals,
+        phases=cand_phases,
+        target=target_vec,
+        basis=basis,
+        gram=basis.T @ basis,
+        atb=basis.T @ target_vec,
+    )
 
-        if best_ci < 0:
-            break
-        if step > 0 and prev_mse > 0 and (prev_mse - best_mse) / prev_mse < 0.01:
-            break
-        selected.append(best_ci)
-        prev_mse = best_mse
 
+def _cycle_fit_result(
+    problem: CycleFitProblem, selected: list[int]
+) -> dict | None:
+    """Fit doses for the *selected* candidates and build the regimen dict."""
     if not selected:
         return None
+    model_key = problem.model_key
+    n_days = problem.target.shape[0]
 
     # ── Final NNLS with all selected columns ──
-    A_cols = [candidates[si][2] for si in selected]
-    final_x = _nnls(A_cols, target)
+    final_x = _nnls_gram(
+        problem.gram[np.ix_(selected, selected)], problem.atb[selected]
+    )
 
     # ── Build schedules, round doses ──
     schedules = []
+    kept: list[int] = []
     for si, dose_raw in zip(selected, final_x):
         if dose_raw < 0.25:
             continue
-        intv, phase, _ = candidates[si]
-        if model_key in PATCH_WEAR_DAYS:
-            # dose_raw in mcg/day (PK units); convert to mg/day
-            dose_mg = dose_raw / 1000.0
-            dose_mg = round(dose_mg / 0.025) * 0.025
-            dose_mg = max(0.025, min(0.4, dose_mg))
-        else:
-            dose_mg = round(dose_raw * 2.0) / 2.0
-            dose_mg = max(0.5, min(20.0, dose_mg))
+        intv, phase = problem.intervals[si], problem.phases[si]
         schedules.append(
             {
-                "dose_mg": dose_mg,
+                "dose_mg": round_regimen_dose(model_key, float(dose_raw)),
                 "interval_days": intv,
                 "phase_days": phase,
                 "model_key": model_key,
             }
         )
+        kept.append(si)
 
     if not schedules:
         return None
 
     # ── Fitted curve with rounded doses ──
-    curve = [0.0] * n_days
-    for sch in schedules:
-        bv = _compute_basis_vector(
-            sch["interval_days"], sch["phase_days"], d, k1, k2, k3, n_days
-        )
-        for i in range(n_days):
-            curve[i] += sch["dose_mg"] * bv[i]
-
-    rms = math.sqrt(
-        sum((target[i] - curve[i]) ** 2 for i in range(n_days)) / n_days
+    curve = problem.basis[:, kept] @ np.array(
+        [sch["dose_mg"] for sch in schedules]
     )
 
+    rms = math.sqrt(float(((problem.target - curve) ** 2).sum()) / n_days)
+
     return {
         "schedules": schedules,
         "residual_rms": round(rms, 2),
-        "cycle_fit_curve": [round(v, 1) for v in curve],
+        "cycle_fit_curve": [round(v, 1) for v in curve.tolist()],
     }
+
+
+def compute_cycle_fit_regimen(
+    ester: str, method: str, max_schedules: int = 4
+) -> dict | None:
+    """Compute a multi-schedule regimen approximating the menstrual cycle.
+
+    Uses greedy forward selection with NNLS to find up to *max_schedules*
+    dose schedules (same ester/method, varying dose/interval/phase) that
+    minimise the MSE between predicted steady-state E2 and the reference
+    menstrual-cycle E2 curve.
+
+    Returns ``{"schedules": [...], "residual_rms": float,
+    "cycle_fit_curve": [float, ...]}`` or *None*.
+    """
+    problem = _cycle_fit_problem(ester, method)
+    if problem is None:
+        return None
+    target = problem.target
+    n_days = target.shape[0]
+    n_candidates = len(problem.intervals)
+
+    # ── Greedy forward selection ──
+    selected: list[int] = []
+    baseline_mse = float((target**2).sum()) / n_days
+    prev_mse = baseline_mse
+
+    for step in range(max_schedules):
+        remaining = np.array(
+            [ci for ci in range(n_candidates) if ci not in selected]
+        )
+        if remaining.size == 0:
+            break
+        cols = np.column_stack(
+            [np.tile(selected, (remaining.shape[0], 1)), remaining]
+        ).astype(int)
+        mses = _score_column_sets(
+            problem.basis, target, problem.gram, problem.atb, cols
+        )
+        best = int(np.argmin(mses))
+        best_mse = float(mses[best])
+        if not best_mse < prev_mse:
+            break
+        best_ci = int(remaining[best])
+        if step > 0 and prev_mse > 0 and (prev_mse - best_mse) / prev_mse < 0.01:
+            break
+        selected.append(best_ci)
+        prev_mse = best_mse
+
+    return _cycle_fit_result(problem, selected)
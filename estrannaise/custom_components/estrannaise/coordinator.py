@@ -2,6 +2,7 @@
 
 from __future__ import annotations
 
+import bisect
 import logging
 import time
 from datetime import timedelta
@@ -12,7 +13,6 @@ from homeassistant.core import HomeAssistant
 from homeassistant.helpers.update_coordinator import DataUpdateCoordinator
 
 from .const import (
-    AVAILABLE_UNITS,
     CONF_AUTO_REGIMEN,
     CONF_BACKFILL_DOSES,
     CONF_DOSE_MG,
@@ -23,6 +23,8 @@ from .const import (
     CONF_METHOD,
     CONF_MODE,
     CONF_PHASE_DAYS,
+    CONF_PROCESS_POOL,
+    CONF_PROFILE,
     CONF_TARGET_TYPE,
     CONF_UNITS,
     DEFAULT_AUTO_REGIMEN,
@@ -35,23 +37,29 @@ from .const import (
     DEFAULT_METHOD,
     DEFAULT_MODE,
     DEFAULT_PHASE_DAYS,
+    DEFAULT_PROCESS_POOL,
+    DEFAULT_PROFILE,
     DEFAULT_TARGET_TYPE,
     DEFAULT_UNITS,
     DEFAULT_UPDATE_INTERVAL,
     DOMAIN,
-    MODE_AUTOMATIC,
-    MODE_BOTH,
     PK_PARAMETERS,
-    compute_e2_at_time,
-    compute_suggested_regimen,
-    resolve_model_key,
+    normalize_profile,
     terminal_elimination_days,
 )
 from .database import EstrannaisDatabase
+from .hub import EstrannaisHub
+from .schedule import get_dose_schedule
 
 _LOGGER = logging.getLogger(__name__)
 
 
+def _has_timestamp_near(sorted_ts: list[float], t: float, tolerance: float) -> bool:
+    """Return True if *sorted_ts* has a value within *tolerance* of *t*."""
+    i = bisect.bisect_right(sorted_ts, t - tolerance)
+    return i < len(sorted_ts) and sorted_ts[i] < t + tolerance
+
+
 class EstrannaisCoordinator(DataUpdateCoordinator[dict[str, Any]]):
     """Coordinator to manage estrannaise data from SQLite."""
 
@@ -62,6 +70,7 @@ class EstrannaisCoordinator(DataUpdateCoordinator[dict[str, Any]]):
         hass: HomeAssistant,
         entry: ConfigEntry,
         database: EstrannaisDatabase,
+        hub: EstrannaisHub,
     ) -> None:
         """Initialize the coordinator."""
         super().__init__(
@@ -72,6 +81,9 @@ class EstrannaisCoordinator(DataUpdateCoordinator[dict[str, Any]]):
         )
         self.config_entry = entry
         self.database = database
+        self.hub = hub
+        # (data version, sorted persisted auto-dose timestamps) for this entry
+        self._auto_ts_cache: tuple[int, list[float]] | None = None
 
     def _get_config(self) -> dict[str, Any]:
         """Get merged config from entry data + options."""
@@ -111,8 +123,19 @@ class EstrannaisCoordinator(DataUpdateCoordinator[dict[str, Any]]):
                 CONF_BACKFILL_DOSES,
                 data.get(CONF_BACKFILL_DOSES, DEFAULT_BACKFILL_DOSES),
             ),
+            "process_pool": opts.get(
+                CONF_PROCESS_POOL,
+                data.get(CONF_PROCESS_POOL, DEFAULT_PROCESS_POOL),
+            ),
+            "profile": normalize_profile(
+                opts.get(CONF_PROFILE, data.get(CONF_PROFILE, DEFAULT_PROFILE))
+            ),
         }
 
+    def retention_days(self) -> float:
+        """Minimum dose retention for this entry (90 days when backfilling)."""
+        return 90.0 if self._get_config().get("backfill_doses", False) else 0.0
+
     def _get_all_entry_configs(self) -> list[dict[str, Any]]:
         """Get configs from all estrannaise entries."""
         configs = []
@@ -124,378 +147,91 @@ class EstrannaisCoordinator(DataUpdateCoordinator[dict[str, Any]]):
                 configs.append(cfg)
         return configs
 
-    @staticmethod
-    def _generate_auto_doses_for_config(
-        config: dict[str, Any], now: float, lookback_days: float = 90.0
-    ) -> list[dict[str, Any]]:
-        """Generate synthetic dose records for a config's recurring schedule."""
-        from datetime import datetime, timezone
-        from homeassistant.util import dt as dt_util
-
-        mode = config["mode"]
-        if mode not in (MODE_AUTOMATIC, MODE_BOTH):
-            return []
-
-        ester = config["ester"]
-        method = config["method"]
-        dose_mg = config["dose_mg"]
-        interval_days = config["interval_days"]
-        if interval_days <= 0:
-            return []
-
-        # Align to time-of-day (in HA's configured local timezone)
-        dose_time = config.get("dose_time", "08:00")
-        try:
-            parts = dose_time.split(":")
-            hour = int(parts[0])
-            minute = int(parts[1]) if len(parts) > 1 else 0
-        except (ValueError, IndexError):
-            hour, minute = 8, 0
-        hour = max(0, min(23, hour))
-        minute = max(0, min(59, minute))
-
-        local_tz = dt_util.DEFAULT_TIME_ZONE
-
-        def _local_dose_anchor(ref_ts: float) -> float:
-            """Get the UTC timestamp of today's dose time in the user's timezone."""
-            ref_dt = datetime.fromtimestamp(ref_ts, tz=local_tz)
-            local_dose = ref_dt.replace(
-                hour=hour, minute=minute, second=0, microsecond=0
-            )
-            return local_dose.timestamp()
-
-        # If auto_regimen is enabled, use suggested regimen values
-        cycle_fit = None
-        if config.get("auto_regimen", False):
-            target_type = config.get("target_type", "target_range")
-            suggested = compute_suggested_regimen(ester, method, target_type)
-            if suggested:
-                if "schedules" in suggested:
-                    cycle_fit = suggested
-                else:
-                    dose_mg = suggested["dose_mg"]
-                    interval_days = suggested["interval_days"]
-
-        doses: list[dict[str, Any]] = []
-        future_limit = now + lookback_days * 86400.0
-
-        if cycle_fit:
-            # Multi-schedule cycle fit: generate future doses per schedule
-            today_anchor = _local_dose_anchor(now)
-            # Use local-time day for cycle phase calculation
-            now_local = datetime.fromtimestamp(now, tz=local_tz)
-            epoch_day_local = int(now_local.replace(
-                hour=0, minute=0, second=0, microsecond=0
-            ).timestamp() // 86400)
-            cycle_day_now = epoch_day_local % 28
-
-            for sch in cycle_fit["schedules"]:
-                sch_dose = sch["dose_mg"]
-                sch_interval = sch["interval_days"]
-                if sch_interval <= 0:
-                    continue
-                sch_phase = int(sch["phase_days"])
-                sch_model = sch["model_key"]
-                sch_interval_sec = sch_interval * 86400.0
-
-                # Anchor to most recent cycle day matching the phase
-                days_back = (cycle_day_now - sch_phase) % 28
-                anchor_ts = today_anchor - days_back * 86400.0
-
-                # Step forward to next future dose
-                t = anchor_ts
-                while t <= now:
-                    t += sch_interval_sec
-
-                while t <= future_limit:
-                    doses.append(
-                        {
-                            "id": None,
-                            "timestamp": t,
-                            "model": sch_model,
-                            "dose_mg": sch_dose,
-                            "source": "automatic",
-                        }
-                    )
-                    t += sch_interval_sec
-        else:
-            # Single schedule
-            interval_sec = interval_days * 86400.0
-            model_key = resolve_model_key(ester, method, interval_days)
-            if not model_key:
-                return []
-
-            phase_days = config.get("phase_days", 0.0)
-
-            if phase_days and phase_days > 0:
-                # Phase-based anchoring (from cycle fit discrete entry)
-                today_anchor = _local_dose_anchor(now)
-                now_local = datetime.fromtimestamp(now, tz=local_tz)
-                epoch_day_local = int(now_local.replace(
-                    hour=0, minute=0, second=0, microsecond=0
-                ).timestamp() // 86400)
-                cycle_day_now = epoch_day_local % 28
-                days_back = (cycle_day_now - int(phase_days)) % 28
-                anchor_ts = today_anchor - days_back * 86400.0
-
-                t = anchor_ts
-                while t <= now:
-                    t += interval_sec
-                while t <= future_limit:
-                    doses.append(
-                        {
-                            "id": None,
-                            "timestamp": t,
-                            "model": model_key,
-                            "dose_mg": dose_mg,
-                            "source": "automatic",
-                        }
-                    )
-                    t += interval_sec
-            else:
-                # Standard anchoring (today's dose time)
-                today_dose_ts = _local_dose_anchor(now)
-                if today_dose_ts > now:
-                    anchor = today_dose_ts - interval_sec
-                else:
-                    anchor = today_dose_ts
-
-                t = anchor + interval_sec
-                while t <= future_limit:
-                    doses.append(
-                        {
-                            "id": None,
-                            "timestamp": t,
-                            "model": model_key,
-                            "dose_mg": dose_mg,
-                            "source": "automatic",
-                        }
-                    )
-                    t += interval_sec
-
-        return doses[:1000]
-
     async def _persist_auto_doses(
         self, config: dict[str, Any], now: float
-    ) -> None:
+    ) -> int:
         """Write past automatic doses to the database.
 
-        Computes which scheduled doses should have occurred between the
-        pharmacokinetic lookback window and *now*, checks which are already
-        persisted, and inserts the missing ones.
+        Enumerates the scheduled doses between the lookback window and
+        *now* (inclusive), checks which are already persisted, and inserts
+        the missing ones.  Returns the number inserted.
         """
-        from datetime import datetime
         from homeassistant.util import dt as dt_util
 
-        mode = config.get("mode", "manual")
-        if mode not in (MODE_AUTOMATIC, MODE_BOTH):
-            return
+        schedule = get_dose_schedule(config, now, dt_util.DEFAULT_TIME_ZONE)
+        if not schedule.series:
+            return 0
 
         entry_id = self.config_entry.entry_id
-        ester = config["ester"]
-        method = config["method"]
-
-        # Parse dose time-of-day (in HA's configured local timezone)
-        dose_time_str = config.get("dose_time", "08:00")
-        try:
-            parts = dose_time_str.split(":")
-            hour = int(parts[0])
-            minute = int(parts[1]) if len(parts) > 1 else 0
-        except (ValueError, IndexError):
-            hour, minute = 8, 0
-        hour = max(0, min(23, hour))
-        minute = max(0, min(59, minute))
-
-        local_tz = dt_util.DEFAULT_TIME_ZONE
 
-        # Resolve schedule(s)
-        schedules: list[dict[str, Any]] = []
-        if config.get("auto_regimen", False):
-            target_type = config.get("target_type", "target_range")
-            suggested = compute_suggested_regimen(ester, method, target_type)
-            if suggested and "schedules" in suggested:
-                schedules = suggested["schedules"]
-            elif suggested:
-                schedules = [{
-                    "dose_mg": suggested["dose_mg"],
-                    "interval_days": suggested["interval_days"],
-                    "phase_days": 0.0,
-                    "model_key": suggested.get("model_key", ""),
-                }]
-
-        if not schedules:
-            dose_mg = config["dose_mg"]
-            interval_days = config["interval_days"]
-            model_key = resolve_model_key(ester, method, interval_days)
-            if not model_key:
-                return
-            schedules = [{
-                "dose_mg": dose_mg,
-                "interval_days": interval_days,
-                "phase_days": config.get("phase_days", 0.0),
-                "model_key": model_key,
-            }]
-
-        # Fetch existing automatic dose timestamps to avoid duplicates
-        existing_ts = await self.database.get_auto_dose_timestamps(entry_id)
-
-        for sch in schedules:
-            sch_dose = sch["dose_mg"]
-            sch_interval = sch["interval_days"]
-            sch_phase = float(sch.get("phase_days", 0.0))
-            sch_model = sch.get("model_key", "")
-            if not sch_model:
-                sch_model = resolve_model_key(ester, method, sch_interval)
-            if not sch_model:
-                continue
-
-            interval_sec = sch_interval * 86400.0
-            if interval_sec <= 0:
-                continue
-
-            if config.get("backfill_doses", False):
-                # Backfill: fill the full chart history (90 days, matching
-                # the future projection window)
-                lookback_ts = now - 90.0 * 86400.0
-            else:
-                # No backfill: only catch doses since the last refresh
-                lookback_ts = now - DEFAULT_UPDATE_INTERVAL - 60
+        # Fetch existing automatic dose timestamps (sorted) to avoid
+        # duplicates; reused while the database is unchanged
+        version = self.database.data_version
+        if self._auto_ts_cache is not None and self._auto_ts_cache[0] == version:
+            existing_ts = self._auto_ts_cache[1]
+        else:
+            existing_ts = await self.database.get_auto_dose_timestamps(entry_id)
+        new_doses: list[tuple[str, float, float]] = []
 
-            # Compute anchor timestamp (in user's local timezone)
-            now_local = datetime.fromtimestamp(now, tz=local_tz)
-            today_dose = now_local.replace(
-                hour=hour, minute=minute, second=0, microsecond=0
-            )
-            today_dose_ts = today_dose.timestamp()
+        if config.get("backfill_doses", False):
+            # Backfill: fill the full chart history (90 days, matching
+            # the future projection window)
+            lookback_ts = now - 90.0 * 86400.0
+        else:
+            # No backfill: only catch doses since the last refresh
+            lookback_ts = now - DEFAULT_UPDATE_INTERVAL - 60
 
-            if sch_phase > 0:
-                epoch_day_local = int(now_local.replace(
-                    hour=0, minute=0, second=0, microsecond=0
-                ).timestamp() // 86400)
-                cycle_day_now = epoch_day_local % 28
-                days_back = (cycle_day_now - int(sch_phase)) % 28
-                anchor_ts = today_dose_ts - days_back * 86400.0
-            else:
-                anchor_ts = today_dose_ts
+        # Every scheduled dose up to now; later ones are projected
+        for series in schedule.series:
+            for t in series.times(lookback_ts, now):
+                # Check within 60s tolerance to avoid duplicates
+                if not _has_timestamp_near(existing_ts, t, 60.0):
+                    new_doses.append((series.model_key, series.dose_mg, t))
+                    bisect.insort(existing_ts, t)
+
+        # Insert everything in one transaction
+        inserted = 0
+        if new_doses:
+            inserted = await self.database.add_auto_doses(entry_id, new_doses)
+
+        # existing_ts mirrors the table unless someone else wrote meanwhile
+        # (or a concurrent writer got some of these slots first)
+        expected = version + (1 if inserted else 0)
+        if inserted == len(new_doses) and self.database.data_version == expected:
+            self._auto_ts_cache = (self.database.data_version, existing_ts)
+        else:
+            self._auto_ts_cache = None
+        return inserted
 
-            # Walk back to find earliest dose within lookback window
-            t = anchor_ts
-            while t > lookback_ts:
-                t -= interval_sec
-            t += interval_sec  # First dose within window
+    async def async_persist_pending(self, now: float) -> int:
+        """Write this entry's pending changes (past automatic doses).
 
-            # Persist past doses that don't already exist
-            while t < now:
-                # Check within 60s tolerance to avoid duplicates
-                if not any(abs(t - ets) < 60 for ets in existing_ts):
-                    await self.database.add_dose(
-                        config_entry_id=entry_id,
-                        model=sch_model,
-                        dose_mg=sch_dose,
-                        timestamp=t,
-                        source="automatic",
-                    )
-                    existing_ts.add(t)
-                t += interval_sec
+        Returns the number of doses inserted.  Every refresh starts with
+        this; the startup barrier runs it for all entries first, so their
+        first refreshes share one shared-model computation.
+        """
+        config = self._get_config()
+        # Memoize the cycle fit the schedule may look up first
+        await self.hub.async_warm_cycle_fits([config])
+        return await self._persist_auto_doses(config, now)
 
     async def _async_update_data(self) -> dict[str, Any]:
-        """Fetch data from SQLite and compute current state."""
+        """Write this entry's pending changes, then project the shared model.
+
+        The cross-entry computation is done once per data version by the
+        hub (off the event loop); this only performs the entry's own
+        writes and derives its view.
+        """
         entry_id = self.config_entry.entry_id
         config = self._get_config()
         now = time.time()
-
-        # Persist any past automatic doses that haven't been recorded yet
-        await self._persist_auto_doses(config, now)
-
-        # Prune old doses for this entry (keep 90 days when backfill enabled)
-        retention = 90.0 if config.get("backfill_doses", False) else 0.0
-        await self.database.prune_stale_doses(entry_id, retention)
-
-        # Get ALL doses from database (manual + persisted automatic, cross-entry)
-        all_manual_doses = await self.database.get_all_doses()
-
-        # Generate automatic recurring doses for ALL entries
         all_configs = self._get_all_entry_configs()
-        all_auto_doses: list[dict[str, Any]] = []
-        for cfg in all_configs:
-            all_auto_doses.extend(
-                self._generate_auto_doses_for_config(cfg, now)
-            )
-
-        # Combine all doses for PK computation
-        combined_doses = all_manual_doses + all_auto_doses
 
-        # Get ALL blood tests (cross-entry)
-        all_blood_tests = await self.database.get_all_blood_tests()
+        # Persist any past automatic doses that haven't been recorded yet
+        await self.async_persist_pending(now)
 
-        # Compute scaling factor and variance
-        scaling_factor, scaling_variance = await self.database.compute_scaling_factor(
-            entry_id, combined_doses, all_configs=all_configs
+        # Writes above bump the database's data version, which makes the
+        # hub recompute; otherwise it only advances the level to *now*
+        return await self.hub.async_get_entry_data(
+            entry_id, config, all_configs, now
         )
-
-        # Compute current E2 level
-        units = config["units"]
-        cf = AVAILABLE_UNITS.get(units, {}).get("conversion_factor", 1.0)
-        current_e2 = compute_e2_at_time(now, combined_doses, scaling_factor) * cf
-
-        # Compute suggested regimen if auto_regimen is enabled
-        suggested_regimen = None
-        cycle_fit_regimen = None
-        if config.get("auto_regimen", False):
-            suggested_regimen = compute_suggested_regimen(
-                config["ester"],
-                config["method"],
-                config.get("target_type", "target_range"),
-            )
-            # When target is menstrual_range, suggested_regimen IS the cycle fit
-            if suggested_regimen and "schedules" in suggested_regimen:
-                cycle_fit_regimen = suggested_regimen
-
-        # Blood test baseline (zero-state handling)
-        # When predicted E2 is negligible (<1 pg/mL) at all test times,
-        # multiplicative scaling cannot work. Use the most recent blood test
-        # as a persistent baseline offset. The blood test represents the
-        # individual's actual E2 from sources the PK model can't explain
-        # (endogenous production, unlogged doses, etc.) — assumed to persist.
-        # Tests marked on_schedule=True are handled by virtual steady-state
-        # in compute_scaling_factor() and should not trigger baseline mode.
-        baseline_e2 = 0.0
-        baseline_test_ts = 0.0
-        baseline_candidates = [
-            bt for bt in all_blood_tests
-            if not bt.get("on_schedule")
-        ]
-        if baseline_candidates:
-            all_negligible = all(
-                compute_e2_at_time(bt["timestamp"], combined_doses) < 1.0
-                for bt in baseline_candidates
-            )
-            if all_negligible:
-                latest = max(baseline_candidates, key=lambda t: t["timestamp"])
-                baseline_e2 = latest["level_pg_ml"]
-                baseline_test_ts = latest["timestamp"]
-
-        # Add baseline to displayed E2 value and reset bogus scaling
-        # Decay baseline exponentially so old tests fade out (λ=0.02/day, ~35d half-life)
-        if baseline_e2 > 0:
-            import math
-            age_days = (now - baseline_test_ts) / 86400.0
-            baseline_decayed = baseline_e2 * math.exp(-0.02 * max(0, age_days))
-            scaling_factor = 1.0
-            scaling_variance = 0.0
-            current_e2 += baseline_decayed * cf
-
-        return {
-            "doses": all_manual_doses,
-            "auto_doses": all_auto_doses,
-            "blood_tests": all_blood_tests,
-            "scaling_factor": scaling_factor,
-            "scaling_variance": scaling_variance,
-            "current_e2": round(current_e2, 1),
-            "config": config,
-            "all_configs": all_configs,
-            "suggested_regimen": suggested_regimen,
-            "cycle_fit_regimen": cycle_fit_regimen,
-            "baseline_e2": round(baseline_e2, 2),
-            "baseline_test_ts": baseline_test_ts,
-        }
@@ -0,0 +1,141 @@
+"""Memoized cycle-fit regimens for Estrannaise.
+
+compute_cycle_fit_regimen is deterministic for a given (ester, method) and
+set of model inputs, but expensive.  Results are served from, in order:
+
+1. the precomputed table shipped as cycle_fit_table.json, and
+2. an in-process memo filled on first computation.
+
+Both are keyed by a fingerprint of every input the fit depends on
+(PK_PARAMETERS, MENSTRUAL_CYCLE_DATA, SUGGESTED_INTERVALS, PATCH_WEAR_DAYS,
+ESTER_METHOD_TO_MODEL), so editing any of them invalidates stale entries.
+Regenerate the shipped table with build_cycle_fit_table() after changing
+the model data.
+"""
+
+from __future__ import annotations
+
+import copy
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from .const import (
+    ESTER_METHOD_TO_MODEL,
+    MENSTRUAL_CYCLE_DATA,
+    PATCH_WEAR_DAYS,
+    PK_PARAMETERS,
+    SUGGESTED_INTERVALS,
+    compute_cycle_fit_regimen,
+)
+
+if TYPE_CHECKING:
+    from homeassistant.core import HomeAssistant
+
+_LOGGER = logging.getLogger(__name__)
+
+TABLE_PATH = Path(__file__).parent / "cycle_fit_table.json"
+
+DEFAULT_MAX_SCHEDULES = 4
+
+# fingerprint -> {(ester, method, max_schedules): result}
+_memo: dict[str, dict[tuple[str, str, int], dict | None]] = {}
+
+
+def model_fingerprint() -> str:
+    """Hash every input that compute_cycle_fit_regimen depends on."""
+    payload = json.dumps(
+        {
+            "pk": PK_PARAMETERS,
+            "cycle": MENSTRUAL_CYCLE_DATA,
+            "intervals": SUGGESTED_INTERVALS,
+            "wear": PATCH_WEAR_DAYS,
+            "models": sorted(
+                [e, m, k] for (e, m), k in ESTER_METHOD_TO_MODEL.items()
+            ),
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def _table_key(ester: str, method: str, max_schedules: int) -> str:
+    return f"{ester}/{method}/{max_schedules}"
+
+
+def _load_table() -> dict[str, Any]:
+    """Read the shipped table; an unreadable file just disables it."""
+    try:
+        return json.loads(TABLE_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError) as exc:
+        _LOGGER.debug("Cycle-fit table unavailable: %s", exc)
+        return {}
+
+
+_TABLE = _load_table()
+
+
+def lookup_cycle_fit_regimen(
+    ester: str, method: str, max_schedules: int = DEFAULT_MAX_SCHEDULES
+) -> tuple[bool, dict | None]:
+    """Return (hit, result) without computing anything on a miss."""
+    fingerprint = model_fingerprint()
+    key = (ester, method, max_schedules)
+    memo = _memo.get(fingerprint)
+    if memo is not None and key in memo:
+        return True, copy.deepcopy(memo[key])
+
+    if _TABLE.get("fingerprint") == fingerprint:
+        entries = _TABLE.get("entries", {})
+        table_key = _table_key(ester, method, max_schedules)
+        if table_key in entries:
+            result = entries[table_key]
+            _memo.setdefault(fingerprint, {})[key] = result
+            return True, copy.deepcopy(result)
+
+    return False, None
+
+
+def get_cycle_fit_regimen(
+    ester: str, method: str, max_schedules: int = DEFAULT_MAX_SCHEDULES
+) -> dict | None:
+    """Cached compute_cycle_fit_regimen (computes and memoizes on a miss)."""
+    hit, result = lookup_cycle_fit_regimen(ester, method, max_schedules)
+    if hit:
+        return result
+    fingerprint = model_fingerprint()
+    result = compute_cycle_fit_regimen(ester, method, max_schedules)
+    # Drop memo generations for outdated model inputs
+    for stale in [fp for fp in _memo if fp != fingerprint]:
+        del _memo[stale]
+    _memo.setdefault(fingerprint, {})[(ester, method, max_schedules)] = result
+    return copy.deepcopy(result)
+
+
+async def async_get_cycle_fit_regimen(
+    hass: HomeAssistant,
+    ester: str,
+    method: str,
+    max_schedules: int = DEFAULT_MAX_SCHEDULES,
+) -> dict | None:
+    """Like get_cycle_fit_regimen, but computes misses in the executor."""
+    hit, result = lookup_cycle_fit_regimen(ester, method, max_schedules)
+    if hit:
+        return result
+    return await hass.async_add_executor_job(
+        get_cycle_fit_regimen, ester, method, max_schedules
+    )
+
+
+def build_cycle_fit_table(
+    max_schedules: int = DEFAULT_MAX_SCHEDULES,
+) -> dict[str, Any]:
+    """Compute the shipped table for every supported ester/method pair."""
+    entries: dict[str, dict | None] = {}
+    for ester, method in sorted(ESTER_METHOD_TO_MODEL):
+        entries[_table_key(ester, method, max_schedules)] = (
+            compute_cycle_fit_regimen(ester, method, max_schedules)
+        )
+    return {"fingerprint": model_fingerprint(), "entries": entries}
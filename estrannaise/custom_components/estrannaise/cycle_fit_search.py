@@ -0,0 +1,318 @@
+"""Beam and exhaustive cycle-fit search for Estrannaise.
+
+compute_cycle_fit_regimen selects schedules greedily and stops early, so it
+can miss better combinations.  The searches here score many candidate
+subsets with the same batched NNLS scorer, spread the work across a
+process pool, stop at a time budget, and return the best regimens ranked
+by residual RMS.  The greedy regimen always takes part in the ranking, so
+a search never returns anything worse than the default fit.
+"""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import logging
+import multiprocessing
+import os
+import time
+from collections.abc import Callable, Iterator
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    wait,
+)
+from concurrent.futures.process import BrokenProcessPool
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from .const import (
+    FIT_MODE_BEAM,
+    FIT_MODE_EXHAUSTIVE,
+    CycleFitProblem,
+    _cycle_fit_problem,
+    _cycle_fit_result,
+    _score_column_sets,
+)
+from .cycle_fit_cache import get_cycle_fit_regimen
+
+if TYPE_CHECKING:
+    from homeassistant.core import HomeAssistant
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_TIME_BUDGET = 20.0  # seconds
+DEFAULT_TOP_K = 3
+DEFAULT_BEAM_WIDTH = 24
+# Search processes; each spawned worker re-imports the integration, so
+# the pool stays small
+DEFAULT_MAX_WORKERS = 2
+
+# Subsets scored per work item sent to a worker
+_CHUNK_SIZE = 4000
+
+
+def _score_chunk(
+    basis: np.ndarray,
+    target: np.ndarray,
+    gram: np.ndarray,
+    atb: np.ndarray,
+    cols: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Worker entry point: score a (n_subsets, k) block of column sets."""
+    return cols, _score_column_sets(basis, target, gram, atb, cols)
+
+
+class _ChunkRunner:
+    """Runs scoring chunks in a process pool (or inline) under a deadline."""
+
+    def __init__(
+        self, problem: CycleFitProblem, deadline: float, max_workers: int | None
+    ) -> None:
+        self._args = (problem.basis, problem.target, problem.gram, problem.atb)
+        self._deadline = deadline
+        self._executor: Executor | None = None
+        cpus = os.cpu_count() or 1
+        if max_workers:
+            max_workers = min(max_workers, cpus)
+        self._max_pending = 2 * (max_workers or cpus)
+        self.complete = True
+        self.evaluated = 0
+        if max_workers != 0:
+            try:
+                # spawn: forking HA's multi-threaded process is unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            except (OSError, NotImplementedError, ValueError) as exc:
+                _LOGGER.debug("Process pool unavailable, searching inline: %s", exc)
+
+    def close(self) -> None:
+        """Shut the pool down without waiting for cancelled work."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def run(
+        self,
+        chunks: Iterator[np.ndarray],
+        consume: Callable[[np.ndarray, np.ndarray], None],
+    ) -> None:
+        """Score every chunk, feeding results to *consume*, until the deadline."""
+        if self._executor is not None:
+            try:
+                self._run_pool(chunks, consume)
+                return
+            except BrokenProcessPool:
+                _LOGGER.warning("Cycle-fit process pool failed, searching inline")
+                self._executor = None
+        for cols in chunks:
+            if time.monotonic() >= self._deadline:
+                self.complete = False
+                return
+            consume(*_score_chunk(*self._args, cols))
+            self.evaluated += cols.shape[0]
+
+    def _run_pool(
+        self,
+        chunks: Iterator[np.ndarray],
+        consume: Callable[[np.ndarray, np.ndarray], None],
+    ) -> None:
+        """Keep a bounded number of chunks in flight until done or timed out."""
+        assert self._executor is not None
+        pending: set[Future] = set()
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < self._max_pending:
+                cols = next(chunks, None)
+                if cols is None:
+                    exhausted = True
+                    break
+                pending.add(
+                    self._executor.submit(_score_chunk, *self._args, cols)
+                )
+            if not pending:
+                return
+            remaining = self._deadline - time.monotonic()
+            if remaining <= 0:
+                self.complete = False
+                for fut in pending:
+                    fut.cancel()
+                return
+            done, pending = wait(
+                pending, timeout=remaining, return_when=FIRST_COMPLETED
+            )
+            for fut in done:
+                cols, mses = fut.result()
+                consume(cols, mses)
+                self.evaluated += cols.shape[0]
+
+
+def _chunked(subsets: Iterator[tuple[int, ...]], k: int) -> Iterator[np.ndarray]:
+    """Group same-size subsets into (n, k) index arrays."""
+    while True:
+        block = list(itertools.islice(subsets, _CHUNK_SIZE))
+        if not block:
+            return
+        yield np.array(block, dtype=int).reshape(len(block), k)
+
+
+class _TopSubsets:
+    """Keeps the *size* lowest-MSE subsets seen so far."""
+
+    def __init__(self, size: int) -> None:
+        self._size = size
+        self._heap: list[tuple[float, tuple[int, ...]]] = []
+
+    def consume(self, cols: np.ndarray, mses: np.ndarray) -> None:
+        """Merge a scored chunk into the running top list."""
+        if cols.shape[0] > self._size:
+            keep = np.argpartition(mses, self._size)[: self._size]
+        else:
+            keep = np.arange(cols.shape[0])
+        for i in keep.tolist():
+            item = (-float(mses[i]), tuple(cols[i].tolist()))
+            if len(self._heap) < self._size:
+                heapq.heappush(self._heap, item)
+            elif item > self._heap[0]:
+                heapq.heapreplace(self._heap, item)
+
+    def best(self) -> list[tuple[int, ...]]:
+        """Return the kept subsets, best first."""
+        return [s for _neg, s in sorted(self._heap, reverse=True)]
+
+
+def _exhaustive(
+    problem: CycleFitProblem,
+    runner: _ChunkRunner,
+    max_schedules: int,
+    keep: int,
+) -> list[tuple[int, ...]]:
+    """Score every subset of up to *max_schedules* candidates."""
+    top = _TopSubsets(keep)
+    n = len(problem.intervals)
+    for k in range(1, max_schedules + 1):
+        runner.run(_chunked(itertools.combinations(range(n), k), k), top.consume)
+        if not runner.complete:
+            break
+    return top.best()
+
+
+def _beam(
+    problem: CycleFitProblem,
+    runner: _ChunkRunner,
+    max_schedules: int,
+    keep: int,
+    beam_width: int,
+) -> list[tuple[int, ...]]:
+    """Grow the *beam_width* best subsets by one candidate per level."""
+    top = _TopSubsets(keep)
+    n = len(problem.intervals)
+    beam: list[tuple[int, ...]] = [()]
+    for k in range(1, max_schedules + 1):
+        expansions = sorted(
+            {
+                tuple(sorted(state + (c,)))
+                for state in beam
+                for c in range(n)
+                if c not in state
+            }
+        )
+        level = _TopSubsets(beam_width)
+
+        def _consume(cols: np.ndarray, mses: np.ndarray) -> None:
+            top.consume(cols, mses)
+            level.consume(cols, mses)
+
+        runner.run(_chunked(iter(expansions), k), _consume)
+        beam = level.best()
+        if not runner.complete or not beam:
+            break
+    return top.best()
+
+
+def search_cycle_fit_regimens(
+    ester: str,
+    method: str,
+    mode: str = FIT_MODE_BEAM,
+    max_schedules: int = 4,
+    top_k: int = DEFAULT_TOP_K,
+    time_budget: float = DEFAULT_TIME_BUDGET,
+    beam_width: int = DEFAULT_BEAM_WIDTH,
+    max_workers: int | None = DEFAULT_MAX_WORKERS,
+) -> list[dict]:
+    """Return up to *top_k* cycle-fit regimens ranked by residual RMS.
+
+    *mode*: FIT_MODE_BEAM or FIT_MODE_EXHAUSTIVE.  *time_budget* caps the
+    wall-clock search time (seconds); a search cut short still ranks
+    everything it scored.  *max_workers*: process count, at most the CPU
+    count (None = CPU count, 0 = search inline).  The greedy regimen is
+    always a candidate, so the first result is never worse than
+    compute_cycle_fit_regimen.
+    Blocking: call from an executor (see async_search_cycle_fit_regimens).
+    """
+    greedy = get_cycle_fit_regimen(ester, method, max_schedules)
+    problem = _cycle_fit_problem(ester, method)
+    if problem is None:
+        return [greedy] if greedy else []
+
+    deadline = time.monotonic() + max(0.0, time_budget)
+    runner = _ChunkRunner(problem, deadline, max_workers)
+    # Rounding doses reorders near-equal fits, so keep extra raw candidates
+    keep = max(4 * top_k, top_k + 8)
+    try:
+        if mode == FIT_MODE_EXHAUSTIVE:
+            subsets = _exhaustive(problem, runner, max_schedules, keep)
+        else:
+            subsets = _beam(problem, runner, max_schedules, keep, beam_width)
+    finally:
+        runner.close()
+
+    _LOGGER.debug(
+        "Cycle-fit %s search for %s/%s scored %d subsets (%s)",
+        mode,
+        ester,
+        method,
+        runner.evaluated,
+        "complete" if runner.complete else "time budget reached",
+    )
+
+    results: list[dict] = [greedy] if greedy else []
+    for subset in subsets:
+        result = _cycle_fit_result(problem, list(subset))
+        if result is not None:
+            results.append(result)
+
+    # Deduplicate regimens that round to the same schedules
+    ranked: list[dict] = []
+    seen: set[tuple] = set()
+    for result in sorted(results, key=lambda r: r["residual_rms"]):
+        key = tuple(
+            sorted(
+                (s["dose_mg"], s["interval_days"], s["phase_days"])
+                for s in result["schedules"]
+            )
+        )
+        if key in seen:
+            continue
+        seen.add(key)
+        ranked.append({**result, "search_mode": mode, "complete": runner.complete})
+        if len(ranked) >= top_k:
+            break
+    return ranked
+
+
+async def async_search_cycle_fit_regimens(
+    hass: HomeAssistant,
+    ester: str,
+    method: str,
+    mode: str = FIT_MODE_BEAM,
+    **kwargs,
+) -> list[dict]:
+    """Run search_cycle_fit_regimens in the executor, off the event loop."""
+    return await hass.async_add_executor_job(
+        lambda: search_cycle_fit_regimens(ester, method, mode, **kwargs)
+    )
@@ -3,46 +3,197 @@
 from __future__ import annotations
 
 import asyncio
+import json
 import logging
 import math
+import sqlite3
 import time
+from collections.abc import Callable, Sequence
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any
+from typing import Any, NamedTuple
 
 import aiosqlite
 
-from .const import PK_PARAMETERS, PATCH_WEAR_DAYS, terminal_elimination_days
+from .const import (
+    DEFAULT_PROFILE,
+    PK_PARAMETERS,
+    PATCH_WEAR_DAYS,
+    terminal_elimination_days,
+)
+from .mirror import BLOOD_TEST_COLUMNS, DOSE_COLUMNS, ColumnMirror
+from .pipeline import compute_scaling_factor
+from .pk import DoseArrays
 
 _LOGGER = logging.getLogger(__name__)
 
-SCHEMA_VERSION = 2
+SCHEMA_VERSION = 3
+
+# Queued writes are committed together once per window (seconds)
+WRITE_FLUSH_WINDOW = 0.5
+# ... or as soon as this many are pending
+WRITE_QUEUE_MAX_BATCH = 500
+
+# Free pages released per incremental vacuum pass
+COMPACT_MAX_PAGES = 2000
+
+# Rows newer than this (at setup) are mirrored in memory; older ones are
+# read from SQL on demand
+MIRROR_WINDOW_DAYS = 365.0
+
+# Fixed ids of the built-in dose sources (partial indexes need constants)
+SOURCE_MANUAL = 1
+SOURCE_AUTOMATIC = 2
+BUILTIN_SOURCES = ((SOURCE_MANUAL, "manual"), (SOURCE_AUTOMATIC, "automatic"))
+
+# Schema v3: config entry ids, models and sources are integer references
+# into small dictionary tables, and timestamps are whole epoch seconds.
+CREATE_TABLES = f"""
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS models (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS sources (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
 
-CREATE_TABLES = """
 CREATE TABLE IF NOT EXISTS doses (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
-    config_entry_id TEXT NOT NULL,
-    timestamp REAL NOT NULL,
-    model TEXT NOT NULL,
+    entry_id INTEGER NOT NULL REFERENCES entries(id),
+    profile_id TEXT NOT NULL DEFAULT '{DEFAULT_PROFILE}',
+    timestamp INTEGER NOT NULL,
+    model_id INTEGER NOT NULL REFERENCES models(id),
     dose_mg REAL NOT NULL,
-    source TEXT NOT NULL DEFAULT 'manual',
-    created_at REAL NOT NULL
+    source_id INTEGER NOT NULL DEFAULT {SOURCE_MANUAL} REFERENCES sources(id),
+    created_at INTEGER NOT NULL
 );
 
 CREATE TABLE IF NOT EXISTS blood_tests (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
-    config_entry_id TEXT NOT NULL,
-    timestamp REAL NOT NULL,
+    entry_id INTEGER NOT NULL REFERENCES entries(id),
+    profile_id TEXT NOT NULL DEFAULT '{DEFAULT_PROFILE}',
+    timestamp INTEGER NOT NULL,
     level_pg_ml REAL NOT NULL,
     notes TEXT,
-    created_at REAL NOT NULL
+    on_schedule INTEGER,
+    created_at INTEGER NOT NULL
 );
 
+CREATE TABLE IF NOT EXISTS doses_archive (
+    id INTEGER PRIMARY KEY,
+    entry_id INTEGER NOT NULL REFERENCES entries(id),
+    profile_id TEXT NOT NULL DEFAULT '{DEFAULT_PROFILE}',
+    timestamp INTEGER NOT NULL,
+    model_id INTEGER NOT NULL REFERENCES models(id),
+    dose_mg REAL NOT NULL,
+    source_id INTEGER NOT NULL REFERENCES sources(id),
+    created_at INTEGER NOT NULL,
+    archived_at INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS pk_state (
+    profile_key TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+# Entry and profile range reads, plus two covering indexes: the archive's
+# (entry, model, cutoff) scan (rowid is part of every index) and
+# automatic-dose timestamps.  The automatic slot index also keeps one
+# automatic dose per entry and time slot; source_id is constant inside it
+# and only listed so the planner treats the index as covering.
+CREATE_INDEXES = f"""
 CREATE INDEX IF NOT EXISTS idx_doses_entry_ts
-    ON doses(config_entry_id, timestamp);
+    ON doses(entry_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_doses_profile_ts
+    ON doses(profile_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_doses_entry_model_ts
+    ON doses(entry_id, model_id, timestamp);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_doses_auto_slot
+    ON doses(entry_id, timestamp, source_id)
+    WHERE source_id = {SOURCE_AUTOMATIC};
 CREATE INDEX IF NOT EXISTS idx_blood_tests_entry_ts
-    ON blood_tests(config_entry_id, timestamp);
+    ON blood_tests(entry_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_blood_tests_profile_ts
+    ON blood_tests(profile_id, timestamp)
 """
 
+# Automatic doses that share a slot after timestamps are rounded (or were
+# duplicated by older versions); the lowest id is kept
+DEDUPE_AUTO_DOSES = f"""
+DELETE FROM doses
+WHERE source_id = {SOURCE_AUTOMATIC} AND id NOT IN (
+    SELECT MIN(id) FROM doses WHERE source_id = {SOURCE_AUTOMATIC}
+    GROUP BY entry_id, timestamp
+)
+"""
+
+# Dictionary lookups for writes (one bound name each)
+ENTRY_REF = "(SELECT id FROM entries WHERE name = ?)"
+MODEL_REF = "(SELECT id FROM models WHERE name = ?)"
+SOURCE_REF = "(SELECT id FROM sources WHERE name = ?)"
+
+# Dictionary-encoded row fields: name -> (stored column, dictionary table).
+# Reads select the stored ids and the reader resolves them from cached
+# dictionaries, which is cheaper than joining every row.
+REFERENCES = {
+    "config_entry_id": ("entry_id", "entries"),
+    "model": ("model_id", "models"),
+    "source": ("source_id", "sources"),
+}
+
+
+def _stored_columns(names: Sequence[str]) -> str:
+    """SELECT list for row fields *names* (references left as ids)."""
+    return ", ".join(
+        REFERENCES[name][0] if name in REFERENCES else name for name in names
+    )
+
+
+def _statements(script: str) -> list[str]:
+    """Split a schema script into statements.
+
+    Lets a script run inside a larger transaction (executescript commits
+    first).
+    """
+    return [stmt.strip() for stmt in script.split(";") if stmt.strip()]
+
+
+class CompactionReport(NamedTuple):
+    """Outcome of EstrannaisDatabase.async_compact."""
+
+    database_bytes: int
+    reclaimed_bytes: int
+    wal_bytes_reclaimed: int
+    full_vacuum: bool
+
+
+class DatabaseSnapshot(NamedTuple):
+    """Consistent view of the stored data (see EstrannaisDatabase.async_snapshot)."""
+
+    data_version: int
+    doses: list[dict[str, Any]]
+    blood_tests: list[dict[str, Any]]
+
+
+class _PendingWrite(NamedTuple):
+    """A queued mutation and the future its caller awaits."""
+
+    sql: str
+    params: tuple[Any, ...]
+    returns_row_id: bool
+    future: asyncio.Future
+    # Applies the committed write to the in-memory mirror
+    on_commit: Callable[[Any], None] | None = None
+
 
 class EstrannaisDatabase:
     """Async SQLite database wrapper for estrannaise data."""
@@ -51,22 +202,75 @@ class EstrannaisDatabase:
         self._db_path = str(db_path)
         self._db: aiosqlite.Connection | None = None
         self._write_lock = asyncio.Lock()
+        self._data_version = 0
+        self._pending: list[_PendingWrite] = []
+        self._flush_timer: asyncio.TimerHandle | None = None
+        # Background flush started by the timer or a full batch
+        self._flush_task: asyncio.Task | None = None
+        self._closed = False
+        self._flush_listeners: list[Callable[[], None]] = []
+        # Write-through mirrors (see mirror.py), plus the number of rows
+        # each table holds before the mirror window
+        window_start = time.time() - MIRROR_WINDOW_DAYS * 86400.0
+        self._doses = ColumnMirror(DOSE_COLUMNS, window_start)
+        self._blood_tests = ColumnMirror(BLOOD_TEST_COLUMNS, window_start)
+        self._older_doses = 0
+        self._older_blood_tests = 0
+        # Dedicated read-only connection on its own thread, so reads never
+        # queue behind the writer connection
+        self._reader: ThreadPoolExecutor | None = None
+        self._reader_conn: sqlite3.Connection | None = None
+        # config entry id -> profile id its new rows are written under
+        self._entry_profiles: dict[str, str] = {}
+        # Reader thread only: id -> name for each dictionary table
+        self._reader_names: dict[str, dict[int, str]] = {
+            table: {} for _column, table in REFERENCES.values()
+        }
+        # Names already present in each dictionary table
+        self._labels: dict[str, set[str]] = {
+            "entries": set(),
+            "models": set(),
+            "sources": set(),
+        }
+
+    @property
+    def data_version(self) -> int:
+        """Change counter, bumped by every write to doses or blood tests.
+
+        Monotonic for the lifetime of this object, so callers can cache
+        anything derived from the stored data under the version they read.
+        (PRAGMA data_version would not see this connection's own commits.)
+        """
+        return self._data_version
 
     async def async_setup(self) -> None:
         """Open the database and create tables if needed."""
         self._db = await aiosqlite.connect(self._db_path)
         self._db.row_factory = aiosqlite.Row
+        # Only takes effect on a new (empty) file, so it must precede the
+        # WAL switch; existing files are converted by their first async_compact
+        await self._db.execute("PRAGMA auto_vacuum = INCREMENTAL")
         # WAL mode allows concurrent reads during writes
         await self._db.execute("PRAGMA journal_mode = WAL")
         # Wait up to 5s for locks instead of failing immediately
         await self._db.execute("PRAGMA busy_timeout = 5000")
-        await self._db.executescript(CREATE_TABLES)
-        await self._db.commit()
 
-        # Schema migration: add on_schedule column (v2)
         cursor = await self._db.execute("PRAGMA user_version")
         row = await cursor.fetchone()
         db_version = row[0] if row else 0
+        cursor = await self._db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'doses'"
+        )
+        if await cursor.fetchone() is None:
+            # New file: created at the current schema directly
+            await self._db.execute("BEGIN")
+            for statement in _statements(CREATE_TABLES + ";" + CREATE_INDEXES):
+                await self._db.execute(statement)
+            await self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            await self._db.commit()
+            db_version = SCHEMA_VERSION
+
+        # Schema migration: add on_schedule column (v2)
         if db_version < 2:
             try:
                 await self._db.execute(
@@ -81,177 +285,873 @@ class EstrannaisDatabase:
             await self._db.commit()
             _LOGGER.info("Estrannaise database migrated to schema v2")
 
+        # Schema migration: dictionary references, integer timestamps (v3)
+        if db_version < 3:
+            await self._migrate_v3()
+
+        for table in self._labels:
+            cursor = await self._db.execute(f"SELECT name FROM {table}")
+            self._labels[table] = {row[0] for row in await cursor.fetchall()}
+        # Built-in sources and every known model (new releases may add some)
+        missing_sources = [
+            (source_id, name)
+            for source_id, name in BUILTIN_SOURCES
+            if name not in self._labels["sources"]
+        ]
+        missing_models = set(PK_PARAMETERS) - self._labels["models"]
+        if missing_sources or missing_models:
+            await self._db.executemany(
+                "INSERT OR IGNORE INTO sources (id, name) VALUES (?, ?)",
+                missing_sources,
+            )
+            await self._db.executemany(
+                "INSERT OR IGNORE INTO models (name) VALUES (?)",
+                [(model,) for model in missing_models],
+            )
+            await self._db.commit()
+            self._labels["sources"].update(name for _id, name in missing_sources)
+            self._labels["models"] |= missing_models
+
+        self._reader = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="estrannaise_reader"
+        )
+        self._older_doses = await self._load_mirror("doses", self._doses)
+        self._older_blood_tests = await self._load_mirror(
+            "blood_tests", self._blood_tests
+        )
+
         _LOGGER.debug("Estrannaise database initialized at %s", self._db_path)
 
+    async def _migrate_v3(self) -> None:
+        """Rebuild the v2 tables in the v3 layout, in one transaction.
+
+        Entry ids, models and sources become dictionary references, timestamps
+        are rounded to whole seconds and every row keeps its id (and each
+        table its AUTOINCREMENT sequence, so archived ids are never
+        reused).  Tables or columns that older versions lacked are filled
+        with their defaults.
+        """
+        assert self._db is not None
+        legacy: dict[str, set[str]] = {}
+        for table in ("doses", "blood_tests", "doses_archive"):
+            cursor = await self._db.execute(f"PRAGMA table_info({table})")
+            columns = {row["name"] for row in await cursor.fetchall()}
+            if columns:
+                legacy[table] = columns
+        cursor = await self._db.execute("SELECT name, seq FROM sqlite_sequence")
+        sequences = {row[0]: row[1] for row in await cursor.fetchall()}
+        cursor = await self._db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' "
+            f"AND sql IS NOT NULL AND tbl_name IN ({', '.join('?' * len(legacy))})",
+            tuple(legacy),
+        )
+        indexes = [row[0] for row in await cursor.fetchall()]
+
+        def _profile(table: str) -> str:
+            if "profile_id" in legacy[table]:
+                return "t.profile_id"
+            return f"'{DEFAULT_PROFILE}'"
+
+        try:
+            await self._db.execute("BEGIN")
+            for index in indexes:
+                await self._db.execute(f"DROP INDEX {index}")
+            for table in legacy:
+                await self._db.execute(f"ALTER TABLE {table} RENAME TO {table}_v2")
+            for statement in _statements(CREATE_TABLES):
+                await self._db.execute(statement)
+            await self._db.executemany(
+                "INSERT OR IGNORE INTO sources (id, name) VALUES (?, ?)",
+                BUILTIN_SOURCES,
+            )
+            for table in legacy:
+                await self._db.execute(
+                    "INSERT OR IGNORE INTO entries (name) "
+                    f"SELECT DISTINCT config_entry_id FROM {table}_v2"
+                )
+            for table in ("doses", "doses_archive"):
+                if table not in legacy:
+                    continue
+                await self._db.execute(
+                    "INSERT OR IGNORE INTO models (name) "
+                    f"SELECT DISTINCT model FROM {table}_v2"
+                )
+                await self._db.execute(
+                    "INSERT OR IGNORE INTO sources (name) "
+                    f"SELECT DISTINCT source FROM {table}_v2"
+                )
+                archived_at = (
+                    ", CAST(ROUND(t.archived_at) AS INTEGER)"
+                    if table == "doses_archive"
+                    else ""
+                )
+                await self._db.execute(
+                    f"INSERT INTO {table} (id, entry_id, profile_id, "
+                    "timestamp, model_id, dose_mg, source_id, created_at"
+                    f"{', archived_at' if archived_at else ''}) "
+                    f"SELECT t.id, e.id, {_profile(table)}, "
+                    "CAST(ROUND(t.timestamp) AS INTEGER), m.id, t.dose_mg, "
+                    "s.id, CAST(ROUND(t.created_at) AS INTEGER)"
+                    f"{archived_at} FROM {table}_v2 t "
+                    "JOIN entries e ON e.name = t.config_entry_id "
+                    "JOIN models m ON m.name = t.model "
+                    "JOIN sources s ON s.name = t.source"
+                )
+            if "blood_tests" in legacy:
+                await self._db.execute(
+                    "INSERT INTO blood_tests (id, entry_id, profile_id, "
+                    "timestamp, level_pg_ml, notes, on_schedule, created_at) "
+                    f"SELECT t.id, e.id, {_profile('blood_tests')}, "
+                    "CAST(ROUND(t.timestamp) AS INTEGER), t.level_pg_ml, t.notes, "
+                    "t.on_schedule, CAST(ROUND(t.created_at) AS INTEGER) "
+                    "FROM blood_tests_v2 t "
+                    "JOIN entries e ON e.name = t.config_entry_id"
+                )
+            cursor = await self._db.execute(DEDUPE_AUTO_DOSES)
+            if cursor.rowcount > 0:
+                _LOGGER.info(
+                    "Removed %d duplicate automatic doses", cursor.rowcount
+                )
+            for table in legacy:
+                await self._db.execute(f"DROP TABLE {table}_v2")
+            for table in ("doses", "blood_tests"):
+                seq = sequences.get(table, 0)
+                cursor = await self._db.execute(
+                    "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?",
+                    (seq, table),
+                )
+                if cursor.rowcount == 0 and seq:
+                    await self._db.execute(
+                        "INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)",
+                        (table, seq),
+                    )
+            for statement in _statements(CREATE_INDEXES):
+                await self._db.execute(statement)
+            await self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            await self._db.commit()
+        except Exception as exc:
+            await self._db.rollback()
+            _LOGGER.warning("Schema migration failed: %s", exc)
+            raise
+        _LOGGER.info("Estrannaise database migrated to schema v3")
+
+    async def _load_mirror(self, table: str, mirror: ColumnMirror) -> int:
+        """Fill *mirror* from *table*; return the number of older rows."""
+        assert self._db is not None
+        (rows,) = await self._async_read(
+            self._read_rows,
+            [(
+                mirror.names,
+                f"SELECT {_stored_columns(mirror.names)} FROM {table} "
+                "WHERE timestamp >= ? ORDER BY timestamp ASC",
+                (mirror.window_start,),
+            )],
+        )
+        mirror.load(rows)
+        return await self._count_older(table, mirror)
+
+    async def _count_older(self, table: str, mirror: ColumnMirror) -> int:
+        """Count the rows of *table* before the mirror window."""
+        assert self._db is not None
+        cursor = await self._db.execute(
+            f"SELECT COUNT(*) FROM {table} WHERE timestamp < ?",
+            (mirror.window_start,),
+        )
+        return (await cursor.fetchone())[0]
+
+    async def _read_older(
+        self,
+        table: str,
+        mirror: ColumnMirror,
+        since: float | None,
+        config_entry_id: str | None = None,
+    ) -> list[dict[str, Any]]:
+        """Read rows before the mirror window (reader connection, not kept)."""
+        if since is not None and since >= mirror.window_start:
+            return []
+        query = (
+            f"SELECT {_stored_columns(mirror.names)} FROM {table} "
+            "WHERE timestamp < ?"
+        )
+        params: list[Any] = [mirror.window_start]
+        if since is not None:
+            query += " AND timestamp >= ?"
+            params.append(since)
+        if config_entry_id is not None:
+            query += f" AND entry_id = {ENTRY_REF}"
+            params.append(config_entry_id)
+        (rows,) = await self._async_read(
+            self._read_rows,
+            [(mirror.names, query + " ORDER BY timestamp ASC", params)],
+        )
+        return [dict(zip(mirror.names, row)) for row in rows]
+
+    # ── Reader connection ────────────────────────────────────────────────────
+
+    async def _async_read(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Run *func* on the reader thread (one hop, off the writer)."""
+        if self._reader is None:
+            raise RuntimeError("Estrannaise database is not initialized")
+        return await asyncio.get_running_loop().run_in_executor(
+            self._reader, func, *args
+        )
+
+    def _reader_connection(self) -> sqlite3.Connection:
+        """Return the read-only connection (reader thread only)."""
+        if self._reader_conn is None:
+            uri = Path(self._db_path).resolve().as_uri() + "?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA busy_timeout = 5000")
+            self._reader_conn = conn
+        return self._reader_conn
+
+    def _read_queries(
+        self, queries: list[tuple[str, Sequence[Any]]]
+    ) -> list[list[dict[str, Any]]]:
+        """Run SELECTs in one read transaction (reader thread only).
+
+        Returns the rows of each query as dicts.
+        """
+        conn = self._reader_connection()
+        conn.execute("BEGIN")
+        try:
+            results = [
+                [dict(row) for row in conn.execute(query, params)]
+                for query, params in queries
+            ]
+        finally:
+            conn.execute("COMMIT")
+        return results
+
+    def _read_rows(
+        self, queries: list[tuple[Sequence[str], str, Sequence[Any]]]
+    ) -> list[list[tuple[Any, ...]]]:
+        """Run row SELECTs in one read transaction (reader thread only).
+
+        Each query is (row field names, SQL selecting their stored columns,
+        params); rows come back as tuples in field order with dictionary
+        references resolved to names.
+        """
+        conn = self._reader_connection()
+        conn.execute("BEGIN")
+        try:
+            results = []
+            for names, sql, params in queries:
+                cursor = conn.execute(sql, params)
+                cursor.row_factory = None
+                results.append(
+                    self._resolve_references(conn, names, cursor.fetchall())
+                )
+            return results
+        finally:
+            conn.execute("COMMIT")
+
+    def _resolve_references(
+        self,
+        conn: sqlite3.Connection,
+        names: Sequence[str],
+        rows: list[tuple[Any, ...]],
+    ) -> list[tuple[Any, ...]]:
+        """Replace dictionary ids in *rows* by names (reader thread only)."""
+        refs = [
+            (pos, REFERENCES[name][1])
+            for pos, name in enumerate(names)
+            if name in REFERENCES
+        ]
+        if not refs or not rows:
+            return rows
+        # Column-wise, so each lookup runs as one map()
+        columns = list(zip(*rows))
+        for pos, table in refs:
+            names_by_id = self._reader_names[table]
+            try:
+                columns[pos] = tuple(map(names_by_id.__getitem__, columns[pos]))
+            except KeyError:
+                # A name added since the dictionary was cached
+                names_by_id = self._reader_names[table] = dict(
+                    conn.execute(f"SELECT id, name FROM {table}").fetchall()
+                )
+                columns[pos] = tuple(map(names_by_id.__getitem__, columns[pos]))
+        return list(zip(*columns))
+
+    def _close_reader(self) -> None:
+        """Close the read-only connection (reader thread only)."""
+        if self._reader_conn is not None:
+            self._reader_conn.close()
+            self._reader_conn = None
+
+    def _mirror_dose(self, row: tuple[Any, ...]) -> None:
+        """Record a committed dose insert in the mirror."""
+        if self._doses.covers(row[2]):
+            self._doses.insert(row)
+        else:
+            self._older_doses += 1
+
+    def _unmirror_dose(self, dose_id: int) -> None:
+        """Record a committed dose deletion in the mirror."""
+        if not self._doses.remove_id(dose_id):
+            self._older_doses -= 1
+
+    def _mirror_blood_test(self, row: tuple[Any, ...]) -> None:
+        """Record a committed blood test insert in the mirror."""
+        if self._blood_tests.covers(row[2]):
+            self._blood_tests.insert(row)
+        else:
+            self._older_blood_tests += 1
+
+    def _unmirror_blood_test(self, test_id: int) -> None:
+        """Record a committed blood test deletion in the mirror."""
+        if not self._blood_tests.remove_id(test_id):
+            self._older_blood_tests -= 1
+
     async def async_close(self) -> None:
-        """Close the database connection."""
+        """Flush queued writes and close the database connection."""
+        # Refuse new writes; the ones already queued are flushed below
+        self._closed = True
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if self._flush_task is not None:
+            await self._flush_task
+            self._flush_task = None
+        if self._reader is not None:
+            await self._async_read(self._close_reader)
+            self._reader.shutdown(wait=False)
+            self._reader = None
         if self._db:
+            await self.async_flush()
             await self._db.close()
             self._db = None
+        self._fail_pending(RuntimeError("Estrannaise database is closed"))
+
+    # ── Profiles ─────────────────────────────────────────────────────────────
+
+    def entry_profile(self, config_entry_id: str) -> str:
+        """Return the profile id an entry's rows are written under."""
+        return self._entry_profiles.get(config_entry_id, DEFAULT_PROFILE)
+
+    async def async_set_entry_profile(
+        self, config_entry_id: str, profile_id: str
+    ) -> None:
+        """Assign an entry to a profile, moving its stored rows if needed."""
+        if self._db is None:
+            raise RuntimeError("Estrannaise database is not initialized")
+        # Rows queued under the previous profile are moved below as well
+        await self.async_flush()
+        self._entry_profiles[config_entry_id] = profile_id
+        async with self._write_lock:
+            moved = 0
+            for table in ("doses", "blood_tests", "doses_archive"):
+                cursor = await self._db.execute(
+                    f"UPDATE {table} SET profile_id = ? "
+                    f"WHERE entry_id = {ENTRY_REF} AND profile_id != ?",
+                    (profile_id, config_entry_id, profile_id),
+                )
+                moved += cursor.rowcount
+            if moved:
+                await self._db.commit()
+                self._older_doses = await self._load_mirror("doses", self._doses)
+                self._older_blood_tests = await self._load_mirror(
+                    "blood_tests", self._blood_tests
+                )
+                self._data_version += 1
+                _LOGGER.info(
+                    "Moved %d rows of %s to profile %s",
+                    moved,
+                    config_entry_id,
+                    profile_id,
+                )
+
+    # ── Write-behind queue ───────────────────────────────────────────────────
+
+    def add_flush_listener(self, listener: Callable[[], None]) -> Callable[[], None]:
+        """Call *listener* once after every flush that changed data.
+
+        Returns a function that removes the listener.
+        """
+        self._flush_listeners.append(listener)
+        return lambda: self._flush_listeners.remove(listener)
+
+    def _enqueue(
+        self,
+        sql: str,
+        params: tuple[Any, ...],
+        returns_row_id: bool = False,
+        on_commit: Callable[[Any], None] | None = None,
+    ) -> asyncio.Future:
+        """Queue one write; it is committed with the rest of its flush window.
+
+        *on_commit* is called with the write's result once it is committed.
+        """
+        if self._closed:
+            raise RuntimeError("Estrannaise database is closed")
+        if self._db is None:
+            raise RuntimeError("Estrannaise database is not initialized")
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future = loop.create_future()
+        self._pending.append(
+            _PendingWrite(sql, params, returns_row_id, future, on_commit)
+        )
+        if len(self._pending) >= WRITE_QUEUE_MAX_BATCH:
+            self._schedule_flush()
+        elif self._flush_timer is None:
+            self._flush_timer = loop.call_later(
+                WRITE_FLUSH_WINDOW, self._schedule_flush
+            )
+        return future
+
+    def _schedule_flush(self) -> None:
+        """Start the background flush, unless one is already running.
+
+        A running flush keeps going until the queue is empty, so writes
+        queued meanwhile are picked up by it rather than by a second task.
+        """
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(
+                self._async_flush_queue()
+            )
+
+    async def _async_flush_queue(self) -> None:
+        """Flush until the queue is empty (body of the background flush)."""
+        try:
+            while self._pending and self._db is not None:
+                await self.async_flush()
+        except Exception:
+            _LOGGER.exception("Flushing queued estrannaise writes failed")
+
+    def _fail_pending(self, exc: Exception) -> None:
+        """Drop every queued write, failing its future with *exc*."""
+        batch, self._pending = self._pending, []
+        for write in batch:
+            if not write.future.done():
+                write.future.set_exception(exc)
+
+    def _ensure_label(self, table: str, name: str) -> None:
+        """Queue a dictionary row (entry, model, source) unless it exists.
+
+        Queued ahead of the write that references it, so both land in the
+        same flush.
+        """
+        known = self._labels[table]
+        if name in known:
+            return
+        known.add(name)
+        future = self._enqueue(
+            f"INSERT OR IGNORE INTO {table} (name) VALUES (?)", (name,)
+        )
+
+        def _forget_if_failed(fut: asyncio.Future) -> None:
+            # The row was not written, so the next reference queues it again
+            if fut.cancelled() or fut.exception() is not None:
+                known.discard(name)
+
+        future.add_done_callback(_forget_if_failed)
+
+    async def async_flush(self) -> None:
+        """Commit every queued write in one transaction and resolve its future.
+
+        If the batch fails, it is rolled back and replayed one write per
+        transaction, so only the offending writes report an error.
+        """
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if self._db is None:
+            self._fail_pending(
+                RuntimeError(
+                    "Estrannaise database is closed"
+                    if self._closed
+                    else "Estrannaise database is not initialized"
+                )
+            )
+            return
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+
+        async with self._write_lock:
+            try:
+                results: list[Any] = [
+                    await self._apply_write(write) for write in batch
+                ]
+                await self._db.commit()
+            except Exception as exc:  # noqa: BLE001
+                await self._db.rollback()
+                _LOGGER.warning(
+                    "Batched write of %d rows failed (%s); retrying singly",
+                    len(batch),
+                    exc,
+                )
+                results = []
+                for write in batch:
+                    try:
+                        result = await self._apply_write(write)
+                        await self._db.commit()
+                    except Exception as write_exc:  # noqa: BLE001
+                        await self._db.rollback()
+                        result = write_exc
+                    else:
+                        self._write_committed(write, result)
+                    results.append(result)
+            else:
+                for write, result in zip(batch, results):
+                    self._write_committed(write, result)
+
+            changed = any(
+                not isinstance(r, Exception) and (w.returns_row_id or r)
+                for w, r in zip(batch, results)
+            )
+            if changed:
+                self._data_version += 1
+
+        for write, result in zip(batch, results):
+            if write.future.done():
+                continue
+            if isinstance(result, Exception):
+                write.future.set_exception(result)
+            else:
+                write.future.set_result(result)
+
+        if changed:
+            for listener in list(self._flush_listeners):
+                listener()
+
+    @staticmethod
+    def _write_committed(write: _PendingWrite, result: Any) -> None:
+        """Run a committed write's mirror update.
+
+        The write itself stands either way, so a failing hook is only logged.
+        """
+        if write.on_commit is None:
+            return
+        try:
+            write.on_commit(result)
+        except Exception:
+            _LOGGER.exception("Updating the mirror after a committed write failed")
+
+    async def _apply_write(self, write: _PendingWrite) -> Any:
+        """Execute one queued write (no commit); return its row id or hit flag."""
+        assert self._db is not None
+        cursor = await self._db.execute(write.sql, write.params)
+        if write.returns_row_id:
+            return cursor.lastrowid
+        return cursor.rowcount > 0
 
     # ── Doses ────────────────────────────────────────────────────────────────
 
-    async def add_dose(
+    def add_dose(
         self,
         config_entry_id: str,
         model: str,
         dose_mg: float,
         timestamp: float | None = None,
         source: str = "manual",
-    ) -> int:
-        """Record a dose. Returns the new row ID."""
+    ) -> asyncio.Future[int]:
+        """Queue a dose. The returned future resolves to the new row ID.
+
+        The timestamp is stored to the second.
+        """
         now = time.time()
-        ts = timestamp if timestamp is not None else now
-        if self._db is None:
-            raise RuntimeError("Estrannaise database is not initialized")
-        async with self._write_lock:
-            cursor = await self._db.execute(
-                "INSERT INTO doses (config_entry_id, timestamp, model, dose_mg, source, created_at) "
-                "VALUES (?, ?, ?, ?, ?, ?)",
-                (config_entry_id, ts, model, dose_mg, source, now),
-            )
-            await self._db.commit()
-            row_id = cursor.lastrowid
-        return row_id  # type: ignore[return-value]
+        ts = round(timestamp if timestamp is not None else now)
+        profile_id = self.entry_profile(config_entry_id)
+        self._ensure_label("entries", config_entry_id)
+        self._ensure_label("models", model)
+        self._ensure_label("sources", source)
+        return self._enqueue(
+            "INSERT INTO doses "
+            "(entry_id, profile_id, timestamp, model_id, dose_mg, source_id, "
+            f"created_at) VALUES ({ENTRY_REF}, ?, ?, {MODEL_REF}, ?, "
+            f"{SOURCE_REF}, ?)",
+            (config_entry_id, profile_id, ts, model, dose_mg, source, int(now)),
+            returns_row_id=True,
+            on_commit=lambda row_id: self._mirror_dose(
+                (row_id, config_entry_id, ts, model, dose_mg, source, profile_id)
+            ),
+        )
+
+    async def add_doses(
+        self,
+        config_entry_id: str,
+        doses: Sequence[tuple[str, float, float | None]],
+        source: str = "manual",
+    ) -> list[int]:
+        """Record several doses in one transaction; return their row IDs.
+
+        *doses*: (model, dose_mg, timestamp or None for now) tuples.  They
+        are queued like add_dose and committed by an immediate flush, with
+        whatever else was queued.
+        """
+        futures = [
+            self.add_dose(config_entry_id, model, dose_mg, ts, source)
+            for model, dose_mg, ts in doses
+        ]
+        await self.async_flush()
+        return list(await asyncio.gather(*futures))
 
     async def get_doses(
         self,
         config_entry_id: str,
         since_timestamp: float | None = None,
     ) -> list[dict[str, Any]]:
-        """Get dose records for a config entry, optionally filtered by time."""
+        """Get dose records for a config entry, optionally filtered by time.
+
+        Served from the in-memory mirror; the records are shared, so treat
+        them as read-only.
+        """
         if self._db is None:
             raise RuntimeError("Estrannaise database is not initialized")
-        if since_timestamp is not None:
-            cursor = await self._db.execute(
-                "SELECT id, config_entry_id, timestamp, model, dose_mg, source "
-                "FROM doses WHERE config_entry_id = ? AND timestamp >= ? "
-                "ORDER BY timestamp ASC",
-                (config_entry_id, since_timestamp),
+        older: list[dict[str, Any]] = []
+        if self._older_doses:
+            older = await self._read_older(
+                "doses", self._doses, since_timestamp, config_entry_id
             )
-        else:
-            cursor = await self._db.execute(
-                "SELECT id, config_entry_id, timestamp, model, dose_mg, source "
-                "FROM doses WHERE config_entry_id = ? "
-                "ORDER BY timestamp ASC",
-                (config_entry_id,),
-            )
-        rows = await cursor.fetchall()
-        return [dict(row) for row in rows]
+        return older + [
+            rec
+            for rec in self._doses.records(since_timestamp)
+            if rec["config_entry_id"] == config_entry_id
+        ]
 
     async def get_all_doses(
         self,
         since_timestamp: float | None = None,
     ) -> list[dict[str, Any]]:
-        """Get dose records across all config entries."""
-        if self._db is None:
-            raise RuntimeError("Estrannaise database is not initialized")
-        if since_timestamp is not None:
-            cursor = await self._db.execute(
-                "SELECT id, config_entry_id, timestamp, model, dose_mg, source "
-                "FROM doses WHERE timestamp >= ? "
-                "ORDER BY timestamp ASC",
-                (since_timestamp,),
-            )
-        else:
-            cursor = await self._db.execute(
-                "SELECT id, config_entry_id, timestamp, model, dose_mg, source "
-                "FROM doses ORDER BY timestamp ASC",
-            )
-        rows = await cursor.fetchall()
-        return [dict(row) for row in rows]
+        """Get dose records across all config entries.
 
-    async def delete_dose(self, config_entry_id: str, dose_id: int) -> bool:
-        """Delete a dose by ID. Returns True if a row was deleted."""
+        Served from the in-memory mirror; the records are shared, so treat
+        them as read-only.
+        """
         if self._db is None:
             raise RuntimeError("Estrannaise database is not initialized")
-        async with self._write_lock:
-            cursor = await self._db.execute(
-                "DELETE FROM doses WHERE id = ? AND config_entry_id = ?",
-                (dose_id, config_entry_id),
-            )
-            await self._db.commit()
-        return cursor.rowcount > 0
+        recent = self._doses.records(since_timestamp)
+        if not self._older_doses:
+            return recent
+        return await self._read_older("doses", self._doses, since_timestamp) + recent
+
+    def delete_dose(
+        self, config_entry_id: str, dose_id: int
+    ) -> asyncio.Future[bool]:
+        """Queue a dose deletion. The future resolves to True if a row was deleted."""
+        return self._enqueue(
+            f"DELETE FROM doses WHERE id = ? AND entry_id = {ENTRY_REF}",
+            (dose_id, config_entry_id),
+            on_commit=lambda hit: hit and self._unmirror_dose(dose_id),
+        )
 
     # ── Blood tests ──────────────────────────────────────────────────────────
 
-    async def add_blood_test(
+    def add_blood_test(
         self,
         config_entry_id: str,
         level_pg_ml: float,
         timestamp: float | None = None,
         notes: str | None = None,
         on_schedule: bool | None = None,
-    ) -> int:
-        """Record a blood test result. Returns the new row ID."""
+    ) -> asyncio.Future[int]:
+        """Queue a blood test result. The future resolves to the new row ID.
+
+        The timestamp is stored to the second.
+        """
         now = time.time()
-        ts = timestamp if timestamp is not None else now
-        if self._db is None:
-            raise RuntimeError("Estrannaise database is not initialized")
+        ts = round(timestamp if timestamp is not None else now)
         on_sched_int = (
             int(on_schedule) if on_schedule is not None else None
         )
-        async with self._write_lock:
-            cursor = await self._db.execute(
-                "INSERT INTO blood_tests "
-                "(config_entry_id, timestamp, level_pg_ml, notes, created_at, on_schedule) "
-                "VALUES (?, ?, ?, ?, ?, ?)",
-                (config_entry_id, ts, level_pg_ml, notes, now, on_sched_int),
-            )
-            await self._db.commit()
-            row_id = cursor.lastrowid
-        return row_id  # type: ignore[return-value]
+        profile_id = self.entry_profile(config_entry_id)
+        self._ensure_label("entries", config_entry_id)
+        return self._enqueue(
+            "INSERT INTO blood_tests "
+            "(entry_id, timestamp, level_pg_ml, notes, created_at, "
+            "on_schedule, profile_id) "
+            f"VALUES ({ENTRY_REF}, ?, ?, ?, ?, ?, ?)",
+            (
+                config_entry_id,
+                ts,
+                level_pg_ml,
+                notes,
+                int(now),
+                on_sched_int,
+                profile_id,
+            ),
+            returns_row_id=True,
+            on_commit=lambda row_id: self._mirror_blood_test(
+                (
+                    row_id,
+                    config_entry_id,
+                    ts,
+                    level_pg_ml,
+                    notes,
+                    on_sched_int,
+                    profile_id,
+                )
+            ),
+        )
+
+    async def add_blood_tests(
+        self,
+        config_entry_id: str,
+        tests: Sequence[tuple[float, float | None, str | None, bool | None]],
+    ) -> list[int]:
+        """Record several blood tests in one transaction; return their row IDs.
+
+        *tests*: (level_pg_ml, timestamp, notes, on_schedule) tuples, as
+        for add_blood_test.
+        """
+        futures = [
+            self.add_blood_test(config_entry_id, level, ts, notes, on_schedule)
+            for level, ts, notes, on_schedule in tests
+        ]
+        await self.async_flush()
+        return list(await asyncio.gather(*futures))
 
     async def get_blood_tests(
         self, config_entry_id: str
     ) -> list[dict[str, Any]]:
-        """Get all blood test records for a config entry."""
+        """Get all blood test records for a config entry (shared, read-only)."""
         if self._db is None:
             raise RuntimeError("Estrannaise database is not initialized")
-        cursor = await self._db.execute(
-            "SELECT id, config_entry_id, timestamp, level_pg_ml, notes, on_schedule "
-            "FROM blood_tests WHERE config_entry_id = ? "
-            "ORDER BY timestamp ASC",
-            (config_entry_id,),
-        )
-        rows = await cursor.fetchall()
-        return [dict(row) for row in rows]
+        older: list[dict[str, Any]] = []
+        if self._older_blood_tests:
+            older = await self._read_older(
+                "blood_tests", self._blood_tests, None, config_entry_id
+            )
+        return older + [
+            rec
+            for rec in self._blood_tests.records()
+            if rec["config_entry_id"] == config_entry_id
+        ]
 
     async def get_all_blood_tests(self) -> list[dict[str, Any]]:
-        """Get all blood test records across all config entries."""
+        """Get all blood test records across all config entries (shared, read-only)."""
         if self._db is None:
             raise RuntimeError("Estrannaise database is not initialized")
-        cursor = await self._db.execute(
-            "SELECT id, config_entry_id, timestamp, level_pg_ml, notes, on_schedule "
-            "FROM blood_tests ORDER BY timestamp ASC",
-        )
-        rows = await cursor.fetchall()
-        return [dict(row) for row in rows]
+        recent = self._blood_tests.records()
+        if not self._older_blood_tests:
+            return recent
+        return await self._read_older("blood_tests", self._blood_tests, None) + recent
 
-    async def delete_blood_test(
-        self, config_entry_id: str, test_id: int
-    ) -> bool:
-        """Delete a blood test by ID. Returns True if a row was deleted."""
+    # ── Snapshot ─────────────────────────────────────────────────────────────
+
+    async def async_snapshot(
+        self, profile_id: str | None = None, since: float | None = None
+    ) -> DatabaseSnapshot:
+        """Return doses and blood tests with the matching data version.
+
+        *profile_id* limits both to one profile's partition (all profiles
+        if None); *since* limits the doses to timestamp >= since (blood
+        tests are never windowed).
+
+        Rows inside the mirror window come from memory.  Older rows, if
+        any are needed, are read on the reader connection in one
+        transaction (one round trip that never waits for the writer); if a
+        write lands meanwhile, the snapshot is retaken.  Records are
+        shared, so treat them as read-only.
+        """
         if self._db is None:
             raise RuntimeError("Estrannaise database is not initialized")
-        async with self._write_lock:
-            cursor = await self._db.execute(
-                "DELETE FROM blood_tests WHERE id = ? AND config_entry_id = ?",
-                (test_id, config_entry_id),
+
+        def _in_profile(records: list[dict[str, Any]]) -> list[dict[str, Any]]:
+            if profile_id is None:
+                return records
+            return [rec for rec in records if rec["profile_id"] == profile_id]
+
+        while True:
+            version = self._data_version
+            doses = _in_profile(self._doses.records(since))
+            blood_tests = _in_profile(self._blood_tests.records())
+
+            older: dict[str, list[dict[str, Any]]] = {}
+            queries: list[tuple[Sequence[str], str, list[Any]]] = []
+            for table, mirror, count, lower in (
+                ("doses", self._doses, self._older_doses, since),
+                ("blood_tests", self._blood_tests, self._older_blood_tests, None),
+            ):
+                if not count or (lower is not None and lower >= mirror.window_start):
+                    continue
+                query = (
+                    f"SELECT {_stored_columns(mirror.names)} FROM {table} "
+                    "WHERE timestamp < ?"
+                )
+                params: list[Any] = [mirror.window_start]
+                if lower is not None:
+                    query += " AND timestamp >= ?"
+                    params.append(lower)
+                if profile_id is not None:
+                    query += " AND profile_id = ?"
+                    params.append(profile_id)
+                older[table] = []
+                queries.append(
+                    (mirror.names, query + " ORDER BY timestamp ASC", params)
+                )
+            if not queries:
+                return DatabaseSnapshot(version, doses, blood_tests)
+
+            results = await self._async_read(self._read_rows, queries)
+            if self._data_version == version:
+                for table, (names, _sql, _params), rows in zip(
+                    list(older), queries, results
+                ):
+                    older[table] = [dict(zip(names, row)) for row in rows]
+                return DatabaseSnapshot(
+                    version,
+                    older.get("doses", []) + doses,
+                    older.get("blood_tests", []) + blood_tests,
+                )
+
+    async def async_earliest_blood_test(self, profile_id: str) -> float | None:
+        """Return the timestamp of the profile's earliest blood test, if any."""
+        if self._db is None:
+            raise RuntimeError("Estrannaise database is not initialized")
+        if self._older_blood_tests:
+            ((row,),) = await self._async_read(
+                self._read_queries,
+                [(
+                    "SELECT MIN(timestamp) AS timestamp FROM blood_tests "
+                    "WHERE profile_id = ?",
+                    [profile_id],
+                )],
             )
-            await self._db.commit()
-        return cursor.rowcount > 0
+            return row["timestamp"]
+        profiles = self._blood_tests.column("profile_id")
+        timestamps = self._blood_tests.timestamps
+        # Timestamp order: the first match is the earliest
+        for pos, value in enumerate(profiles):
+            if value == profile_id:
+                return timestamps[pos]
+        return None
+
+    def delete_blood_test(
+        self, config_entry_id: str, test_id: int
+    ) -> asyncio.Future[bool]:
+        """Queue a blood test deletion. The future resolves to True if a row was deleted."""
+        return self._enqueue(
+            f"DELETE FROM blood_tests WHERE id = ? AND entry_id = {ENTRY_REF}",
+            (test_id, config_entry_id),
+            on_commit=lambda hit: hit and self._unmirror_blood_test(test_id),
+        )
 
     # ── Clear all data ────────────────────────────────────────────────────────
 
     async def clear_all_data(self) -> None:
-        """Delete all doses and blood tests from the database."""
+        """Delete all doses (archived too) and blood tests from the database."""
         if self._db is None:
             raise RuntimeError("Estrannaise database is not initialized")
+        # Apply queued writes first so they cannot land after the clear
+        await self.async_flush()
         async with self._write_lock:
             await self._db.execute("DELETE FROM doses")
+            await self._db.execute("DELETE FROM doses_archive")
             await self._db.execute("DELETE FROM blood_tests")
+            await self._db.execute("DELETE FROM pk_state")
             await self._db.commit()
+            self._data_version += 1
+            self._doses.clear()
+            self._blood_tests.clear()
+            self._older_doses = 0
+            self._older_blood_tests = 0
         _LOGGER.info("All estrannaise dose and blood test data cleared")
 
     # ── Scaling factor ───────────────────────────────────────────────────────
@@ -259,117 +1159,294 @@ class EstrannaisDatabase:
     async def compute_scaling_factor(
         self,
         config_entry_id: str,
-        all_doses: list[dict[str, Any]],
+        all_doses: list[dict[str, Any]] | DoseArrays,
         all_configs: list[dict[str, Any]] | None = None,
         decay_lambda: float = 0.02,
     ) -> tuple[float, float]:
         """Compute exponentially-weighted scaling factor from blood tests.
 
-        For each blood test, compares measured level to predicted level from
-        the PK model at that timestamp. Recent tests are weighted more heavily.
-
-        For tests marked on_schedule=True where predicted E2 is negligible
-        (no dose records that far back), virtual steady-state doses are
-        generated from all_configs to produce a meaningful prediction.
-
-        decay_lambda: exponential decay rate for weighting (per day).
-        Returns (factor, variance) where factor is clamped to [0.0, 2.0].
-        Returns (1.0, 0.0) if no usable tests.
+        Reads every blood test and fits them with
+        pipeline.compute_scaling_factor (see there for the method).
+        Returns (factor, variance); (1.0, 0.0) if no usable tests.
         """
-        from .const import compute_e2_at_time, compute_steady_state_e2_at_time
-
         tests = await self.get_all_blood_tests()
-        if not tests:
-            return (1.0, 0.0)
+        return compute_scaling_factor(
+            tests,
+            all_doses,
+            time.time(),
+            all_configs=all_configs,
+            decay_lambda=decay_lambda,
+        )
 
-        now = time.time()
-        weighted_sum = 0.0
-        weight_total = 0.0
-        ratios_and_weights: list[tuple[float, float]] = []
+    # ── Auto dose tracking ─────────────────────────────────────────────────
 
-        for test in tests:
-            predicted = compute_e2_at_time(
-                test["timestamp"], all_doses, scaling_factor=1.0
+    async def get_auto_dose_timestamps(
+        self, config_entry_id: str
+    ) -> list[float]:
+        """Return timestamps of all automatic doses for an entry, sorted."""
+        if self._db is None:
+            raise RuntimeError("Estrannaise database is not initialized")
+        older: list[float] = []
+        if self._older_doses:
+            (rows,) = await self._async_read(
+                self._read_queries,
+                [(
+                    # Answered from the automatic-slot index alone
+                    "SELECT timestamp FROM doses "
+                    f"WHERE entry_id = {ENTRY_REF} "
+                    f"AND source_id = {SOURCE_AUTOMATIC} "
+                    "AND timestamp < ? ORDER BY timestamp ASC",
+                    (config_entry_id, self._doses.window_start),
+                )],
+            )
+            older = [row["timestamp"] for row in rows]
+        return older + [
+            ts
+            for entry_id, source, ts in zip(
+                self._doses.column("config_entry_id"),
+                self._doses.column("source"),
+                self._doses.timestamps,
             )
-            if predicted < 1.0:
-                # Try virtual steady-state for on_schedule tests
-                on_schedule = test.get("on_schedule")
-                if on_schedule and all_configs:
-                    predicted = compute_steady_state_e2_at_time(
-                        test["timestamp"], all_configs
+            if entry_id == config_entry_id and source == "automatic"
+        ]
+
+    async def add_auto_doses(
+        self,
+        config_entry_id: str,
+        doses: list[tuple[str, float, float]],
+    ) -> int:
+        """Record automatic doses in one transaction.
+
+        *doses*: (model, dose_mg, timestamp) tuples.  Slots that already
+        hold an automatic dose for the entry are skipped (unique index), so
+        concurrent callers cannot insert duplicates.  Returns the number of
+        rows inserted.
+        """
+        if self._db is None:
+            raise RuntimeError("Estrannaise database is not initialized")
+        now = int(time.time())
+        async with self._write_lock:
+            for table, names in (
+                ("entries", {config_entry_id}),
+                ("models", {model for model, _dose, _ts in doses}),
+            ):
+                new_names = names - self._labels[table]
+                if new_names:
+                    await self._db.executemany(
+                        f"INSERT OR IGNORE INTO {table} (name) VALUES (?)",
+                        [(name,) for name in new_names],
                     )
-                if predicted < 1.0:
-                    continue
+                    self._labels[table] |= new_names
+            cursor = await self._db.execute("SELECT COALESCE(MAX(id), 0) FROM doses")
+            last_id = (await cursor.fetchone())[0]
+            before = self._db.total_changes
+            profile_id = self.entry_profile(config_entry_id)
+            await self._db.executemany(
+                "INSERT OR IGNORE INTO doses "
+                "(entry_id, profile_id, timestamp, model_id, dose_mg, "
+                "source_id, created_at) "
+                f"VALUES ({ENTRY_REF}, ?, ?, {MODEL_REF}, ?, "
+                f"{SOURCE_AUTOMATIC}, ?)",
+                [
+                    (config_entry_id, profile_id, round(ts), model, dose_mg, now)
+                    for model, dose_mg, ts in doses
+                ],
+            )
+            await self._db.commit()
+            inserted = self._db.total_changes - before
+            if inserted:
+                # AUTOINCREMENT: the rows this call inserted follow every
+                # id that existed before
+                (rows,) = await self._async_read(
+                    self._read_rows,
+                    [(
+                        self._doses.names,
+                        f"SELECT {_stored_columns(self._doses.names)} FROM doses "
+                        "WHERE id > ?",
+                        (last_id,),
+                    )],
+                )
+                for row in rows:
+                    self._mirror_dose(row)
+                # Bump only once the mirror matches, so a reader never sees
+                # the new version with the old rows
+                self._data_version += 1
+        return inserted
 
-            ratio = test["level_pg_ml"] / predicted
-            age_days = (now - test["timestamp"]) / 86400.0
-            weight = math.exp(-decay_lambda * age_days)
+    # ── PK state checkpoints ───────────────────────────────────────────────
 
-            weighted_sum += ratio * weight
-            weight_total += weight
-            ratios_and_weights.append((ratio, weight))
+    async def load_pk_state(self, profile_key: str) -> dict[str, Any] | None:
+        """Return the last checkpointed E2 tracker state, if any."""
+        if self._db is None:
+            raise RuntimeError("Estrannaise database is not initialized")
+        cursor = await self._db.execute(
+            "SELECT state FROM pk_state WHERE profile_key = ?",
+            (profile_key,),
+        )
+        row = await cursor.fetchone()
+        if row is None:
+            return None
+        try:
+            return json.loads(row["state"])
+        except ValueError:
+            _LOGGER.warning("Discarding unreadable PK state for %s", profile_key)
+            return None
 
-        if weight_total <= 0:
-            return (1.0, 0.0)
+    async def save_pk_state(
+        self, profile_key: str, state: dict[str, Any]
+    ) -> None:
+        """Checkpoint an E2 tracker state."""
+        if self._db is None:
+            raise RuntimeError("Estrannaise database is not initialized")
+        async with self._write_lock:
+            await self._db.execute(
+                "INSERT OR REPLACE INTO pk_state (profile_key, state, updated_at) "
+                "VALUES (?, ?, ?)",
+                (profile_key, json.dumps(state), time.time()),
+            )
+            await self._db.commit()
 
-        factor = weighted_sum / weight_total
+    # ── Retention ────────────────────────────────────────────────────────────
 
-        # Compute weighted variance
-        var_sum = 0.0
-        for ratio, weight in ratios_and_weights:
-            var_sum += weight * (ratio - factor) ** 2
-        variance = var_sum / weight_total
+    async def archive_stale_doses(
+        self, retention_days: dict[str, float], now: float | None = None
+    ) -> int:
+        """Move doses whose contribution has decayed to ~1% of peak to the archive.
 
-        return (max(0.0, min(2.0, factor)), variance)
+        *retention_days* maps each config entry to a minimum retention (e.g.
+        90 days for backfill entries); doses are kept for at least that many
+        days regardless of the PK model.  Archived doses stay in
+        doses_archive, which the refresh path never reads.  One transaction
+        for every entry and model.  Returns the number of rows archived.
+        """
+        if self._db is None:
+            raise RuntimeError("Estrannaise database is not initialized")
+        if not retention_days:
+            return 0
+        now = time.time() if now is None else now
 
-    # ── Auto dose tracking ─────────────────────────────────────────────────
+        cutoff_ts: dict[tuple[str, str], float] = {}
+        for entry_id, min_days in retention_days.items():
+            for model in PK_PARAMETERS:
+                max_age_days = max(terminal_elimination_days(model), min_days)
+                cutoff_ts[(entry_id, model)] = now - max_age_days * 86400.0
+        cutoffs = [v for (e, m), ts in cutoff_ts.items() for v in (e, m, ts)]
+        # Temporary (entry, model, cutoff) table shared by both statements
+        values = ", ".join(["(?, ?, ?)"] * (len(cutoffs) // 3))
+        stale = (
+            f"WITH cutoffs(entry_id, model, cutoff_ts) AS (VALUES {values}) "
+            "SELECT d.id FROM cutoffs c "
+            "JOIN entries e ON e.name = c.entry_id "
+            "JOIN models m ON m.name = c.model "
+            "JOIN doses d ON d.entry_id = e.id "
+            "AND d.model_id = m.id AND d.timestamp < c.cutoff_ts"
+        )
 
-    async def get_auto_dose_timestamps(
-        self, config_entry_id: str
-    ) -> set[float]:
-        """Return timestamps of all automatic doses for an entry."""
+        async with self._write_lock:
+            await self._db.execute(
+                "INSERT OR IGNORE INTO doses_archive "
+                "(id, entry_id, profile_id, timestamp, model_id, dose_mg, "
+                "source_id, created_at, archived_at) "
+                "SELECT id, entry_id, profile_id, timestamp, model_id, "
+                f"dose_mg, source_id, created_at, ? FROM doses WHERE id IN ({stale})",
+                (int(now), *cutoffs),
+            )
+            cursor = await self._db.execute(
+                f"DELETE FROM doses WHERE id IN ({stale})", cutoffs
+            )
+            archived = cursor.rowcount
+            await self._db.commit()
+            if archived > 0:
+                self._doses.remove_where(
+                    lambda rec: rec["timestamp"]
+                    < cutoff_ts.get(
+                        (rec["config_entry_id"], rec["model"]), -math.inf
+                    )
+                )
+                self._older_doses = await self._count_older("doses", self._doses)
+                self._data_version += 1
+                _LOGGER.debug("Archived %d stale doses", archived)
+
+        return archived
+
+    async def get_archived_doses(
+        self, config_entry_id: str | None = None
+    ) -> list[dict[str, Any]]:
+        """Get archived dose records (all entries if *config_entry_id* is None)."""
         if self._db is None:
             raise RuntimeError("Estrannaise database is not initialized")
-        cursor = await self._db.execute(
-            "SELECT timestamp FROM doses "
-            "WHERE config_entry_id = ? AND source = 'automatic' "
-            "ORDER BY timestamp ASC",
-            (config_entry_id,),
+        names = (
+            "id",
+            "config_entry_id",
+            "timestamp",
+            "model",
+            "dose_mg",
+            "source",
+            "archived_at",
+        )
+        query = f"SELECT {_stored_columns(names)} FROM doses_archive"
+        params: tuple[Any, ...] = ()
+        if config_entry_id is not None:
+            query += f" WHERE entry_id = {ENTRY_REF}"
+            params = (config_entry_id,)
+        (rows,) = await self._async_read(
+            self._read_rows, [(names, query + " ORDER BY timestamp ASC", params)]
         )
-        rows = await cursor.fetchall()
-        return {row["timestamp"] for row in rows}
+        return [dict(zip(names, row)) for row in rows]
 
-    # ── Stale dose pruning ───────────────────────────────────────────────────
+    @property
+    def is_idle(self) -> bool:
+        """True if no write is queued or in progress."""
+        return not self._pending and not self._write_lock.locked()
 
-    async def prune_stale_doses(
-        self, config_entry_id: str, min_retention_days: float = 0.0
-    ) -> int:
-        """Remove doses whose contribution has decayed to ~1% of peak.
+    async def async_compact(
+        self, max_free_pages: int = COMPACT_MAX_PAGES
+    ) -> CompactionReport:
+        """Return free pages to the file system and checkpoint the WAL.
 
-        When *min_retention_days* is set (e.g. for backfill entries), doses
-        are kept for at least that many days regardless of the PK model.
-        Returns the number of rows deleted.
+        Releases up to *max_free_pages* pages with incremental vacuum, then
+        truncates the write-ahead log.  Databases created before incremental
+        auto-vacuum are switched over by one full VACUUM the first time.
         """
         if self._db is None:
             raise RuntimeError("Estrannaise database is not initialized")
-        now = time.time()
-        total_deleted = 0
+        wal_path = Path(f"{self._db_path}-wal")
 
         async with self._write_lock:
-            for model, _params in PK_PARAMETERS.items():
-                max_age_days = max(
-                    terminal_elimination_days(model), min_retention_days
-                )
-                cutoff_ts = now - (max_age_days * 86400.0)
-                cursor = await self._db.execute(
-                    "DELETE FROM doses WHERE config_entry_id = ? "
-                    "AND model = ? AND timestamp < ?",
-                    (config_entry_id, model, cutoff_ts),
+            db_before = await self._file_bytes()
+            wal_before = wal_path.stat().st_size if wal_path.exists() else 0
+
+            cursor = await self._db.execute("PRAGMA auto_vacuum")
+            row = await cursor.fetchone()
+            full_vacuum = not row or row[0] != 2
+            if full_vacuum:
+                await self._db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                await self._db.execute("VACUUM")
+            else:
+                # executescript runs the pragma to completion; a plain
+                # execute only steps it once (one page)
+                await self._db.executescript(
+                    f"PRAGMA incremental_vacuum({int(max_free_pages)});"
                 )
-                total_deleted += cursor.rowcount
+            await self._db.commit()
+            cursor = await self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            await cursor.fetchall()
 
-            if total_deleted > 0:
-                await self._db.commit()
-                _LOGGER.debug("Pruned %d stale doses for %s", total_deleted, config_entry_id)
+            db_after = await self._file_bytes()
+            wal_after = wal_path.stat().st_size if wal_path.exists() else 0
+
+        return CompactionReport(
+            database_bytes=db_after,
+            reclaimed_bytes=max(0, db_before - db_after),
+            wal_bytes_reclaimed=max(0, wal_before - wal_after),
+            full_vacuum=full_vacuum,
+        )
 
-        return total_deleted
+    async def _file_bytes(self) -> int:
+        """Size of the main database file (page_count x page_size)."""
+        assert self._db is not None
+        cursor = await self._db.execute("PRAGMA page_count")
+        pages = (await cursor.fetchone())[0]
+        cursor = await self._db.execute("PRAGMA page_size")
+        page_size = (await cursor.fetchone())[0]
+        return int(pages) * int(page_size)
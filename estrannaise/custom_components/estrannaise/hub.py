@@ -0,0 +1,207 @@
+"""Shared cross-entry computation hub for Estrannaise.
+
+Entries are grouped into profiles (one per person).  Every coordinator of
+a profile shows the same model: the profile's doses and blood tests,
+every member entry's projected auto-dose schedules, one scaling factor, one
+baseline and one incremental E2 state.  The hub computes that model once
+per data version (EstrannaisDatabase.data_version) and profile, and fans
+it out; each coordinator only projects the parts specific to its entry
+(units, suggested regimen).  When nothing changed, a refresh only
+advances the cached E2 state to the new time.  The E2 state and the
+scaling fit are kept between recomputations, so those only absorb what
+changed.
+
+Only doses that can still contribute are read: those within the longest
+terminal elimination horizon of now (or of the earliest blood test),
+widened to the members' retention window.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import math
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import TYPE_CHECKING, Any
+
+from .const import max_contribution_days, normalize_profile
+from .cycle_fit_cache import async_get_cycle_fit_regimen
+from .pipeline import (
+    RefreshSnapshot,
+    ScalingFit,
+    SharedModel,
+    async_compute_shared_model,
+    project_entry_data,
+)
+from .pk import E2StateTracker
+
+if TYPE_CHECKING:
+    from homeassistant.core import HomeAssistant
+
+    from .database import EstrannaisDatabase
+
+_LOGGER = logging.getLogger(__name__)
+
+# The dose window start is floored to this step, so it only moves (and
+# drops doses out of the tracker and the scaling fit) once a week
+DOSE_WINDOW_STEP = 7 * 86400.0
+
+
+class EstrannaisHub:
+    """Computes the shared refresh model once for all coordinators."""
+
+    def __init__(self, hass: HomeAssistant, database: EstrannaisDatabase) -> None:
+        """Initialize the hub."""
+        self.hass = hass
+        self.database = database
+        self._lock = asyncio.Lock()
+        # Per-profile state, keyed by profile id
+        self._shared: dict[str, SharedModel] = {}
+        self._shared_key: dict[str, tuple[int, str]] = {}
+        self._trackers: dict[str, E2StateTracker] = {}
+        self._scaling_fits: dict[str, ScalingFit] = {}
+        self._process_pool: Executor | None = None
+
+    def close(self) -> None:
+        """Release the process pool, if one was started."""
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False)
+            self._process_pool = None
+
+    async def async_get_entry_data(
+        self,
+        entry_id: str,
+        config: dict[str, Any],
+        all_configs: list[dict[str, Any]],
+        now: float,
+    ) -> dict[str, Any]:
+        """Return one coordinator's data, recomputing the shared model if stale.
+
+        Only the entries in *config*'s profile take part.
+        """
+        profile_id = normalize_profile(config.get("profile"))
+        members = [
+            cfg for cfg in all_configs
+            if normalize_profile(cfg.get("profile")) == profile_id
+        ]
+        async with self._lock:
+            shared = await self._async_get_shared(profile_id, members, now)
+            # Cheap O(models) step; the tracker never moves backwards, so
+            # coordinators refreshing moments apart read the latest state
+            shared.tracker.advance(now)
+            return project_entry_data(shared, entry_id, config)
+
+    async def _async_get_shared(
+        self, profile_id: str, all_configs: list[dict[str, Any]], now: float
+    ) -> SharedModel:
+        """Return the profile's cached shared model, or compute it (lock held)."""
+        configs_key = json.dumps(all_configs, sort_keys=True, default=str)
+        cached = self._shared.get(profile_id)
+        if (
+            cached is not None
+            and self._shared_key.get(profile_id)
+            == (self.database.data_version, configs_key)
+            and now < cached.valid_until
+        ):
+            return cached
+
+        from homeassistant.util import dt as dt_util
+
+        # Make sure cycle-fit regimens are memoized before the sync paths run
+        await self.async_warm_cycle_fits(all_configs)
+
+        # The profile's doses (within the contribution window) and blood
+        # tests, with the data version they belong to, in one consistent read
+        db_snapshot = await self.database.async_snapshot(
+            profile_id,
+            await self._async_dose_window_start(profile_id, all_configs, now),
+        )
+        key = (db_snapshot.data_version, configs_key)
+
+        # The incremental tracker is restored from its checkpoint on first
+        # use; afterwards it lives in memory
+        tracker = self._trackers.get(profile_id)
+        tracker_state = None
+        if tracker is None:
+            tracker_state = await self.database.load_pk_state(profile_id)
+
+        snapshot = RefreshSnapshot(
+            all_configs=all_configs,
+            doses=db_snapshot.doses,
+            blood_tests=db_snapshot.blood_tests,
+            now=now,
+            local_tz=dt_util.DEFAULT_TIME_ZONE,
+            tracker=tracker,
+            tracker_state=tracker_state,
+            scaling_fit=self._scaling_fits.get(profile_id),
+        )
+        shared = await async_compute_shared_model(
+            self.hass, snapshot, self._get_process_pool(all_configs)
+        )
+
+        # Re-checkpoint only when the set of absorbed doses changed
+        # (advancing in time needs no checkpoint)
+        self._trackers[profile_id] = shared.tracker
+        if shared.scaling_fit is not None:
+            self._scaling_fits[profile_id] = shared.scaling_fit
+        if shared.tracker_changed:
+            await self.database.save_pk_state(profile_id, shared.tracker.to_dict())
+
+        self._shared[profile_id] = shared
+        self._shared_key[profile_id] = key
+        return shared
+
+    async def _async_dose_window_start(
+        self, profile_id: str, configs: list[dict[str, Any]], now: float
+    ) -> float:
+        """Earliest dose timestamp a profile's refresh needs.
+
+        Doses older than the longest terminal elimination horizon no
+        longer contribute at *now*, nor to any blood test's prediction
+        unless the test itself is that old.  The window is widened to the
+        longest backfill retention so the chart keeps its history.
+        """
+        horizon = max_contribution_days() * 86400.0
+        span = horizon
+        if any(cfg.get("backfill_doses", False) for cfg in configs):
+            span = max(span, 90.0 * 86400.0)
+        start = now - span
+        earliest = await self.database.async_earliest_blood_test(profile_id)
+        if earliest is not None:
+            start = min(start, earliest - horizon)
+        return math.floor(start / DOSE_WINDOW_STEP) * DOSE_WINDOW_STEP
+
+    async def async_warm_cycle_fits(self, configs: list[dict[str, Any]]) -> None:
+        """Memoize every cycle-fit regimen the refresh will look up.
+
+        Cache misses are computed in the executor, so the synchronous
+        callers (auto-dose generation, persistence, calendar) only hit.
+        """
+        for cfg in configs:
+            if (
+                cfg.get("auto_regimen", False)
+                and cfg.get("target_type") == "menstrual_range"
+            ):
+                await async_get_cycle_fit_regimen(
+                    self.hass, cfg["ester"], cfg["method"]
+                )
+
+    def _get_process_pool(
+        self, configs: list[dict[str, Any]]
+    ) -> Executor | None:
+        """Return the refresh process pool if any entry opted in."""
+        if not any(cfg.get("process_pool", False) for cfg in configs):
+            return None
+        if self._process_pool is None:
+            try:
+                # spawn: forking HA's multi-threaded process is unsafe
+                self._process_pool = ProcessPoolExecutor(
+                    max_workers=1,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            except (OSError, NotImplementedError, ValueError) as exc:
+                _LOGGER.warning("Refresh process pool unavailable: %s", exc)
+                return None
+        return self._process_pool
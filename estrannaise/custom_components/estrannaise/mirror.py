@@ -0,0 +1,137 @@
+"""In-memory column mirror of an Estrannaise database table.
+
+EstrannaisDatabase keeps one ColumnMirror per table (doses, blood tests)
+holding every row from a window start onward, sorted by timestamp and
+stored column-wise (typed arrays for numbers, lists for strings).  The
+write path updates it after each commit, so reads need no SQL.  Record
+dicts are built once per mirror version and shared by every reader until
+the next write; callers must treat them as read-only.
+"""
+
+from __future__ import annotations
+
+import bisect
+from array import array
+from collections.abc import Callable, Iterable, Sequence
+from itertools import compress
+from typing import Any
+
+# Per-column storage: an array typecode, or "" for a plain list
+DOSE_COLUMNS: tuple[tuple[str, str], ...] = (
+    ("id", "q"),
+    ("config_entry_id", ""),
+    ("timestamp", "q"),
+    ("model", ""),
+    ("dose_mg", "d"),
+    ("source", ""),
+    ("profile_id", ""),
+)
+BLOOD_TEST_COLUMNS: tuple[tuple[str, str], ...] = (
+    ("id", "q"),
+    ("config_entry_id", ""),
+    ("timestamp", "q"),
+    ("level_pg_ml", "d"),
+    ("notes", ""),
+    ("on_schedule", ""),
+    ("profile_id", ""),
+)
+
+
+class ColumnMirror:
+    """Timestamp-sorted, column-wise copy of a table's rows from window_start on.
+
+    Rows older than window_start are not mirrored; the database counts
+    them and reads them from SQL on the rare calls that reach back that
+    far.
+    """
+
+    def __init__(
+        self, columns: Sequence[tuple[str, str]], window_start: float
+    ) -> None:
+        """Initialize an empty mirror with the given (name, typecode) columns."""
+        self.names = tuple(name for name, _code in columns)
+        self._codes = tuple(code for _name, code in columns)
+        self._ts_index = self.names.index("timestamp")
+        self._id_index = self.names.index("id")
+        self.window_start = window_start
+        self.version = 0
+        self._records: list[dict[str, Any]] | None = None
+        self._cols: list[Any] = []
+        self.clear()
+
+    def __len__(self) -> int:
+        """Return the number of mirrored rows."""
+        return len(self._cols[self._ts_index])
+
+    @property
+    def timestamps(self) -> array:
+        """Timestamp column (sorted ascending); do not modify."""
+        return self._cols[self._ts_index]
+
+    def column(self, name: str) -> Sequence[Any]:
+        """Return one column by name; do not modify."""
+        return self._cols[self.names.index(name)]
+
+    def covers(self, ts: float) -> bool:
+        """True if a row at *ts* belongs in the mirror."""
+        return ts >= self.window_start
+
+    def _touch(self) -> None:
+        """Invalidate cached records after a change."""
+        self.version += 1
+        self._records = None
+
+    def clear(self) -> None:
+        """Drop every row."""
+        self._cols = [array(code) if code else [] for code in self._codes]
+        self._touch()
+
+    def load(self, rows: Iterable[Sequence[Any]]) -> None:
+        """Replace the contents with *rows* (tuples in column order, sorted)."""
+        self.clear()
+        for row in rows:
+            for col, value in zip(self._cols, row):
+                col.append(value)
+
+    def insert(self, row: Sequence[Any]) -> None:
+        """Insert one row (tuple in column order), keeping timestamp order."""
+        pos = bisect.bisect_right(self.timestamps, row[self._ts_index])
+        for col, value in zip(self._cols, row):
+            col.insert(pos, value)
+        self._touch()
+
+    def remove_id(self, row_id: int) -> bool:
+        """Remove the row with *row_id*; return False if it is not mirrored."""
+        try:
+            pos = self._cols[self._id_index].index(row_id)
+        except ValueError:
+            return False
+        for col in self._cols:
+            del col[pos]
+        self._touch()
+        return True
+
+    def remove_where(self, predicate: Callable[[dict[str, Any]], bool]) -> int:
+        """Remove every row whose record satisfies *predicate*; return the count."""
+        keep = [not predicate(rec) for rec in self.records()]
+        removed = keep.count(False)
+        if removed:
+            self._cols = [
+                array(code, compress(col, keep)) if code else list(compress(col, keep))
+                for col, code in zip(self._cols, self._codes)
+            ]
+            self._touch()
+        return removed
+
+    def records(self, since: float | None = None) -> list[dict[str, Any]]:
+        """Return row dicts in timestamp order (shared; treat as read-only).
+
+        *since*: only rows with timestamp >= since.
+        """
+        if self._records is None:
+            self._records = [
+                dict(zip(self.names, row)) for row in zip(*self._cols)
+            ]
+        if since is None:
+            return self._records
+        return self._records[bisect.bisect_left(self.timestamps, since):]
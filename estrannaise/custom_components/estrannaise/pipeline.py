@@ -0,0 +1,489 @@
+"""Synchronous refresh pipeline for Estrannaise.
+
+EstrannaisHub gathers everything a refresh needs from the database into a
+RefreshSnapshot, then hands it to compute_shared_model, which does all of
+the CPU work once for every entry: incremental state tracking, auto-dose
+projection, the scaling-factor fit, suggested regimens and the blood-test
+baseline check.  project_entry_data then derives each coordinator's data
+from the shared model.  The pipeline touches neither Home Assistant nor
+the database, so it runs in the executor, or in a process pool when the
+snapshot (and its result) are shipped to a worker process.
+"""
+
+from __future__ import annotations
+
+import datetime as _dt
+import json
+import logging
+import math
+from collections.abc import Sequence
+from concurrent.futures import Executor
+from concurrent.futures.process import BrokenProcessPool
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+from .const import (
+    AVAILABLE_UNITS,
+    compute_steady_state_e2_at_time,
+    compute_suggested_regimen,
+)
+from .pk import DoseArrays, E2StateTracker, evaluate_e2
+from .schedule import ProjectedSeries, get_dose_schedule
+
+if TYPE_CHECKING:
+    from homeassistant.core import HomeAssistant
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class RefreshSnapshot(NamedTuple):
+    """Everything a shared refresh reads, captured up front."""
+
+    all_configs: list[dict[str, Any]]
+    doses: list[dict[str, Any]]
+    blood_tests: list[dict[str, Any]]
+    now: float
+    local_tz: _dt.tzinfo
+    # In-memory tracker, or None to restore it from tracker_state
+    tracker: E2StateTracker | None
+    tracker_state: dict[str, Any] | None
+    # Fit carried over from the previous refresh, or None to start afresh
+    scaling_fit: ScalingFit | None = None
+
+
+class SharedModel(NamedTuple):
+    """Cross-entry refresh results, computed once for every coordinator."""
+
+    all_configs: list[dict[str, Any]]
+    doses: list[dict[str, Any]]
+    # Projected recurring doses of every entry, kept symbolic
+    auto_schedules: list[ProjectedSeries]
+    blood_tests: list[dict[str, Any]]
+    scaling_factor: float
+    scaling_variance: float
+    baseline_e2: float
+    baseline_test_ts: float
+    # entry_id -> suggested regimen (None unless auto_regimen is enabled)
+    regimens: dict[str, dict[str, Any] | None]
+    tracker: E2StateTracker
+    tracker_changed: bool
+    scaling_fit: ScalingFit
+    # Unix time at which a stored or projected dose starts to count, so the
+    # model must be recomputed even if no data changed
+    valid_until: float
+
+
+# ── Auto doses ──────────────────────────────────────────────────────────────
+
+
+def project_auto_schedules(
+    config: dict[str, Any],
+    now: float,
+    local_tz: _dt.tzinfo,
+    lookback_days: float = 90.0,
+) -> list[ProjectedSeries]:
+    """Return a config's projected recurring doses (after *now*) as runs."""
+    schedule = get_dose_schedule(config, now, local_tz)
+    future_limit = now + lookback_days * 86400.0
+    return [
+        ProjectedSeries(
+            series, now, future_limit, schedule.ester, schedule.method
+        )
+        for series in schedule.series
+    ]
+
+
+# ── Scaling factor ──────────────────────────────────────────────────────────
+
+
+# Re-sum instead of subtracting when a removal cancels this much of the weight
+_CANCELLATION_LIMIT = 1.0 / 1024.0
+
+
+class ScalingFit:
+    """Exponentially weighted scaling-factor fit over the blood tests.
+
+    Each test contributes its measured/predicted ratio with weight
+    e^(-λ·age).  Since e^(-λ·(now - ts)) = e^(-λ·(now - t0))·e^(λ·(ts - t0)),
+    the now-dependent factor cancels out of both the weighted mean and the
+    weighted variance, so the fit keeps running sums S0 = Σu, S1 = Σu·r and
+    S2 = Σu·r² with u = e^(λ·(ts - t0)) for a fixed reference time t0.
+    Adding or removing a test is an O(1) update of the sums.
+
+    Predictions are cached per test together with a digest of the doses
+    that can affect them (DoseArrays.digest up to the latest cached test,
+    plus the projected schedule runs starting by then); while the digest
+    is unchanged only new tests are evaluated, in one batched PK call.
+    Any change to those doses (or to the configs used by the on-schedule
+    steady-state fallback) re-evaluates every test.
+    """
+
+    __slots__ = (
+        "decay_lambda",
+        "_entries",
+        "_horizon",
+        "_dose_key",
+        "_t0",
+        "_sums",
+    )
+
+    def __init__(self, decay_lambda: float = 0.02) -> None:
+        """Initialize an empty fit (*decay_lambda* per day)."""
+        self.decay_lambda = decay_lambda
+        # test key -> (timestamp, raw prediction, ratio or None if unusable)
+        self._entries: dict[tuple, tuple[float, float, float | None]] = {}
+        self._horizon = -math.inf
+        self._dose_key: tuple[bytes, tuple, str] | None = None
+        self._t0: float | None = None
+        self._sums = [0.0, 0.0, 0.0]
+
+    @staticmethod
+    def _test_key(test: dict[str, Any], occurrence: int = 0) -> tuple:
+        """Identity of a blood test record (row id plus its contents).
+
+        *occurrence* tells apart identical records without a row id.
+        """
+        return (
+            test.get("id"),
+            test["timestamp"],
+            test["level_pg_ml"],
+            bool(test.get("on_schedule")),
+            occurrence,
+        )
+
+    def _weight(self, ts: float) -> float:
+        """Relative weight e^(λ·(ts - t0)) of a test taken at *ts*."""
+        assert self._t0 is not None
+        return math.exp(self.decay_lambda * (ts - self._t0) / 86400.0)
+
+    def _accumulate(self, ts: float, ratio: float | None, sign: float) -> None:
+        """Add (sign=1) or remove (sign=-1) one test's contribution."""
+        if ratio is None:
+            return
+        if self._t0 is None:
+            self._t0 = ts
+        elif ts > self._t0:
+            # Re-anchor at the newest test so weights stay <= 1
+            scale = self._weight(ts) ** -1
+            self._sums = [v * scale for v in self._sums]
+            self._t0 = ts
+        u = sign * self._weight(ts)
+        self._sums[0] += u
+        self._sums[1] += u * ratio
+        self._sums[2] += u * ratio * ratio
+
+    def _resum(self) -> None:
+        """Rebuild the running sums from the cached ratios (no PK calls)."""
+        self._t0 = None
+        self._sums = [0.0, 0.0, 0.0]
+        for ts, _raw, ratio in sorted(self._entries.values(), reverse=True):
+            self._accumulate(ts, ratio, 1.0)
+
+    def _reset(self) -> None:
+        """Forget every cached prediction and sum."""
+        self._entries = {}
+        self._horizon = -math.inf
+        self._t0 = None
+        self._sums = [0.0, 0.0, 0.0]
+
+    @staticmethod
+    def _schedule_key(
+        schedules: Sequence[ProjectedSeries], until: float
+    ) -> tuple:
+        """Identity of the schedule runs' doses at or before *until*."""
+        key = []
+        for run in schedules:
+            first = run.first_time()
+            if first is not None and first <= until:
+                key.append((run.series, run.after, min(run.until, until)))
+        return tuple(key)
+
+    def update(
+        self,
+        tests: list[dict[str, Any]],
+        doses: DoseArrays,
+        all_configs: list[dict[str, Any]] | None = None,
+        local_tz: _dt.tzinfo | None = None,
+        schedules: Sequence[ProjectedSeries] = (),
+    ) -> None:
+        """Bring the fit in line with *tests*, *doses* and *schedules*."""
+        config_key = json.dumps(
+            [all_configs, str(local_tz)], sort_keys=True, default=str
+        )
+        if (
+            self._dose_key is None
+            or self._dose_key[2] != config_key
+            or self._dose_key[0] != doses.digest(self._horizon)
+            or self._dose_key[1] != self._schedule_key(schedules, self._horizon)
+        ):
+            self._reset()
+
+        current: dict[tuple, dict[str, Any]] = {}
+        for test in tests:
+            occurrence = 0
+            while self._test_key(test, occurrence) in current:
+                occurrence += 1
+            current[self._test_key(test, occurrence)] = test
+
+        removed = [k for k in self._entries if k not in current]
+        if removed:
+            mass = self._sums[0]
+            for key in removed:
+                ts, _raw, ratio = self._entries.pop(key)
+                self._accumulate(ts, ratio, -1.0)
+            if not self._entries:
+                # Drop accumulated round-off along with the last test
+                self._reset()
+            elif self._sums[0] < mass * _CANCELLATION_LIMIT:
+                # Removed tests carried nearly all the weight; the remainder
+                # would be mostly round-off, so re-sum the cached ratios
+                self._resum()
+
+        added = [(key, test) for key, test in current.items() if key not in self._entries]
+        if added:
+            predictions = evaluate_e2(
+                doses,
+                [test["timestamp"] for _k, test in added],
+                schedules=schedules,
+            )
+            for (key, test), raw in zip(added, predictions.tolist()):
+                predicted = raw
+                if predicted < 1.0 and test.get("on_schedule") and all_configs:
+                    # Try virtual steady-state for on_schedule tests
+                    predicted = compute_steady_state_e2_at_time(
+                        test["timestamp"], all_configs, local_tz
+                    )
+                ratio = test["level_pg_ml"] / predicted if predicted >= 1.0 else None
+                self._entries[key] = (test["timestamp"], raw, ratio)
+                self._accumulate(test["timestamp"], ratio, 1.0)
+                self._horizon = max(self._horizon, test["timestamp"])
+
+        self._dose_key = (
+            doses.digest(self._horizon),
+            self._schedule_key(schedules, self._horizon),
+            config_key,
+        )
+
+    def raw_prediction(self, test: dict[str, Any]) -> float:
+        """Model prediction (no steady-state fallback) for a fitted test."""
+        return self._entries[self._test_key(test)][1]
+
+    def result(self) -> tuple[float, float]:
+        """Return (factor clamped to [0.0, 2.0], weighted variance).
+
+        Returns (1.0, 0.0) if no test is usable.
+        """
+        s0, s1, s2 = self._sums
+        if not self._entries or s0 <= 0:
+            return (1.0, 0.0)
+        factor = s1 / s0
+        variance = max(0.0, s2 / s0 - factor * factor)
+        return (max(0.0, min(2.0, factor)), variance)
+
+
+def compute_scaling_factor(
+    tests: list[dict[str, Any]],
+    all_doses: list[dict[str, Any]] | DoseArrays,
+    now: float,
+    all_configs: list[dict[str, Any]] | None = None,
+    local_tz: _dt.tzinfo | None = None,
+    decay_lambda: float = 0.02,
+) -> tuple[float, float]:
+    """Compute exponentially-weighted scaling factor from blood tests.
+
+    For each blood test, compares measured level to predicted level from
+    the PK model at that timestamp. Recent tests are weighted more heavily.
+    Predictions for all test timestamps are evaluated in one batched pass.
+
+    For tests marked on_schedule=True where predicted E2 is negligible
+    (no dose records that far back), virtual steady-state doses are
+    generated from all_configs to produce a meaningful prediction.
+
+    decay_lambda: exponential decay rate for weighting (per day).  The
+    weights only matter relative to each other, so the result does not
+    depend on *now*.  One-shot form of ScalingFit, which callers that
+    refresh repeatedly should keep instead.
+    Returns (factor, variance) where factor is clamped to [0.0, 2.0].
+    Returns (1.0, 0.0) if no usable tests.
+    """
+    if not tests:
+        return (1.0, 0.0)
+    fit = ScalingFit(decay_lambda)
+    fit.update(tests, DoseArrays.coerce(all_doses), all_configs, local_tz)
+    return fit.result()
+
+
+# ── Pipeline ────────────────────────────────────────────────────────────────
+
+
+def compute_shared_model(snapshot: RefreshSnapshot) -> SharedModel:
+    """Compute the cross-entry refresh model from *snapshot* (blocking, pure)."""
+    all_configs = snapshot.all_configs
+    all_manual_doses = snapshot.doses
+    all_blood_tests = snapshot.blood_tests
+    now = snapshot.now
+
+    # Advance the incremental E2 state.  Projected auto doses all lie in
+    # the future, so the level at *now* comes from the stored doses alone.
+    tracker = snapshot.tracker
+    if tracker is None:
+        if snapshot.tracker_state:
+            tracker = E2StateTracker.from_dict(
+                snapshot.tracker_state, all_manual_doses, now
+            )
+        else:
+            tracker = E2StateTracker(now)
+            tracker.sync(all_manual_doses, now)
+        tracker_changed = True
+    else:
+        tracker_changed = tracker.sync(all_manual_doses, now)
+
+    # Projected recurring doses for ALL entries, as (anchor, interval,
+    # dose, model) runs the PK engine sums in closed form
+    auto_schedules = [
+        run
+        for cfg in all_configs
+        for run in project_auto_schedules(cfg, now, snapshot.local_tz)
+    ]
+
+    # Stored doses for PK computation (converted to arrays once, reused by
+    # the scaling fit and baseline check)
+    combined_doses = DoseArrays.from_records(all_manual_doses)
+
+    # Compute scaling factor and variance (only new blood tests, or all of
+    # them if the doses they depend on changed, are evaluated)
+    scaling_fit = snapshot.scaling_fit or ScalingFit()
+    scaling_fit.update(
+        all_blood_tests,
+        combined_doses,
+        all_configs,
+        snapshot.local_tz,
+        auto_schedules,
+    )
+    scaling_factor, scaling_variance = scaling_fit.result()
+
+    # Compute suggested regimens for entries with auto_regimen enabled
+    regimens: dict[str, dict[str, Any] | None] = {}
+    for cfg in all_configs:
+        if cfg.get("auto_regimen", False):
+            regimens[cfg["entry_id"]] = compute_suggested_regimen(
+                cfg["ester"],
+                cfg["method"],
+                cfg.get("target_type", "target_range"),
+            )
+
+    # Blood test baseline (zero-state handling)
+    # When predicted E2 is negligible (<1 pg/mL) at all test times,
+    # multiplicative scaling cannot work. Use the most recent blood test
+    # as a persistent baseline offset. The blood test represents the
+    # individual's actual E2 from sources the PK model can't explain
+    # (endogenous production, unlogged doses, etc.) — assumed to persist.
+    # Tests marked on_schedule=True are handled by virtual steady-state
+    # in compute_scaling_factor() and should not trigger baseline mode.
+    baseline_e2 = 0.0
+    baseline_test_ts = 0.0
+    baseline_candidates = [
+        bt for bt in all_blood_tests
+        if not bt.get("on_schedule")
+    ]
+    if baseline_candidates:
+        all_negligible = all(
+            scaling_fit.raw_prediction(bt) < 1.0 for bt in baseline_candidates
+        )
+        if all_negligible:
+            latest = max(baseline_candidates, key=lambda t: t["timestamp"])
+            baseline_e2 = latest["level_pg_ml"]
+            baseline_test_ts = latest["timestamp"]
+
+    upcoming = [d["timestamp"] for d in all_manual_doses if d["timestamp"] > now]
+    for run in auto_schedules:
+        first = run.first_time()
+        if first is not None:
+            upcoming.append(first)
+
+    return SharedModel(
+        all_configs=all_configs,
+        doses=all_manual_doses,
+        auto_schedules=auto_schedules,
+        blood_tests=all_blood_tests,
+        scaling_factor=scaling_factor,
+        scaling_variance=scaling_variance,
+        baseline_e2=baseline_e2,
+        baseline_test_ts=baseline_test_ts,
+        regimens=regimens,
+        tracker=tracker,
+        tracker_changed=tracker_changed,
+        scaling_fit=scaling_fit,
+        valid_until=min(upcoming, default=math.inf),
+    )
+
+
+def project_entry_data(
+    shared: SharedModel, entry_id: str, config: dict[str, Any]
+) -> dict[str, Any]:
+    """Build one coordinator's data from the shared model.
+
+    The level is read from the shared tracker at its current t_ref (the
+    caller advances it to "now" first).  Cheap: no PK summation.
+    """
+    now = shared.tracker.t_ref
+    scaling_factor = shared.scaling_factor
+    scaling_variance = shared.scaling_variance
+
+    # Compute current E2 level
+    units = config["units"]
+    cf = AVAILABLE_UNITS.get(units, {}).get("conversion_factor", 1.0)
+    current_e2 = shared.tracker.level() * scaling_factor * cf
+
+    # When target is menstrual_range, suggested_regimen IS the cycle fit
+    suggested_regimen = None
+    cycle_fit_regimen = None
+    if config.get("auto_regimen", False):
+        suggested_regimen = shared.regimens.get(entry_id)
+        if suggested_regimen and "schedules" in suggested_regimen:
+            cycle_fit_regimen = suggested_regimen
+
+    # Add baseline to displayed E2 value and reset bogus scaling
+    # Decay baseline exponentially so old tests fade out (λ=0.02/day, ~35d half-life)
+    if shared.baseline_e2 > 0:
+        age_days = (now - shared.baseline_test_ts) / 86400.0
+        baseline_decayed = shared.baseline_e2 * math.exp(-0.02 * max(0, age_days))
+        scaling_factor = 1.0
+        scaling_variance = 0.0
+        current_e2 += baseline_decayed * cf
+
+    return {
+        "doses": shared.doses,
+        "auto_schedules": shared.auto_schedules,
+        "blood_tests": shared.blood_tests,
+        "scaling_factor": scaling_factor,
+        "scaling_variance": scaling_variance,
+        "current_e2": round(current_e2, 1),
+        "config": config,
+        "all_configs": shared.all_configs,
+        "suggested_regimen": suggested_regimen,
+        "cycle_fit_regimen": cycle_fit_regimen,
+        "baseline_e2": round(shared.baseline_e2, 2),
+        "baseline_test_ts": shared.baseline_test_ts,
+    }
+
+
+async def async_compute_shared_model(
+    hass: HomeAssistant,
+    snapshot: RefreshSnapshot,
+    process_pool: Executor | None = None,
+) -> SharedModel:
+    """Run compute_shared_model off the event loop.
+
+    Uses *process_pool* when given (the snapshot and result are pickled
+    across), falling back to HA's executor if the pool is unusable.
+    """
+    if process_pool is not None:
+        try:
+            return await hass.loop.run_in_executor(
+                process_pool, compute_shared_model, snapshot
+            )
+        except (BrokenProcessPool, RuntimeError) as exc:
+            _LOGGER.warning(
+                "Refresh process pool unavailable, using executor: %s", exc
+            )
+    return await hass.async_add_executor_job(compute_shared_model, snapshot)
@@ -0,0 +1,880 @@
+"""Vectorized pharmacokinetic evaluation engine for Estrannaise.
+
+The scalar helpers in const.py evaluate one dose at one time from raw
+parameters.  This module compiles every entry of PK_PARAMETERS once, at
+import, into a PKModel holding its exponential-term decomposition (the
+partial-fraction coefficients of the selected closed-form branch) and, for
+patches, the post-removal residual terms per unit dose.  Whole dose sets are
+then evaluated against whole vectors of times in a single NumPy pass,
+grouped by model.
+"""
+
+from __future__ import annotations
+
+import functools
+import hashlib
+import math
+from collections.abc import Iterable, Sequence
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+
+from .const import PATCH_WEAR_DAYS, PK_PARAMETERS, _es_single_dose_3c
+
+if TYPE_CHECKING:
+    from .schedule import ProjectedSeries
+
+# Upper bound on (times x doses) cells evaluated per chunk, to cap memory
+_MAX_CELLS = 1_000_000
+
+# Blocks this small are evaluated whole rather than split into windows
+_DENSE_CELLS = 16_384
+
+# Doses whose contribution has fallen below this level (pg/mL) are skipped
+DEFAULT_RELEVANCE_EPSILON = 1e-4
+
+# A term (coef, power, rate) stands for coef * t**power * exp(-rate * t)
+ExpTerm = tuple[float, int, float]
+
+
+# ── Exponential-term decomposition ──────────────────────────────────────────
+
+
+def curve_terms(d: float, k1: float, k2: float, k3: float) -> list[ExpTerm]:
+    """Decompose the unit-dose e2_curve_3c into exponential terms.
+
+    Mirrors the equal-rate branches of e2_curve_3c, so that summing the
+    returned terms at t >= 0 reproduces the scalar curve exactly.
+    """
+    if d <= 0:
+        return []
+    if k1 == k2 and k2 == k3:
+        return [(d * k1 * k1 / 2.0, 2, k1)]
+    if k1 == k2:
+        a = d * k1 * k1 / (k1 - k3) / (k1 - k3)
+        return [(a, 0, k3), (-a, 0, k1), (-a * (k1 - k3), 1, k1)]
+    if k1 == k3:
+        a = d * k1 * k2 / (k1 - k2) / (k1 - k2)
+        return [(a, 0, k2), (-a, 0, k1), (-a * (k1 - k2), 1, k1)]
+    if k2 == k3:
+        a = d * k1 * k2 / (k1 - k2) / (k1 - k2)
+        return [(a, 0, k1), (-a, 0, k2), (a * (k1 - k2), 1, k2)]
+    return [
+        (d * k1 * k2 / (k1 - k2) / (k1 - k3), 0, k1),
+        (-d * k1 * k2 / (k1 - k2) / (k2 - k3), 0, k2),
+        (d * k1 * k2 / (k1 - k3) / (k2 - k3), 0, k3),
+    ]
+
+
+def curve_branch(k1: float, k2: float, k3: float) -> str:
+    """Name the closed-form branch e2_curve_3c takes for these rates."""
+    if k1 == k2 and k2 == k3:
+        return "equal"
+    if k1 == k2:
+        return "k1=k2"
+    if k1 == k3:
+        return "k1=k3"
+    if k2 == k3:
+        return "k2=k3"
+    return "distinct"
+
+
+def _periodic_term_sum(term: ExpTerm, s: float, period: float) -> float:
+    """Sum a term over s, s + T, s + 2T, ... (closed-form geometric series)."""
+    c, p, r = term
+    if r <= 0 or period <= 0:
+        return 0.0
+    q = math.exp(-r * period)
+    g = 1.0 / (1.0 - q)
+    e = c * math.exp(-r * s)
+    if p == 0:
+        return e * g
+    if p == 1:
+        return e * (s * g + period * q * g * g)
+    return e * (
+        s * s * g
+        + 2.0 * s * period * q * g * g
+        + period * period * q * (1.0 + q) * g * g * g
+    )
+
+
+def _periodic_term_sum_np(
+    term: ExpTerm, s: np.ndarray, period: float
+) -> np.ndarray:
+    """Vectorized _periodic_term_sum over an array of start offsets."""
+    c, p, r = term
+    if r <= 0 or period <= 0:
+        return np.zeros_like(s)
+    q = math.exp(-r * period)
+    g = 1.0 / (1.0 - q)
+    e = c * np.exp(-r * s)
+    if p == 0:
+        return e * g
+    if p == 1:
+        return e * (s * g + period * q * g * g)
+    return e * (
+        s * s * g
+        + 2.0 * s * period * q * g * g
+        + period * period * q * (1.0 + q) * g * g * g
+    )
+
+
+def _term_integral(term: ExpTerm, upper: float | None = None) -> float:
+    """Integrate a term over [0, upper] (or [0, inf) when upper is None)."""
+    c, p, r = term
+    if r <= 0:
+        return 0.0
+    full = c * math.factorial(p) / r ** (p + 1)
+    if upper is None:
+        return full
+    # Upper tail: ∫_u^∞ t^p e^(-rt) dt = e^(-ru) Σ_k p!/k! u^k / r^(p-k+1)
+    tail = sum(
+        math.factorial(p) / math.factorial(k) * upper ** k / r ** (p - k + 1)
+        for k in range(p + 1)
+    )
+    return full - c * math.exp(-r * upper) * tail
+
+
+def _eval_terms(terms: Sequence[ExpTerm], t: float) -> float:
+    """Evaluate a sum of exponential terms at scalar t."""
+    total = 0.0
+    for c, p, r in terms:
+        v = c * math.exp(-r * t)
+        if p:
+            v *= t ** p
+        total += v
+    return total
+
+
+def _eval_terms_np(terms: Sequence[ExpTerm], t: np.ndarray) -> np.ndarray:
+    """Evaluate a sum of exponential terms over an array of t."""
+    total = np.zeros_like(t)
+    for c, p, r in terms:
+        v = c * np.exp(-r * t)
+        if p:
+            v *= t ** p
+        total += v
+    return total
+
+
+# ── Compiled PK models ──────────────────────────────────────────────────────
+
+
+class PKModel:
+    """A PK_PARAMETERS entry compiled for repeated evaluation.
+
+    Holds the raw parameters, the selected closed-form branch, the
+    unit-dose curve as exponential terms and, for patches, the wear
+    duration, the compartment residuals at removal and the post-removal
+    terms (all per unit dose).  Levels scale linearly with dose.
+    """
+
+    __slots__ = (
+        "key",
+        "d",
+        "k1",
+        "k2",
+        "k3",
+        "branch",
+        "terms",
+        "wear_days",
+        "es_w",
+        "e2_w",
+        "residual_terms",
+    )
+
+    def __init__(self, key: str, params: Sequence[float]) -> None:
+        """Compile *params* ([d, k1, k2, k3]) for model *key*."""
+        d, k1, k2, k3 = params
+        self.key = key
+        self.d = d
+        self.k1 = k1
+        self.k2 = k2
+        self.k3 = k3
+        self.branch = curve_branch(k1, k2, k3)
+        self.terms: tuple[ExpTerm, ...] = tuple(curve_terms(d, k1, k2, k3))
+        self.wear_days: float | None = PATCH_WEAR_DAYS.get(key)
+        self.es_w = 0.0
+        self.e2_w = 0.0
+        self.residual_terms: tuple[ExpTerm, ...] = ()
+        if self.wear_days is not None:
+            w = self.wear_days
+            self.es_w = _es_single_dose_3c(w, 1.0, d, k1, k2)
+            self.e2_w = max(0.0, _eval_terms(self.terms, w))
+            residual: list[ExpTerm] = []
+            if self.es_w > 0:
+                if k2 == k3:
+                    residual.append((self.es_w * k2, 1, k2))
+                else:
+                    residual.append((self.es_w * k2 / (k2 - k3), 0, k3))
+                    residual.append((-self.es_w * k2 / (k2 - k3), 0, k2))
+            if self.e2_w > 0:
+                residual.append((self.e2_w, 0, k3))
+            self.residual_terms = tuple(residual)
+
+    @property
+    def is_patch(self) -> bool:
+        """Return True for transdermal patch models."""
+        return self.wear_days is not None
+
+    def level(self, t: float, dose: float = 1.0) -> float:
+        """E2 (pg/mL) *t* days after a dose of *dose* PK units."""
+        if t < 0 or dose <= 0:
+            return 0.0
+        try:
+            if self.wear_days is not None and t > self.wear_days:
+                return dose * _eval_terms(
+                    self.residual_terms, t - self.wear_days
+                )
+            return dose * _eval_terms(self.terms, t)
+        except OverflowError:
+            return 0.0
+
+    def response(self, t: np.ndarray) -> np.ndarray:
+        """Unit-dose E2 over an array of elapsed days (zero for t < 0)."""
+        t = np.asarray(t, dtype=np.float64)
+        tc = np.maximum(t, 0.0)
+        with np.errstate(over="ignore", invalid="ignore"):
+            if self.wear_days is None:
+                val = _eval_terms_np(self.terms, tc)
+            else:
+                w = self.wear_days
+                val = np.where(
+                    tc <= w,
+                    _eval_terms_np(self.terms, np.minimum(tc, w)),
+                    _eval_terms_np(self.residual_terms, np.maximum(tc - w, 0.0)),
+                )
+        val = np.where(np.isfinite(val), val, 0.0)
+        return np.where(t < 0, 0.0, val)
+
+    def periodic_level(self, phase_days: float, interval_days: float) -> float:
+        """Steady-state E2 from a 1-unit dose repeated forever.
+
+        *phase_days*: time since the most recent dose, in [0, interval_days).
+        Exact over infinite dose history and O(1) in the number of
+        intervals; covers injections, oral and patches (worn and
+        post-removal phases).
+        """
+        if interval_days <= 0 or not self.terms:
+            return 0.0
+        period = interval_days
+        phase = math.fmod(phase_days, period)
+        if phase < 0:
+            phase += period
+
+        try:
+            if self.wear_days is None:
+                total = sum(
+                    _periodic_term_sum(tm, phase, period) for tm in self.terms
+                )
+                return max(0.0, total)
+
+            # Patch: doses aged phase + nT are still worn while age <= w;
+            # the remaining (older) doses follow the post-removal residual.
+            w = self.wear_days
+            n_worn = int(math.floor((w - phase) / period)) + 1 if phase <= w else 0
+            first_removed = phase + n_worn * period
+            total = 0.0
+            for tm in self.terms:
+                # Finite worn sum = infinite sum from phase - tail from first_removed
+                total += _periodic_term_sum(tm, phase, period)
+                total -= _periodic_term_sum(tm, first_removed, period)
+            for tm in self.residual_terms:
+                total += _periodic_term_sum(tm, first_removed - w, period)
+            return max(0.0, total)
+        except (OverflowError, ZeroDivisionError, ValueError):
+            return 0.0
+
+    def periodic_response(
+        self, phase_days: np.ndarray, interval_days: float
+    ) -> np.ndarray:
+        """Vectorized periodic_level over an array of phases (days)."""
+        phase = np.asarray(phase_days, dtype=np.float64)
+        if interval_days <= 0 or not self.terms:
+            return np.zeros_like(phase)
+        period = interval_days
+        phase = np.mod(phase, period)
+        with np.errstate(over="ignore", invalid="ignore", divide="ignore"):
+            total = np.zeros_like(phase)
+            if self.wear_days is None:
+                for tm in self.terms:
+                    total += _periodic_term_sum_np(tm, phase, period)
+            else:
+                w = self.wear_days
+                n_worn = np.where(
+                    phase <= w, np.floor((w - phase) / period) + 1.0, 0.0
+                )
+                first_removed = phase + n_worn * period
+                for tm in self.terms:
+                    total += _periodic_term_sum_np(tm, phase, period)
+                    total -= _periodic_term_sum_np(tm, first_removed, period)
+                for tm in self.residual_terms:
+                    total += _periodic_term_sum_np(tm, first_removed - w, period)
+        total = np.where(np.isfinite(total), total, 0.0)
+        return np.maximum(total, 0.0)
+
+    def series_response(
+        self, age_days: np.ndarray, interval_days: float, count: np.ndarray
+    ) -> np.ndarray:
+        """E2 from *count* unit doses aged age, age + T, age + 2T, ... days.
+
+        Vectorized over *age_days* / *count* (T = *interval_days*).  A
+        finite run is the difference of two infinite periodic sums, so the
+        cost does not depend on the count; patch runs are split into the
+        doses still worn and those already removed.
+        """
+        age = np.asarray(age_days, dtype=np.float64)
+        n = np.asarray(count, dtype=np.float64)
+        if interval_days <= 0 or not self.terms:
+            return np.zeros_like(age)
+        period = interval_days
+        # Age of the (absent) dose just past the run
+        end = age + n * period
+        with np.errstate(over="ignore", invalid="ignore", divide="ignore"):
+            total = np.zeros_like(age)
+            if self.wear_days is None:
+                for tm in self.terms:
+                    total += (
+                        _periodic_term_sum_np(tm, age, period)
+                        - _periodic_term_sum_np(tm, end, period)
+                    )
+            else:
+                w = self.wear_days
+                n_worn = np.where(age <= w, np.floor((w - age) / period) + 1.0, 0.0)
+                first_removed = age + np.minimum(n_worn, n) * period
+                for tm in self.terms:
+                    total += (
+                        _periodic_term_sum_np(tm, age, period)
+                        - _periodic_term_sum_np(tm, first_removed, period)
+                    )
+                # Post-removal ages; zeroed where every dose is still worn,
+                # since end - w < 0 would overflow the terms
+                removed = first_removed < end
+                lo = np.where(removed, first_removed - w, 0.0)
+                hi = np.where(removed, end - w, 0.0)
+                for tm in self.residual_terms:
+                    total += (
+                        _periodic_term_sum_np(tm, lo, period)
+                        - _periodic_term_sum_np(tm, hi, period)
+                    )
+        total = np.where(np.isfinite(total) & (n > 0), total, 0.0)
+        return np.maximum(total, 0.0)
+
+    def relevance_horizon(self, threshold: float) -> float:
+        """Days after which a unit dose stays below *threshold* pg/mL.
+
+        Bounds the curve by the envelope Σ|c|·t^p·e^(-r·t) of its tail
+        terms, which decreases monotonically past max(p/r), and bisects
+        for the crossing.  Returns inf when *threshold* <= 0.
+        """
+        if threshold <= 0:
+            return math.inf
+        if self.wear_days is None:
+            terms, offset = self.terms, 0.0
+        else:
+            # Worn doses are always relevant; bound the post-removal tail
+            terms, offset = self.residual_terms, self.wear_days
+        terms = tuple(tm for tm in terms if tm[0] != 0 and tm[2] > 0)
+        if not terms:
+            return offset
+
+        def envelope(t: float) -> float:
+            return sum(abs(c) * t ** p * math.exp(-r * t) for c, p, r in terms)
+
+        lo = max(p / r for _c, p, r in terms)
+        if envelope(lo) < threshold:
+            return offset + lo
+        hi = lo + 1.0
+        while envelope(hi) >= threshold:
+            lo, hi = hi, lo + 2.0 * (hi - lo)
+            if hi > 1e5:
+                return math.inf
+        for _ in range(60):
+            mid = 0.5 * (lo + hi)
+            if envelope(mid) >= threshold:
+                lo = mid
+            else:
+                hi = mid
+        return offset + hi
+
+    def auc(self) -> float:
+        """Total area under the unit-dose curve (pg/mL x days).
+
+        Dividing dose x AUC by the dosing interval gives the exact
+        steady-state average level.
+        """
+        try:
+            if self.wear_days is None:
+                return sum(_term_integral(tm) for tm in self.terms)
+            return sum(
+                _term_integral(tm, self.wear_days) for tm in self.terms
+            ) + sum(_term_integral(tm) for tm in self.residual_terms)
+        except (OverflowError, ZeroDivisionError):
+            return 0.0
+
+
+# Compiled once at import; keyed like PK_PARAMETERS
+PK_MODELS: dict[str, PKModel] = {
+    key: PKModel(key, params) for key, params in PK_PARAMETERS.items()
+}
+
+# Stable integer ids for PK model keys (used in dose arrays)
+MODEL_KEYS: tuple[str, ...] = tuple(PK_MODELS)
+MODEL_INDEX: dict[str, int] = {key: i for i, key in enumerate(MODEL_KEYS)}
+
+
+# ── Dose sets ───────────────────────────────────────────────────────────────
+
+
+def pk_amount(model: str, dose_mg: float) -> float:
+    """Convert a stored dose amount to PK model units."""
+    # Patch PK parameters are calibrated for mcg/day input;
+    # stored dose_mg is in mg/day, so convert (×1000)
+    if model in PATCH_WEAR_DAYS:
+        return dose_mg * 1000.0
+    return dose_mg
+
+
+class DoseArrays:
+    """Column-oriented dose set: timestamps, model ids and PK-unit amounts.
+
+    Amounts are stored in PK model units, i.e. patch doses are already
+    converted from mg/day to mcg/day.  Doses with an unknown model or a
+    non-positive amount contribute nothing and are dropped on construction.
+    A per-model, timestamp-sorted view is built on first use (see by_model).
+    """
+
+    __slots__ = ("timestamps", "model_ids", "amounts", "_by_model")
+
+    def __init__(
+        self,
+        timestamps: np.ndarray,
+        model_ids: np.ndarray,
+        amounts: np.ndarray,
+    ) -> None:
+        """Initialize from pre-built arrays (same length)."""
+        self.timestamps = np.asarray(timestamps, dtype=np.float64)
+        self.model_ids = np.asarray(model_ids, dtype=np.int16)
+        self.amounts = np.asarray(amounts, dtype=np.float64)
+        self._by_model: dict[int, tuple[np.ndarray, np.ndarray]] | None = None
+
+    @classmethod
+    def from_records(cls, doses: Iterable[dict[str, Any]]) -> DoseArrays:
+        """Build arrays from dose dicts with 'timestamp', 'model', 'dose_mg'."""
+        ts: list[float] = []
+        ids: list[int] = []
+        amts: list[float] = []
+        for rec in doses:
+            model = rec.get("model", "")
+            mid = MODEL_INDEX.get(model)
+            if mid is None:
+                continue
+            amount = pk_amount(model, rec.get("dose_mg", 0.0) or 0.0)
+            if amount <= 0:
+                continue
+            ts.append(rec["timestamp"])
+            ids.append(mid)
+            amts.append(amount)
+        return cls(
+            np.array(ts, dtype=np.float64),
+            np.array(ids, dtype=np.int16),
+            np.array(amts, dtype=np.float64),
+        )
+
+    @classmethod
+    def coerce(
+        cls, doses: DoseArrays | Iterable[dict[str, Any]]
+    ) -> DoseArrays:
+        """Return *doses* as DoseArrays, converting dose dicts if needed."""
+        if isinstance(doses, DoseArrays):
+            return doses
+        return cls.from_records(doses)
+
+    def __len__(self) -> int:
+        """Return the number of doses."""
+        return int(self.timestamps.shape[0])
+
+    def digest(self, until: float = math.inf) -> bytes:
+        """Order-independent fingerprint of the doses at or before *until*.
+
+        Doses after *until* cannot affect a level at or before it, so two
+        dose sets with equal digests predict the same levels up to *until*.
+        """
+        mask = self.timestamps <= until
+        ts = self.timestamps[mask]
+        ids = self.model_ids[mask]
+        amts = self.amounts[mask]
+        order = np.lexsort((amts, ids, ts))
+        h = hashlib.blake2b(digest_size=16)
+        for arr in (ts[order], ids[order], amts[order]):
+            h.update(np.ascontiguousarray(arr).tobytes())
+        return h.digest()
+
+    def by_model(self) -> dict[int, tuple[np.ndarray, np.ndarray]]:
+        """Return {model id: (timestamps, amounts)}, sorted by timestamp."""
+        if self._by_model is None:
+            groups: dict[int, tuple[np.ndarray, np.ndarray]] = {}
+            for mid in np.unique(self.model_ids).tolist():
+                mask = self.model_ids == mid
+                dose_ts = self.timestamps[mask]
+                order = np.argsort(dose_ts, kind="stable")
+                groups[mid] = (dose_ts[order], self.amounts[mask][order])
+            self._by_model = groups
+        return self._by_model
+
+
+def unit_response(model: str, t_days: np.ndarray) -> np.ndarray:
+    """E2 (pg/mL) from a 1-unit dose of *model* after *t_days* days."""
+    pk_model = PK_MODELS.get(model)
+    if pk_model is None:
+        return np.zeros_like(np.asarray(t_days, dtype=np.float64))
+    return pk_model.response(t_days)
+
+
+@functools.lru_cache(maxsize=256)
+def _relevance_horizon(model: str, threshold: float) -> float:
+    """Memoized PKModel.relevance_horizon (inputs repeat across refreshes)."""
+    return PK_MODELS[model].relevance_horizon(threshold)
+
+
+def _window_chunks(
+    lo: np.ndarray, hi: np.ndarray
+) -> Iterable[tuple[int, int]]:
+    """Split sorted times into runs that share one dose window.
+
+    *lo*/*hi* are the non-decreasing dose-window bounds of each time; a run
+    [i, j) is evaluated against doses lo[i]:hi[j - 1].  Runs only grow
+    while consecutive windows overlap (or the block is tiny) and it fits
+    _MAX_CELLS, so widely spaced times never pull in each other's doses.
+    """
+    lo_list, hi_list = lo.tolist(), hi.tolist()
+    n = len(lo_list)
+    i = 0
+    while i < n:
+        j = i + 1
+        while j < n:
+            cells = (j + 1 - i) * (hi_list[j] - lo_list[i])
+            overlaps = lo_list[j] < hi_list[j - 1]
+            if cells > _MAX_CELLS or (not overlaps and cells > _DENSE_CELLS):
+                break
+            j += 1
+        yield i, j
+        i = j
+
+
+def evaluate_e2(
+    doses: DoseArrays | Iterable[dict[str, Any]],
+    times: float | Sequence[float] | np.ndarray,
+    epsilon: float = DEFAULT_RELEVANCE_EPSILON,
+    schedules: Iterable[ProjectedSeries] = (),
+) -> np.ndarray:
+    """Evaluate the summed E2 level at every time in *times*.
+
+    *doses*: DoseArrays or dose dicts.  *times*: Unix timestamps (seconds).
+    Each time only sees the doses of each model inside its relevance
+    window, found by bisecting the model's sorted timestamps: doses after
+    the time (e.g. projected auto doses) and doses old enough to contribute
+    less than *epsilon* pg/mL are never touched.  *epsilon* <= 0 disables
+    the lower cut-off.  *schedules*: recurring dose runs, summed exactly
+    in closed form (see evaluate_series).
+    Returns an array of E2 levels (pg/mL, unscaled) with one value per time.
+    """
+    arrays = DoseArrays.coerce(doses)
+    times_arr = np.atleast_1d(np.asarray(times, dtype=np.float64))
+    total = np.zeros(times_arr.shape[0], dtype=np.float64)
+    for run in schedules:
+        total += evaluate_series(run, times_arr)
+    if len(arrays) == 0 or times_arr.shape[0] == 0:
+        return total
+
+    order = np.argsort(times_arr, kind="stable")
+    sorted_times = times_arr[order]
+    sorted_total = np.zeros_like(sorted_times)
+
+    for mid, (dose_ts, amounts) in arrays.by_model().items():
+        pk_model = PK_MODELS[MODEL_KEYS[mid]]
+        horizon = _relevance_horizon(pk_model.key, epsilon / float(amounts.max()))
+        hi = np.searchsorted(dose_ts, sorted_times, side="right")
+        if math.isinf(horizon):
+            lo = np.zeros_like(hi)
+        else:
+            lo = np.searchsorted(
+                dose_ts, sorted_times - horizon * 86400.0, side="left"
+            )
+
+        for i, j in _window_chunks(lo, hi):
+            start, stop = int(lo[i]), int(hi[j - 1])
+            if stop <= start:
+                continue
+            t_days = (
+                sorted_times[i:j, None] - dose_ts[None, start:stop]
+            ) / 86400.0
+            sorted_total[i:j] += pk_model.response(t_days) @ amounts[start:stop]
+
+    total[order] += sorted_total
+    return total
+
+
+def evaluate_series(
+    run: ProjectedSeries, times: float | Sequence[float] | np.ndarray
+) -> np.ndarray:
+    """E2 (pg/mL, unscaled) from a recurring dose run at each of *times*.
+
+    At time t the run contributes its doses up to t: a contiguous block
+    of the series, evaluated by PKModel.series_response in O(terms).
+    """
+    times_arr = np.atleast_1d(np.asarray(times, dtype=np.float64))
+    series = run.series
+    pk_model = PK_MODELS.get(series.model_key)
+    amount = pk_amount(series.model_key, series.dose_mg or 0.0)
+    if pk_model is None or amount <= 0 or series.interval_sec <= 0:
+        return np.zeros_like(times_arr)
+    first, last = series.index_range(run.after, run.until)
+    anchor, step = series.anchor_ts, series.interval_sec
+    # Empty, or entirely after every time (projections vs. past tests)
+    if last < first or not np.any(times_arr >= anchor + first * step):
+        return np.zeros_like(times_arr)
+
+    # Latest dose at or before each time, clamped to the run
+    k = np.floor((times_arr - anchor) / step)
+    k = np.where(anchor + k * step > times_arr, k - 1.0, k)
+    k = np.minimum(k, float(last))
+    count = np.maximum(k - first + 1.0, 0.0)
+    age = np.where(count > 0, (times_arr - (anchor + k * step)) / 86400.0, 0.0)
+    return amount * pk_model.series_response(age, step / 86400.0, count)
+
+
+def periodic_unit_level(
+    model: str, phase_days: float, interval_days: float
+) -> float:
+    """Steady-state E2 from a 1-unit dose of *model* (see PKModel)."""
+    pk_model = PK_MODELS.get(model)
+    if pk_model is None:
+        return 0.0
+    return pk_model.periodic_level(phase_days, interval_days)
+
+
+# ── Incremental state tracking ──────────────────────────────────────────────
+
+
+def _dose_key(rec: dict[str, Any]) -> str:
+    """Stable identity for a dose record (row id, or schedule slot if unsaved)."""
+    if rec.get("id") is not None:
+        return str(rec["id"])
+    return f"auto:{rec.get('model', '')}:{rec['timestamp']}"
+
+
+class E2StateTracker:
+    """Incrementally advanced E2 state for one profile's dose history.
+
+    The PK models are linear, so the summed response of all absorbed doses
+    is carried as moments per (model, decay rate): A = Σ a·e^(-r·τ),
+    B = Σ a·τ·e^(-r·τ), C = Σ a·τ²·e^(-r·τ), with τ the elapsed days.
+    Advancing by Δ days is closed-form, absorbing a dose adds one impulse,
+    and the level is Σ c·M_p(r) over the model's terms, so a refresh costs
+    O(models) instead of a re-sum over every dose.  Worn patches are kept
+    explicitly until removal, then absorbed into their residual terms.
+
+    Deleting or editing an absorbed dose marks its model dirty and only
+    that model is rebuilt from the current dose set.
+    """
+
+    __slots__ = ("t_ref", "_moments", "_worn", "_absorbed")
+
+    def __init__(self, t_ref: float = 0.0) -> None:
+        """Initialize an empty tracker at Unix time *t_ref*."""
+        self.t_ref = t_ref
+        # model -> {rate: [A, B, C]}
+        self._moments: dict[str, dict[float, list[float]]] = {}
+        # model -> [(key, timestamp, amount)] of patches still worn
+        self._worn: dict[str, list[tuple[str, float, float]]] = {}
+        # dose key -> (model, timestamp, dose_mg)
+        self._absorbed: dict[str, tuple[str, float, float]] = {}
+
+    @staticmethod
+    def _state_terms(pk_model: PKModel) -> tuple[ExpTerm, ...]:
+        """Terms carried in moments (post-removal terms for patches)."""
+        return pk_model.residual_terms if pk_model.is_patch else pk_model.terms
+
+    def _model_moments(self, model: str) -> dict[float, list[float]]:
+        """Return (creating if needed) the moment table for *model*."""
+        moments = self._moments.get(model)
+        if moments is None:
+            pk_model = PK_MODELS[model]
+            moments = {
+                r: [0.0, 0.0, 0.0] for _c, _p, r in self._state_terms(pk_model)
+            }
+            self._moments[model] = moments
+        return moments
+
+    def _add_impulse(self, model: str, amount: float, age: float) -> None:
+        """Add a dose of *amount* PK units that is *age* days old at t_ref."""
+        for r, m in self._model_moments(model).items():
+            e = amount * math.exp(-r * age)
+            m[0] += e
+            m[1] += e * age
+            m[2] += e * age * age
+
+    def _absorb(self, model: str, key: str, ts: float, amount: float) -> None:
+        """Absorb a dose taken at or before t_ref into the state."""
+        pk_model = PK_MODELS[model]
+        age = (self.t_ref - ts) / 86400.0
+        if pk_model.wear_days is not None and age <= pk_model.wear_days:
+            self._worn.setdefault(model, []).append((key, ts, amount))
+            return
+        if pk_model.wear_days is not None:
+            age -= pk_model.wear_days
+        self._add_impulse(model, amount, age)
+
+    def advance(self, t: float) -> None:
+        """Advance the state to Unix time *t* (no-op if t <= t_ref)."""
+        if t <= self.t_ref:
+            return
+        delta = (t - self.t_ref) / 86400.0
+        for moments in self._moments.values():
+            for r, m in moments.items():
+                e = math.exp(-r * delta)
+                a, b, c = m
+                m[0] = e * a
+                m[1] = e * (b + delta * a)
+                m[2] = e * (c + 2.0 * delta * b + delta * delta * a)
+        self.t_ref = t
+
+        # Absorb patches removed during the advance into residual moments
+        for model, worn in self._worn.items():
+            w = PK_MODELS[model].wear_days or 0.0
+            still_worn = []
+            for key, ts, amount in worn:
+                age = (t - ts) / 86400.0
+                if age > w:
+                    self._add_impulse(model, amount, age - w)
+                else:
+                    still_worn.append((key, ts, amount))
+            worn[:] = still_worn
+
+    def level(self) -> float:
+        """Return the unscaled E2 level (pg/mL) at t_ref."""
+        total = 0.0
+        for model, moments in self._moments.items():
+            for c, p, r in self._state_terms(PK_MODELS[model]):
+                total += c * moments[r][p]
+        for model, worn in self._worn.items():
+            pk_model = PK_MODELS[model]
+            for _key, ts, amount in worn:
+                total += pk_model.level((self.t_ref - ts) / 86400.0, amount)
+        return max(0.0, total)
+
+    def rebuild_model(self, model: str, doses: Iterable[dict[str, Any]]) -> None:
+        """Recompute one model's state at t_ref from its current doses."""
+        self._moments.pop(model, None)
+        self._worn.pop(model, None)
+        for key in [k for k, v in self._absorbed.items() if v[0] == model]:
+            del self._absorbed[key]
+        for rec in doses:
+            if rec.get("model") == model and rec["timestamp"] <= self.t_ref:
+                self._absorb_record(rec)
+
+    def _absorb_record(self, rec: dict[str, Any]) -> bool:
+        """Absorb a dose record; returns False if it contributes nothing."""
+        model = rec.get("model", "")
+        if model not in PK_MODELS:
+            return False
+        dose_mg = rec.get("dose_mg", 0.0) or 0.0
+        amount = pk_amount(model, dose_mg)
+        if amount <= 0:
+            return False
+        key = _dose_key(rec)
+        self._absorb(model, key, rec["timestamp"], amount)
+        self._absorbed[key] = (model, rec["timestamp"], dose_mg)
+        return True
+
+    def sync(self, doses: Sequence[dict[str, Any]], now: float) -> bool:
+        """Advance to *now* and reconcile with the current dose set.
+
+        New doses at or before *now* are absorbed as impulses (back-dated
+        ones included, since absorption is exact at any age); doses that
+        disappeared or changed trigger a rebuild of their model only.
+        Doses after *now* are ignored until they become past.
+        Returns True if the absorbed dose set changed.
+        """
+        self.advance(now)
+        current: dict[str, dict[str, Any]] = {}
+        for rec in doses:
+            if rec["timestamp"] <= self.t_ref and rec.get("model") in PK_MODELS:
+                current[_dose_key(rec)] = rec
+
+        dirty: set[str] = set()
+        for key, (model, ts, dose_mg) in self._absorbed.items():
+            rec = current.get(key)
+            if rec is None:
+                dirty.add(model)
+            elif (
+                rec["model"] != model
+                or rec["timestamp"] != ts
+                or (rec.get("dose_mg", 0.0) or 0.0) != dose_mg
+            ):
+                dirty.add(model)
+                dirty.add(rec["model"])
+
+        changed = bool(dirty)
+        for model in dirty:
+            self.rebuild_model(model, current.values())
+        for key, rec in current.items():
+            if key not in self._absorbed:
+                changed |= self._absorb_record(rec)
+        return changed
+
+    def to_dict(self) -> dict[str, Any]:
+        """Serialize the state for checkpointing."""
+        return {
+            "t_ref": self.t_ref,
+            "params": {
+                m: list(PK_PARAMETERS[m])
+                for m in set(self._moments) | set(self._worn)
+            },
+            "moments": {
+                model: [[r, *m] for r, m in moments.items()]
+                for model, moments in self._moments.items()
+            },
+            "worn": {
+                model: [list(w) for w in worn]
+                for model, worn in self._worn.items()
+            },
+            "absorbed": {k: list(v) for k, v in self._absorbed.items()},
+        }
+
+    @classmethod
+    def from_dict(
+        cls, data: dict[str, Any], doses: Sequence[dict[str, Any]], now: float
+    ) -> E2StateTracker:
+        """Restore a checkpoint and reconcile it with *doses* at *now*.
+
+        Models whose PK parameters changed since the checkpoint are
+        rebuilt from *doses* instead of trusting the stored moments.
+        """
+        tracker = cls(float(data.get("t_ref", 0.0)))
+        stale: set[str] = set()
+        for model, params in data.get("params", {}).items():
+            if model not in PK_MODELS or list(PK_PARAMETERS[model]) != params:
+                stale.add(model)
+        for model, rows in data.get("moments", {}).items():
+            if model in stale or model not in PK_MODELS:
+                continue
+            moments = tracker._model_moments(model)
+            for r, a, b, c in rows:
+                if r in moments:
+                    moments[r] = [a, b, c]
+        for model, rows in data.get("worn", {}).items():
+            if model in stale or model not in PK_MODELS:
+                continue
+            tracker._worn[model] = [(k, ts, amt) for k, ts, amt in rows]
+        for key, (model, ts, dose_mg) in data.get("absorbed", {}).items():
+            if model in PK_MODELS:
+                tracker._absorbed[key] = (model, ts, dose_mg)
+
+        tracker.advance(now)
+        for model in stale:
+            if model in PK_MODELS:
+                tracker.rebuild_model(model, doses)
+        tracker.sync(doses, now)
+        return tracker
@@ -0,0 +1,154 @@
+"""Debounced coordinator refreshes and the startup barrier for Estrannaise.
+
+Every data change (a committed write batch, a clear, an entry added or
+removed) asks for the coordinators to be refreshed.  Those requests come
+in bursts: an automation back-logging a month of doses, or several entries
+set up together.  The scheduler coalesces them into one refresh of every
+coordinator, run REFRESH_DEBOUNCE after the last request of a burst (but
+no later than REFRESH_MAX_DELAY after its first), and never runs two
+refreshes at once; requests arriving during a refresh get one more.
+
+At startup every entry's first refresh would otherwise see a different
+set of entries (and, after its own auto-dose writes, a new data version),
+so each one recomputed the shared model: O(N²) for N entries.  The startup
+barrier holds the first refreshes until every entry known at startup has
+registered its coordinator (or failed before it could), writes all their
+pending changes once, and then lets them through; the first computes the
+shared model and the rest reuse it.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
+from homeassistant.helpers.event import async_call_later
+
+_LOGGER = logging.getLogger(__name__)
+
+# Quiet period that ends a burst of requests (seconds)
+REFRESH_DEBOUNCE = 1.0
+# A steady stream of requests still refreshes this often (seconds)
+REFRESH_MAX_DELAY = 10.0
+# Longest wait for entries that never arrive (failed setup) (seconds)
+STARTUP_BARRIER_TIMEOUT = 30.0
+
+
+class EstrannaisRefreshScheduler:
+    """Coalesces refresh requests into debounced refreshes."""
+
+    def __init__(
+        self, hass: HomeAssistant, refresh: Callable[[], Awaitable[None]]
+    ) -> None:
+        """Initialize the scheduler.
+
+        *refresh* refreshes every coordinator once.
+        """
+        self.hass = hass
+        self._refresh = refresh
+        self._lock = asyncio.Lock()
+        self._unsub: CALLBACK_TYPE | None = None
+        # Loop time of the oldest request not yet served
+        self._first_request: float | None = None
+        self.refresh_count = 0
+
+    @callback
+    def async_schedule(self) -> None:
+        """Request a refresh; it runs once the burst of requests settles."""
+        now = self.hass.loop.time()
+        if self._first_request is None:
+            self._first_request = now
+        delay = min(REFRESH_DEBOUNCE, self._first_request + REFRESH_MAX_DELAY - now)
+        if self._unsub is not None:
+            self._unsub()
+        self._unsub = async_call_later(
+            self.hass, max(delay, 0.0), self._async_scheduled_refresh
+        )
+
+    async def _async_scheduled_refresh(self, _now: Any = None) -> None:
+        """Run the refresh the pending requests asked for."""
+        self._unsub = None
+        await self.async_refresh_now()
+
+    async def async_refresh_now(self) -> None:
+        """Refresh immediately, serving every pending request."""
+        if self._unsub is not None:
+            self._unsub()
+            self._unsub = None
+        self._first_request = None
+        # Requests made while this waits or runs schedule one more refresh
+        async with self._lock:
+            self.refresh_count += 1
+            try:
+                await self._refresh()
+            except Exception:  # noqa: BLE001
+                _LOGGER.exception("Estrannaise coordinator refresh failed")
+
+    def stop(self) -> None:
+        """Cancel a pending refresh."""
+        if self._unsub is not None:
+            self._unsub()
+            self._unsub = None
+        self._first_request = None
+
+
+class EstrannaisStartupBarrier:
+    """Holds first refreshes until every entry known at startup has arrived."""
+
+    def __init__(
+        self,
+        expected: set[str],
+        prepare: Callable[[], Awaitable[None]],
+    ) -> None:
+        """Initialize the barrier.
+
+        *expected*: the config entry ids being set up.  *prepare* runs once
+        when the barrier opens, before any entry passes.
+        """
+        self._expected = set(expected)
+        self._arrived: set[str] = set()
+        self._prepare = prepare
+        self._all_arrived = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self.opened = False
+
+    @callback
+    def async_depart(self, entry_id: str) -> None:
+        """Stop waiting for an entry whose setup failed before it arrived."""
+        self._expected.discard(entry_id)
+        if self._expected <= self._arrived:
+            self._all_arrived.set()
+
+    async def async_arrive(self, entry_id: str) -> bool:
+        """Wait for the barrier to open; False if it already had (a late entry).
+
+        Call once the entry's coordinator is registered.
+        """
+        if self.opened:
+            return False
+        self._arrived.add(entry_id)
+        if self._expected <= self._arrived:
+            self._all_arrived.set()
+        try:
+            async with asyncio.timeout(STARTUP_BARRIER_TIMEOUT):
+                await self._all_arrived.wait()
+        except TimeoutError:
+            _LOGGER.warning(
+                "Estrannaise entries %s did not finish setting up; "
+                "continuing without them",
+                sorted(self._expected - self._arrived),
+            )
+            # Release the other waiters too
+            self._all_arrived.set()
+        async with self._lock:
+            if not self.opened:
+                try:
+                    await self._prepare()
+                except Exception:  # noqa: BLE001
+                    # Each first refresh writes its own changes anyway
+                    _LOGGER.exception("Estrannaise startup preparation failed")
+                self.opened = True
+        return True
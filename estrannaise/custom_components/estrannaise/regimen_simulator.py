@@ -0,0 +1,194 @@
+"""Batch "what-if" regimen simulator for Estrannaise.
+
+Scores a grid of candidate regimens (ester x method x interval x dose) at
+steady state.  Candidates that share a PK model and interval share one
+unit-dose periodic profile: the profile is evaluated once, in closed form,
+over a phase grid, and every dose in the group is a linear scaling of it.
+Trough and peak come from the profile, the average from the exact
+unit-dose AUC, and time in range from the fraction of the grid that falls
+inside the target range.
+"""
+
+from __future__ import annotations
+
+import itertools
+import logging
+from collections.abc import Sequence
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+
+from .const import (
+    ESTER_METHOD_TO_MODEL,
+    ESTERS,
+    METHODS,
+    SUGGESTED_INTERVALS,
+    TARGET_RANGE_LOWER,
+    TARGET_RANGE_UPPER,
+    TARGET_TROUGH,
+    get_dose_units,
+    is_combination_supported,
+    resolve_model_key,
+    round_regimen_dose,
+)
+from .pk import PK_MODELS, pk_amount
+
+if TYPE_CHECKING:
+    from homeassistant.core import HomeAssistant
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_LIMIT = 20
+MAX_CANDIDATES = 5000
+
+# Phase grid: at least _MIN_GRID points per interval, at most _GRID_STEP days apart
+_MIN_GRID = 256
+_MAX_GRID = 4096
+_GRID_STEP = 1.0 / 48.0  # 30 minutes
+
+
+def _phase_grid(interval_days: float) -> np.ndarray:
+    """Uniform phases over one dosing interval (end point excluded)."""
+    n = int(np.clip(np.ceil(interval_days / _GRID_STEP), _MIN_GRID, _MAX_GRID))
+    return np.linspace(0.0, interval_days, n, endpoint=False)
+
+
+def _candidate_groups(
+    esters: Sequence[str],
+    methods: Sequence[str],
+    intervals_days: Sequence[float] | None,
+    doses_mg: Sequence[float] | None,
+    target_trough: float,
+) -> dict[tuple[str, float], list[tuple[str, str, float]]]:
+    """Expand the candidate grid, grouped by (model key, interval).
+
+    Without explicit *intervals_days*, each model's SUGGESTED_INTERVALS are
+    used.  Without explicit *doses_mg*, each candidate gets the rounded dose
+    that reaches *target_trough*, as compute_suggested_regimen does.
+    """
+    groups: dict[tuple[str, float], list[tuple[str, str, float]]] = {}
+    for ester, method in itertools.product(esters, methods):
+        if not is_combination_supported(ester, method):
+            continue
+        if intervals_days:
+            intervals = list(intervals_days)
+        elif ESTER_METHOD_TO_MODEL[(ester, method)] == "patch":
+            # Both wear schedules (twice-weekly and once-weekly)
+            intervals = sorted(
+                {*SUGGESTED_INTERVALS["patch tw"], *SUGGESTED_INTERVALS["patch ow"]}
+            )
+        else:
+            intervals = SUGGESTED_INTERVALS.get(
+                ESTER_METHOD_TO_MODEL[(ester, method)], [7.0]
+            )
+        for interval in intervals:
+            model_key = resolve_model_key(ester, method, interval)
+            pk_model = PK_MODELS.get(model_key)
+            if pk_model is None:
+                continue
+            if doses_mg:
+                doses = list(doses_mg)
+            else:
+                trough = pk_model.periodic_level(0.0, interval)
+                if trough <= 0:
+                    continue
+                doses = [round_regimen_dose(model_key, target_trough / trough)]
+            group = groups.setdefault((model_key, float(interval)), [])
+            group.extend((ester, method, dose) for dose in doses)
+    return groups
+
+
+def simulate_regimens(
+    esters: Sequence[str] | None = None,
+    methods: Sequence[str] | None = None,
+    doses_mg: Sequence[float] | None = None,
+    intervals_days: Sequence[float] | None = None,
+    target_type: str = "target_range",
+    limit: int = DEFAULT_LIMIT,
+) -> dict[str, Any]:
+    """Score every candidate regimen at steady state and rank them.
+
+    Candidates are the supported ester/method pairs in *esters* x *methods*
+    (all by default), each combined with every interval and dose.  Doses
+    are stored units (mg, or mg/day for patches).  Results are ranked by
+    time in the target range (descending), then by distance of the trough
+    from TARGET_TROUGH[*target_type*], and truncated to *limit*.
+
+    Raises ValueError if the grid exceeds MAX_CANDIDATES.
+    """
+    target_trough = TARGET_TROUGH.get(target_type, 200.0)
+    groups = _candidate_groups(
+        esters or list(ESTERS),
+        methods or list(METHODS),
+        intervals_days,
+        doses_mg,
+        target_trough,
+    )
+    n_candidates = sum(len(group) for group in groups.values())
+    if n_candidates > MAX_CANDIDATES:
+        raise ValueError(
+            f"Too many candidate regimens ({n_candidates} > {MAX_CANDIDATES})"
+        )
+
+    rows: list[dict[str, Any]] = []
+    for (model_key, interval), group in groups.items():
+        pk_model = PK_MODELS[model_key]
+        profile = pk_model.periodic_response(_phase_grid(interval), interval)
+        unit_avg = pk_model.auc() / interval
+        amounts = np.array([pk_amount(model_key, dose) for _e, _m, dose in group])
+
+        # (n_doses, n_phases) levels: each dose scales the shared unit profile
+        levels = amounts[:, None] * profile[None, :]
+        in_range = (levels >= TARGET_RANGE_LOWER) & (levels <= TARGET_RANGE_UPPER)
+        troughs = amounts * profile.min()
+        peaks = amounts * profile.max()
+        averages = amounts * unit_avg
+        time_in_range = in_range.mean(axis=1)
+
+        for i, (ester, method, dose) in enumerate(group):
+            rows.append(
+                {
+                    "ester": ester,
+                    "method": method,
+                    "model_key": model_key,
+                    "dose_mg": dose,
+                    "dose_units": get_dose_units(method),
+                    "interval_days": interval,
+                    "doses_per_week": round(7.0 / interval, 2),
+                    "trough_pg_ml": round(float(troughs[i]), 1),
+                    "peak_pg_ml": round(float(peaks[i]), 1),
+                    "average_pg_ml": round(float(averages[i]), 1),
+                    "time_in_range_pct": round(100.0 * float(time_in_range[i]), 1),
+                    "_trough_error": abs(float(troughs[i]) - target_trough),
+                }
+            )
+
+    rows.sort(key=lambda r: (-r["time_in_range_pct"], r["_trough_error"]))
+    ranked = rows[: max(0, limit)]
+    for rank, row in enumerate(ranked, start=1):
+        del row["_trough_error"]
+        row["rank"] = rank
+
+    _LOGGER.debug(
+        "Simulated %d regimens in %d model/interval groups",
+        n_candidates,
+        len(groups),
+    )
+
+    return {
+        "target_type": target_type,
+        "target_trough_pg_ml": target_trough,
+        "range_lower_pg_ml": TARGET_RANGE_LOWER,
+        "range_upper_pg_ml": TARGET_RANGE_UPPER,
+        "evaluated": n_candidates,
+        "regimens": ranked,
+    }
+
+
+async def async_simulate_regimens(
+    hass: HomeAssistant, **kwargs: Any
+) -> dict[str, Any]:
+    """Run simulate_regimens in the executor, off the event loop."""
+    return await hass.async_add_executor_job(
+        lambda: simulate_regimens(**kwargs)
+    )
@@ -0,0 +1,121 @@
+"""Background retention and compaction for the Estrannaise database.
+
+Doses whose contribution has decayed away are moved out of the hot doses
+table into doses_archive, so refreshes only ever read the doses that still
+matter while the long-term history is kept.  Afterwards the file is
+compacted (incremental vacuum plus a WAL checkpoint).  This runs on its own
+schedule, not on every coordinator refresh, and is deferred while writes
+are queued or in progress.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from collections.abc import Callable
+from datetime import timedelta
+from typing import Any, NamedTuple
+
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant
+from homeassistant.helpers.event import (
+    async_call_later,
+    async_track_time_interval,
+)
+
+from .database import CompactionReport, EstrannaisDatabase
+
+_LOGGER = logging.getLogger(__name__)
+
+RETENTION_INTERVAL = timedelta(hours=6)
+# First run after setup, once startup writes have settled
+RETENTION_STARTUP_DELAY = timedelta(minutes=10)
+# Retry delay while the database is busy
+RETENTION_BUSY_RETRY = timedelta(minutes=1)
+
+
+class RetentionReport(NamedTuple):
+    """Outcome of one retention run."""
+
+    finished_at: float
+    archived_doses: int
+    compaction: CompactionReport
+
+
+class EstrannaisRetentionManager:
+    """Archives stale doses and compacts the database on a schedule."""
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        database: EstrannaisDatabase,
+        retention_days: Callable[[], dict[str, float]],
+    ) -> None:
+        """Initialize the manager.
+
+        *retention_days* returns {config entry id: minimum retention in
+        days} for the entries currently loaded.
+        """
+        self.hass = hass
+        self.database = database
+        self._retention_days = retention_days
+        self._unsubs: list[CALLBACK_TYPE] = []
+        self._retry_unsub: CALLBACK_TYPE | None = None
+        self.last_report: RetentionReport | None = None
+
+    def start(self) -> None:
+        """Schedule the startup run and the periodic runs."""
+        self._unsubs.append(
+            async_call_later(
+                self.hass, RETENTION_STARTUP_DELAY, self._async_scheduled_run
+            )
+        )
+        self._unsubs.append(
+            async_track_time_interval(
+                self.hass, self._async_scheduled_run, RETENTION_INTERVAL
+            )
+        )
+
+    def stop(self) -> None:
+        """Cancel every scheduled run."""
+        for unsub in self._unsubs:
+            unsub()
+        self._unsubs.clear()
+        if self._retry_unsub is not None:
+            self._retry_unsub()
+            self._retry_unsub = None
+
+    async def _async_scheduled_run(self, _now: Any = None) -> None:
+        """Run now if the database is idle, otherwise retry shortly."""
+        if self._retry_unsub is not None:
+            self._retry_unsub()
+            self._retry_unsub = None
+        if not self.database.is_idle:
+            self._retry_unsub = async_call_later(
+                self.hass, RETENTION_BUSY_RETRY, self._async_scheduled_run
+            )
+            return
+        try:
+            await self.async_run()
+        except Exception:  # noqa: BLE001
+            _LOGGER.exception("Estrannaise database maintenance failed")
+
+    async def async_run(self) -> RetentionReport:
+        """Archive stale doses, then compact the database file."""
+        archived = await self.database.archive_stale_doses(self._retention_days())
+        compaction = await self.database.async_compact()
+        report = RetentionReport(
+            finished_at=time.time(),
+            archived_doses=archived,
+            compaction=compaction,
+        )
+        self.last_report = report
+        _LOGGER.info(
+            "Estrannaise database maintenance: archived %d doses, reclaimed "
+            "%d bytes (+%d bytes of WAL)%s, database is now %d bytes",
+            archived,
+            compaction.reclaimed_bytes,
+            compaction.wal_bytes_reclaimed,
+            " with a one-time full VACUUM" if compaction.full_vacuum else "",
+            compaction.database_bytes,
+        )
+        return report
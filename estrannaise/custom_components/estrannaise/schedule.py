@@ -0,0 +1,203 @@
+"""Recurring dose schedules for Estrannaise.
+
+An automatic entry doses every interval_days at its local dose_time, or
+follows the schedules of its suggested regimen (a cycle fit anchors each
+schedule to a day of the 28-day cycle).  get_dose_schedule resolves that
+once into arithmetic series; the projected auto doses, the persisted past
+automatic doses and the calendar all enumerate their windows from the
+same series, so they agree on every dose time.  A schedule depends only
+on the config and the local date, and is cached on both.
+"""
+
+from __future__ import annotations
+
+import datetime as _dt
+import functools
+import math
+from typing import Any, NamedTuple
+
+from .const import (
+    MODE_AUTOMATIC,
+    MODE_BOTH,
+    compute_suggested_regimen,
+    resolve_model_key,
+)
+
+CYCLE_DAYS = 28
+
+# Config fields a schedule depends on (the cache key)
+_SCHEDULE_KEYS = (
+    "mode",
+    "ester",
+    "method",
+    "dose_mg",
+    "interval_days",
+    "dose_time",
+    "auto_regimen",
+    "target_type",
+    "phase_days",
+)
+
+
+class DoseSeries(NamedTuple):
+    """Doses of dose_mg at anchor_ts + k * interval_sec, for every integer k."""
+
+    anchor_ts: float
+    interval_sec: float
+    dose_mg: float
+    model_key: str
+
+    def index_range(self, after: float, until: float) -> tuple[int, int]:
+        """Return the first and last k with after < t_k <= until.
+
+        t_k = anchor_ts + k * interval_sec; last < first when the window
+        holds no dose.
+        """
+        anchor, step = self.anchor_ts, self.interval_sec
+        first = math.floor((after - anchor) / step) + 1
+        # The division can round across a boundary; settle on the exact
+        # products, which are what times() returns
+        while anchor + (first - 1) * step > after:
+            first -= 1
+        while anchor + first * step <= after:
+            first += 1
+        last = math.floor((until - anchor) / step)
+        while anchor + last * step > until:
+            last -= 1
+        while anchor + (last + 1) * step <= until:
+            last += 1
+        return first, last
+
+    def times(self, after: float, until: float) -> list[float]:
+        """Return the dose times t with after < t <= until, ascending.
+
+        Consecutive windows (a, b], (b, c] partition the series exactly.
+        """
+        first, last = self.index_range(after, until)
+        anchor, step = self.anchor_ts, self.interval_sec
+        return [anchor + k * step for k in range(first, last + 1)]
+
+
+class ProjectedSeries(NamedTuple):
+    """The doses of *series* in (after, until], kept symbolic.
+
+    Stands in for the dose records of a projection window: the PK engine
+    sums it in closed form (see pk.evaluate_e2), and only consumers that
+    need individual doses expand it.  *ester* and *method* are the entry's,
+    for labelling (the calendar).
+    """
+
+    series: DoseSeries
+    after: float
+    until: float
+    ester: str = ""
+    method: str = ""
+
+    def times(self) -> list[float]:
+        """Return the dose times, ascending."""
+        return self.series.times(self.after, self.until)
+
+    def first_time(self) -> float | None:
+        """Return the first dose time, or None if the window is empty."""
+        first, last = self.series.index_range(self.after, self.until)
+        if last < first:
+            return None
+        return self.series.anchor_ts + first * self.series.interval_sec
+
+
+class DoseSchedule(NamedTuple):
+    """An entry's recurring doses (no series unless it doses automatically)."""
+
+    ester: str
+    method: str
+    series: tuple[DoseSeries, ...]
+
+
+def parse_dose_time(value: Any) -> tuple[int, int]:
+    """Parse "HH:MM" (or "HH") into a clamped (hour, minute); 08:00 if invalid."""
+    try:
+        parts = value.split(":")
+        hour = int(parts[0])
+        minute = int(parts[1]) if len(parts) > 1 else 0
+    except (AttributeError, ValueError, IndexError):
+        hour, minute = 8, 0
+    return max(0, min(23, hour)), max(0, min(59, minute))
+
+
+def get_dose_schedule(
+    config: dict[str, Any], now: float, local_tz: _dt.tzinfo
+) -> DoseSchedule:
+    """Return the (cached) dose schedule of *config* on *now*'s local date."""
+    day = _dt.datetime.fromtimestamp(now, tz=local_tz).date()
+    return _build_schedule(
+        tuple(config.get(key) for key in _SCHEDULE_KEYS), day, local_tz
+    )
+
+
+@functools.lru_cache(maxsize=64)
+def _build_schedule(
+    values: tuple[Any, ...], day: _dt.date, local_tz: _dt.tzinfo
+) -> DoseSchedule:
+    """Resolve a config's schedule for one local date."""
+    cfg = dict(zip(_SCHEDULE_KEYS, values))
+    ester = cfg["ester"] or ""
+    method = cfg["method"] or "im"
+    if cfg["mode"] not in (MODE_AUTOMATIC, MODE_BOTH):
+        return DoseSchedule(ester, method, ())
+
+    # (dose_mg, interval_days, model key or None, cycle day or None)
+    plan: list[tuple[float, float, str | None, int | None]] = []
+    if cfg["auto_regimen"]:
+        suggested = compute_suggested_regimen(
+            ester, method, cfg["target_type"] or "target_range"
+        )
+        if suggested and "schedules" in suggested:
+            # Cycle fit: every schedule keeps its place in the cycle
+            plan = [
+                (
+                    sch["dose_mg"],
+                    sch["interval_days"],
+                    sch.get("model_key"),
+                    int(sch.get("phase_days", 0)),
+                )
+                for sch in suggested["schedules"]
+            ]
+        elif suggested:
+            plan = [(
+                suggested["dose_mg"],
+                suggested["interval_days"],
+                suggested.get("model_key"),
+                None,
+            )]
+    if not plan:
+        phase_days = cfg["phase_days"] or 0
+        plan = [(
+            cfg["dose_mg"] or 0,
+            cfg["interval_days"] or 0,
+            None,
+            int(phase_days) if phase_days > 0 else None,
+        )]
+
+    # Today's dose time in the local timezone (→ UTC timestamp), and the
+    # local day's position in the cycle
+    hour, minute = parse_dose_time(cfg["dose_time"] or "08:00")
+    midnight = _dt.datetime(day.year, day.month, day.day, tzinfo=local_tz)
+    today_dose_ts = midnight.replace(hour=hour, minute=minute).timestamp()
+    cycle_day_now = int(midnight.timestamp() // 86400) % CYCLE_DAYS
+
+    series: list[DoseSeries] = []
+    for dose_mg, interval_days, model_key, cycle_day in plan:
+        if interval_days <= 0:
+            continue
+        model_key = model_key or resolve_model_key(ester, method, interval_days)
+        if not model_key:
+            continue
+        anchor_ts = today_dose_ts
+        if cycle_day is not None:
+            # Most recent local day at that point of the cycle
+            days_back = (cycle_day_now - cycle_day) % CYCLE_DAYS
+            anchor_ts -= days_back * 86400.0
+        series.append(
+            DoseSeries(anchor_ts, interval_days * 86400.0, dose_mg, model_key)
+        )
+    return DoseSchedule(ester, method, tuple(series))
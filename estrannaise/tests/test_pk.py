@@ -0,0 +1,61 @@
+"""Tests pinning the compiled PK models to the scalar reference curves.
+
+pk.PKModel evaluates every model from its exponential-term decomposition;
+e2_curve_3c and e2_patch_3c in const.py are the closed forms it replaces.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from custom_components.estrannaise.const import (
+    PATCH_WEAR_DAYS,
+    PK_PARAMETERS,
+    e2_curve_3c,
+    e2_patch_3c,
+)
+from custom_components.estrannaise.pk import PK_MODELS, PKModel
+
+# Elapsed days, dense early on and across patch removal
+TIMES = [0.0, 0.01, 0.5, 1.0, 2.0, 3.4, 3.5, 3.6, 5.0, 6.99, 7.0, 7.01, 10.0,
+         14.0, 21.0, 30.0, 60.0, 120.0]
+
+# Rates hitting each closed-form branch of e2_curve_3c
+BRANCH_PARAMS = {
+    "distinct": (100.0, 0.5, 0.2, 0.9),
+    "equal": (100.0, 0.4, 0.4, 0.4),
+    "k1=k2": (100.0, 0.4, 0.4, 0.9),
+    "k1=k3": (100.0, 0.4, 0.2, 0.4),
+    "k2=k3": (100.0, 0.5, 0.3, 0.3),
+}
+
+
+def _reference(key: str, params, t: float) -> float:
+    """Unit-dose level from the scalar reference curves."""
+    w = PATCH_WEAR_DAYS.get(key)
+    if w is not None:
+        return e2_patch_3c(t, 1.0, *params, w)
+    return e2_curve_3c(t, 1.0, *params)
+
+
+@pytest.mark.parametrize("key", sorted(PK_PARAMETERS))
+def test_models_match_reference(key):
+    """Each compiled model reproduces its reference curve, scalar and batched."""
+    model = PK_MODELS[key]
+    expected = [_reference(key, PK_PARAMETERS[key], t) for t in TIMES]
+    assert [model.level(t) for t in TIMES] == pytest.approx(expected, rel=1e-9)
+    assert model.response(np.array(TIMES)).tolist() == pytest.approx(
+        expected, rel=1e-9
+    )
+
+
+@pytest.mark.parametrize(("branch", "params"), sorted(BRANCH_PARAMS.items()))
+def test_branches_match_reference(branch, params):
+    """The term decomposition follows e2_curve_3c's equal-rate branches."""
+    model = PKModel("branch test", params)
+    assert model.branch == branch
+    expected = [e2_curve_3c(t, 1.0, *params) for t in TIMES]
+    assert [model.level(t) for t in TIMES] == pytest.approx(
+        expected, rel=1e-9, abs=1e-12
+    )
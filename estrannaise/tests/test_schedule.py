@@ -0,0 +1,275 @@
+"""Property tests for the shared dose schedule engine.
+
+The projected auto doses, the persisted past automatic doses and the
+calendar all enumerate their windows from one arithmetic DoseSeries.
+These tests check the series against a step-by-step walk, across DST
+changes and cycle-day anchoring, and check that the three views agree.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import datetime as dt
+import random
+from zoneinfo import ZoneInfo
+
+import pytest
+from homeassistant.util import dt as dt_util
+
+from custom_components.estrannaise.calendar import _EventStore, _scheduled_doses
+from custom_components.estrannaise.coordinator import EstrannaisCoordinator
+from custom_components.estrannaise.pipeline import project_auto_schedules
+from custom_components.estrannaise.schedule import (
+    CYCLE_DAYS,
+    DoseSeries,
+    ProjectedSeries,
+    get_dose_schedule,
+)
+
+DAY = 86400.0
+
+# Days on which the local clock changes, and the day after
+DST_DAYS = [
+    ("Europe/Berlin", dt.date(2026, 3, 29)),
+    ("Europe/Berlin", dt.date(2026, 10, 25)),
+    ("America/New_York", dt.date(2026, 3, 8)),
+    ("America/New_York", dt.date(2026, 11, 1)),
+    ("Pacific/Auckland", dt.date(2026, 4, 5)),
+    ("Pacific/Auckland", dt.date(2026, 9, 27)),
+]
+
+
+def _walk(series: DoseSeries, after: float, until: float) -> list[float]:
+    """Reference enumeration: step k from the anchor one dose at a time."""
+    anchor, step = series.anchor_ts, series.interval_sec
+    k = 0
+    while anchor + k * step > after:
+        k -= 1
+    while anchor + k * step <= after:
+        k += 1
+    times = []
+    while anchor + k * step <= until:
+        times.append(anchor + k * step)
+        k += 1
+    return times
+
+
+def _random_windows(seed: int, count: int) -> list[tuple[DoseSeries, float, float]]:
+    """Random series with windows, a fifth of them bounded by dose times."""
+    rng = random.Random(seed)
+    cases = []
+    for _ in range(count):
+        interval = rng.choice([0.25, 1.0, 3.5, 5.0, 7.0, 10.0, 14.0, 27.3]) * DAY
+        anchor = 1.7e9 + rng.uniform(-400, 400) * DAY
+        series = DoseSeries(anchor, interval, 4.0, "EV im")
+        after = anchor + rng.uniform(-200, 200) * DAY
+        until = after + rng.uniform(0, 120) * DAY
+        if rng.random() < 0.2:
+            k = rng.randint(-50, 50)
+            after = anchor + k * interval
+            until = anchor + (k + rng.randint(0, 30)) * interval
+        cases.append((series, after, until))
+    return cases
+
+
+def _config(**overrides) -> dict:
+    """An automatic entry config."""
+    config = {
+        "mode": "automatic",
+        "ester": "EV",
+        "method": "im",
+        "dose_mg": 4.0,
+        "interval_days": 7.0,
+        "dose_time": "08:00",
+        "auto_regimen": False,
+        "target_type": "target_range",
+        "phase_days": 0,
+        "backfill_doses": True,
+    }
+    config.update(overrides)
+    return config
+
+
+@pytest.fixture
+def local_tz():
+    """Set Home Assistant's default time zone for a test, then restore it."""
+    original = dt_util.DEFAULT_TIME_ZONE
+
+    def _set(name: str) -> dt.tzinfo:
+        tz = ZoneInfo(name)
+        dt_util.set_default_time_zone(tz)
+        return tz
+
+    yield _set
+    dt_util.set_default_time_zone(original)
+
+
+# ── Series arithmetic ────────────────────────────────────────────────────────
+
+
+@pytest.mark.parametrize(("series", "after", "until"), _random_windows(1, 300))
+def test_times_match_step_walk(series, after, until):
+    """times(after, until] is exactly the step-by-step enumeration."""
+    assert series.times(after, until) == _walk(series, after, until)
+
+
+@pytest.mark.parametrize(("series", "after", "until"), _random_windows(2, 200))
+def test_windows_partition_the_series(series, after, until):
+    """Consecutive windows (a, b], (b, c] neither drop nor repeat a dose."""
+    cuts = [after + (until - after) * random.Random(after).random()]
+    # Cutting exactly at a dose time too
+    cuts += series.times(after, until)[:1]
+    for cut in cuts:
+        assert (
+            series.times(after, cut) + series.times(cut, until)
+            == series.times(after, until)
+        )
+
+
+@pytest.mark.parametrize(("series", "after", "until"), _random_windows(3, 200))
+def test_projected_first_time(series, after, until):
+    """first_time is the first of times(), or None for an empty window."""
+    run = ProjectedSeries(series, after, until)
+    times = run.times()
+    assert run.first_time() == (times[0] if times else None)
+
+
+# ── Local dose time and DST ──────────────────────────────────────────────────
+
+
+@pytest.mark.parametrize(("zone", "day"), DST_DAYS)
+@pytest.mark.parametrize("offset", [-1, 0, 1])
+@pytest.mark.parametrize("interval_days", [1.0, 3.5, 7.0])
+def test_anchor_at_local_dose_time_across_dst(zone, day, offset, interval_days):
+    """Each local day's schedule has a dose at that day's local dose time."""
+    tz = ZoneInfo(zone)
+    day = day + dt.timedelta(days=offset)
+    now = dt.datetime(day.year, day.month, day.day, 12, 0, tzinfo=tz).timestamp()
+    (series,) = get_dose_schedule(
+        _config(interval_days=interval_days), now, tz
+    ).series
+    local = dt.datetime.fromtimestamp(series.anchor_ts, tz)
+    assert (local.date(), local.hour, local.minute) == (day, 8, 0)
+    # Enumeration across the clock change is still the plain walk
+    window = (now - 30 * DAY, now + 30 * DAY)
+    assert series.times(*window) == _walk(series, *window)
+
+
+@pytest.mark.parametrize(("zone", "day"), DST_DAYS)
+def test_nonexistent_dose_time_stays_on_its_day(zone, day):
+    """A dose time skipped by the clock change still doses on that day."""
+    tz = ZoneInfo(zone)
+    now = dt.datetime(day.year, day.month, day.day, 12, 0, tzinfo=tz).timestamp()
+    (series,) = get_dose_schedule(
+        _config(interval_days=1.0, dose_time="02:30"), now, tz
+    ).series
+    assert dt.datetime.fromtimestamp(series.anchor_ts, tz).date() == day
+
+
+# ── Cycle-day anchoring ──────────────────────────────────────────────────────
+
+
+@pytest.mark.parametrize("phase_days", [1, 5, 13, 27])
+@pytest.mark.parametrize("interval_days", [7.0, 14.0, 28.0])
+def test_phase_anchors_to_cycle_day(phase_days, interval_days):
+    """A phased schedule doses on its cycle day, whatever day it is built on."""
+    tz = dt.timezone.utc
+    start = dt.datetime(2026, 1, 1, 12, 0, tzinfo=tz).timestamp()
+    config = _config(interval_days=interval_days, phase_days=phase_days)
+    window = (start + 40 * DAY, start + 120 * DAY)
+    expected = None
+    for day in range(CYCLE_DAYS * 2):
+        now = start + day * DAY
+        (series,) = get_dose_schedule(config, now, tz).series
+        today_dose = now - 4 * 3600.0  # 08:00 UTC
+        assert today_dose - CYCLE_DAYS * DAY < series.anchor_ts <= today_dose
+        # At the dose time, on a day at the configured point of the cycle
+        assert series.anchor_ts % DAY == 8 * 3600.0
+        assert int(series.anchor_ts // DAY) % CYCLE_DAYS == phase_days
+        # The interval divides the cycle, so every day sees the same doses
+        times = series.times(*window)
+        if expected is None:
+            expected = times
+        assert times == expected
+
+
+# ── Projection, persistence and calendar agree ───────────────────────────────
+
+
+class _RecordingDatabase:
+    """Database double that records the automatic doses written to it."""
+
+    data_version = 0
+
+    def __init__(self) -> None:
+        self.written: list[tuple[str, float, float]] = []
+
+    async def get_auto_dose_timestamps(self, config_entry_id: str) -> list[float]:
+        return []
+
+    async def add_auto_doses(self, config_entry_id, doses) -> int:
+        self.written.extend(doses)
+        return len(doses)
+
+
+class _Entry:
+    entry_id = "entry"
+
+
+def _persisted(config: dict, now: float) -> list[tuple[float, str, float]]:
+    """Doses EstrannaisCoordinator._persist_auto_doses writes at *now*."""
+    coordinator = object.__new__(EstrannaisCoordinator)
+    coordinator.config_entry = _Entry()
+    coordinator.database = _RecordingDatabase()
+    coordinator._auto_ts_cache = None
+    asyncio.run(coordinator._persist_auto_doses(config, now))
+    return sorted(
+        (ts, model, dose_mg) for model, dose_mg, ts in coordinator.database.written
+    )
+
+
+VIEW_CONFIGS = [
+    _config(),
+    _config(ester="EEn", interval_days=5.0, dose_time="23:30"),
+    _config(interval_days=3.5, dose_time="00:15", phase_days=6),
+    _config(ester="EC", auto_regimen=True),
+    _config(mode="both", ester="EB", interval_days=1.0, dose_time="02:30"),
+]
+
+
+@pytest.mark.parametrize("config", VIEW_CONFIGS)
+@pytest.mark.parametrize(("zone", "day"), DST_DAYS[:4])
+@pytest.mark.parametrize("hour", [1.5, 8.0, 20.0])
+def test_views_agree(local_tz, config, zone, day, hour):
+    """Persisted, projected and calendar doses are the one schedule's windows."""
+    tz = local_tz(zone)
+    midnight = dt.datetime(day.year, day.month, day.day, tzinfo=tz).timestamp()
+    now = midnight + hour * 3600.0
+    schedule = get_dose_schedule(config, now, tz)
+    assert schedule.series
+
+    def window(after: float, until: float) -> list[tuple[float, str, float]]:
+        return sorted(
+            (ts, series.model_key, series.dose_mg)
+            for series in schedule.series
+            for ts in series.times(after, until)
+        )
+
+    # Persistence: the backfill window up to and including now
+    assert _persisted(config, now) == window(now - 90 * DAY, now)
+
+    # Projection: everything after now, for the same 90 days
+    runs = project_auto_schedules(config, now, tz)
+    projected = sorted(
+        (ts, run.series.model_key, run.series.dose_mg)
+        for run in runs
+        for ts in run.times()
+    )
+    assert projected == window(now, now + 90 * DAY)
+
+    # Calendar: the projected runs' events (single series, no merging)
+    store = _EventStore([], _scheduled_doses(runs), now)
+    events = store.events_between(now + 900.0, now + 30 * DAY)
+    assert [event.start.timestamp() for event in events] == [
+        ts for ts, _model, _dose in window(now, now + 30 * DAY)
+    ]